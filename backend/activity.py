@@ -0,0 +1,191 @@
+"""Append-only activity log behind /admin/recent-activities.
+
+Every mutating API route and the bot's /start append one compact event to
+the capped ``activity_events`` collection. Recent activity is then a single
+read on the timestamp index, and the log can be followed with a tailable
+cursor (``python activity.py tail``).
+
+Run ``python activity.py backfill`` once to seed the log from the raw
+collections for activity that happened before it existed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from pymongo import CursorType, InsertOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+import live
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "activity_events"
+# Capped by size; the oldest events are dropped first
+ACTIVITY_LOG_SIZE_BYTES = int(os.environ.get('ACTIVITY_LOG_SIZE_BYTES', str(64 * 1024 * 1024)))
+
+EVENT_PROJECTION = {"_id": 0}
+
+
+def _username(doc):
+    return (doc or {}).get('username') or 'Unknown'
+
+
+def event(type, telegram_id, username, description, timestamp=None, **data):
+    doc = {
+        "type": type,
+        "telegram_id": telegram_id,
+        "username": username,
+        "timestamp": timestamp or datetime.now(timezone.utc).isoformat(),
+        "description": description,
+    }
+    doc.update(data)
+    return doc
+
+
+async def ensure_activity_log(db, size=ACTIVITY_LOG_SIZE_BYTES):
+    """Create the capped collection, or convert one created uncapped"""
+    try:
+        await db.create_collection(COLLECTION, capped=True, size=size)
+        logger.info(f"Created capped collection {COLLECTION} ({size} bytes)")
+        return
+    except CollectionInvalid:
+        pass
+    if (await db[COLLECTION].options()).get('capped'):
+        return
+    # Created plain by an insert or index build before this ran; it would grow
+    # without bound and the tail command needs a capped collection
+    try:
+        await db.command("convertToCapped", COLLECTION, size=size)
+        logger.warning(f"Converted {COLLECTION} to a capped collection ({size} bytes)")
+    except OperationFailure as e:
+        logger.error(f"{COLLECTION} is not capped and could not be converted: {e}. "
+                     f"Run convertToCapped on it by hand")
+
+
+async def record(db, type, telegram_id, username, description, **data):
+    """Append one event; failures are logged and never fail the caller"""
+    doc = event(type, telegram_id, username, description, **data)
+    try:
+        await db[COLLECTION].insert_one(doc)
+    except Exception as e:
+        logger.error(f"Activity event {type} not recorded: {e}")
+        return None
+    doc.pop('_id', None)
+    live.publish_activity(doc)
+    return doc
+
+
+async def record_many(db, docs):
+    """Append events built with ``event`` in one unordered insert; never fails the caller"""
+    if not docs:
+        return
+    try:
+        await db[COLLECTION].insert_many(docs, ordered=False)
+    except Exception as e:
+        logger.error(f"{len(docs)} activity events not all recorded: {e}")
+    for doc in docs:
+        doc.pop('_id', None)
+        live.publish_activity(doc)
+
+
+async def recent(db, limit=50, before=None):
+    """Newest events first; ``before`` is an ISO timestamp for paging back"""
+    query = {"timestamp": {"$lt": before}} if before else {}
+    return await db[COLLECTION].find(query, EVENT_PROJECTION).sort("timestamp", -1).limit(limit).to_list(limit)
+
+
+async def tail(db):
+    """Yield events as they are appended, starting after the current newest one"""
+    last = await db[COLLECTION].find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+    query = {"_id": {"$gt": last['_id']}} if last else {}
+    while True:
+        cursor = db[COLLECTION].find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            async for doc in cursor:
+                query = {"_id": {"$gt": doc['_id']}}
+                doc.pop('_id')
+                yield doc
+        # The cursor dies if the collection was empty; retry shortly
+        await asyncio.sleep(1)
+
+
+# Events recoverable from the raw collections, for seeding the log
+
+async def _backfill_events(db):
+    usernames = {}
+    async for user in db.users.find({}, {"_id": 0, "telegram_id": 1, "username": 1, "join_date": 1, "referred_by": 1}):
+        usernames[user['telegram_id']] = user['username']
+        yield event("user_joined", user['telegram_id'], user['username'],
+                    f"@{user['username']} joined the event", timestamp=user['join_date'],
+                    referred_by=user.get('referred_by'))
+
+    tasks = {t['task_id']: t async for t in db.tasks.find({}, {"_id": 0, "task_id": 1, "title": 1, "reward_points": 1})}
+    async for completion in db.task_completions.find({}, {"_id": 0}):
+        task = tasks.get(completion['task_id'])
+        if not task:
+            continue
+        username = usernames.get(completion['user_id']) or 'Unknown'
+        yield event("task_completed", completion['user_id'], username,
+                    f"@{username} completed '{task['title']}' (+{task['reward_points']} pts)",
+                    timestamp=completion['completed_at'], task_id=task['task_id'], points=task['reward_points'])
+
+    async for withdrawal in db.withdrawals.find({}, {"_id": 0}):
+        username = _username(withdrawal)
+        yield event("withdrawal", withdrawal['user_id'], username,
+                    f"@{username} requested {withdrawal['amount']} pts withdrawal",
+                    timestamp=withdrawal['timestamp'], withdrawal_id=withdrawal['withdrawal_id'],
+                    amount=withdrawal['amount'])
+
+    # Only the latest check-in per user survives in the raw data
+    async for user in db.users.find({"last_checkin": {"$ne": None}},
+                                    {"_id": 0, "telegram_id": 1, "username": 1, "last_checkin": 1, "streak_day": 1}):
+        yield event("checkin", user['telegram_id'], user['username'],
+                    f"@{user['username']} checked in (Day {user['streak_day']} streak)",
+                    timestamp=user['last_checkin'], streak_day=user['streak_day'])
+
+
+async def backfill(db, batch_size=1000):
+    """Seed the log from the raw collections, oldest first; returns the count"""
+    if await db[COLLECTION].estimated_document_count():
+        raise RuntimeError(f"{COLLECTION} is not empty; refusing to backfill twice")
+    events = [e async for e in _backfill_events(db)]
+    # Insertion order is what a tailable cursor sees, so keep it chronological
+    events.sort(key=lambda e: e['timestamp'] or '')
+    for start in range(0, len(events), batch_size):
+        await db[COLLECTION].bulk_write([InsertOne(e) for e in events[start:start + batch_size]])
+    logger.info(f"Backfilled {len(events)} activity events")
+    return len(events)
+
+
+def main():
+    import repository
+
+    parser = argparse.ArgumentParser(description="Backfill or follow the activity log")
+    parser.add_argument("command", choices=["backfill", "tail"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = repository.db
+
+    async def run():
+        await ensure_activity_log(db)
+        if args.command == "backfill":
+            await backfill(db)
+            return 0
+        async for doc in tail(db):
+            print(f"{doc['timestamp']} {doc['type']:<20} {doc['description']}", flush=True)
+        return 0
+
+    try:
+        sys.exit(asyncio.run(run()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        repository.close()
+
+
+if __name__ == '__main__':
+    main()
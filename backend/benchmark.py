@@ -0,0 +1,360 @@
+"""Load benchmark for the API against a local MongoDB.
+
+Seeds a synthetic dataset into its own database, drives a weighted mix of
+user and admin endpoints with concurrent clients, and reports throughput
+plus p50/p95/p99 latency per route. Results are written as JSON so runs can
+be compared between commits.
+
+    MONGO_URL=mongodb://localhost:27017 python benchmark.py --seed --users 20000 --output before.json
+    python benchmark.py --url http://localhost:8001 --duration 60 --output after.json
+
+By default the app runs in-process (``server.app`` over httpx's ASGI
+transport, startup hooks included); ``--url`` targets a running server that
+must share JWT_SECRET and the database. The database is BENCH_DB_NAME
+(hbd_speedy_bench), never DB_NAME, and ``--seed`` refuses to touch a
+non-empty one without ``--reset``.
+
+Writes go through the per-user rate limiter, so limited requests show up as
+429s in the status counts; raise RATE_LIMIT_* to measure the routes
+themselves.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Point the app at the benchmark database before anything imports repository
+BENCH_DB_NAME = os.environ.get('BENCH_DB_NAME', 'hbd_speedy_bench')
+os.environ['DB_NAME'] = BENCH_DB_NAME
+
+import httpx  # noqa: E402
+from pymongo import InsertOne, UpdateOne  # noqa: E402
+
+SEED_BATCH_SIZE = 1000
+
+
+# Synthetic data
+
+def _points(rng):
+    # Long-tailed like real balances: most users near the join bonus, a few far ahead
+    return int(rng.lognormvariate(7.5, 1.2))
+
+
+def _timestamp(rng, start, days):
+    return (start + timedelta(seconds=rng.uniform(0, days * 86400))).isoformat()
+
+
+def generate_dataset(scale, seed=0):
+    """Yield (collection, document) pairs for a dataset of ``scale['users']`` users"""
+    import repository
+
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(days=scale['days'])
+    first_id = 100000000
+
+    task_ids = []
+    for n in range(scale['tasks']):
+        task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        task_ids.append(task_id)
+        yield "tasks", {
+            "task_id": task_id,
+            "title": f"Benchmark task {n}",
+            "description": "Synthetic task",
+            "type": rng.choice(["youtube", "telegram", "twitter"]),
+            "url": f"https://example.com/{n}",
+            "reward_points": rng.choice([100, 200, 500, 1000]),
+            "active": n < scale['tasks'] * 0.8,
+            "created_at": _timestamp(rng, start, scale['days']),
+        }
+
+    for n in range(scale['users']):
+        telegram_id = first_id + n
+        # Earlier users are more likely to have referred later ones
+        referred_by = first_id + int(rng.random() ** 2 * n) if n and rng.random() < scale['referral_rate'] else None
+        user = repository.new_user_doc(telegram_id, f"bench_{n}", referred_by)
+        completed = rng.sample(task_ids, min(len(task_ids), int(rng.expovariate(1 / scale['completions_per_user']))))
+        user.update({
+            "points": _points(rng),
+            "join_date": _timestamp(rng, start, scale['days']),
+            "streak_day": rng.randint(0, 8),
+            "last_checkin": _timestamp(rng, start, scale['days']) if rng.random() < 0.7 else None,
+            "join_bonus_claimed": rng.random() < 0.9,
+            "tasks_completed": len(completed),
+        })
+        for task_id in completed:
+            yield "task_completions", {
+                "user_id": telegram_id,
+                "task_id": task_id,
+                "completed_at": _timestamp(rng, start, scale['days']),
+            }
+        if rng.random() < scale['withdrawal_rate']:
+            amount = max(1, user['points'] // 2)
+            status = rng.choice(["pending", "approved", "approved", "rejected"])
+            user['withdrawal_count'] = 1
+            yield "withdrawals", {
+                "withdrawal_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "user_id": telegram_id,
+                "username": user['username'],
+                "amount": amount,
+                "status": status,
+                "timestamp": _timestamp(rng, start, scale['days']),
+                "admin_note": None if status == "pending" else status.capitalize(),
+                "reserved": False,
+            }
+        yield "users", user
+
+
+async def count_referrals(db):
+    """Set each referrer's referral_count from the generated referred_by edges"""
+    pipeline = [
+        {"$match": {"referred_by": {"$ne": None}}},
+        {"$group": {"_id": "$referred_by", "count": {"$sum": 1}}},
+    ]
+    ops = [UpdateOne({"telegram_id": row['_id']}, {"$set": {"referral_count": row['count']}})
+           async for row in db.users.aggregate(pipeline)]
+    for start in range(0, len(ops), SEED_BATCH_SIZE):
+        await db.users.bulk_write(ops[start:start + SEED_BATCH_SIZE], ordered=False)
+
+
+async def seed(db, scale, reset=False, seed_value=0):
+    """Load the synthetic dataset and rebuild everything derived from it"""
+    import activity
+    import counters
+    import indexes
+    import referrals
+
+    existing = await db.list_collection_names()
+    if existing and not reset:
+        raise SystemExit(f"Database {db.name} is not empty; pass --reset to drop it and reseed")
+    for name in existing:
+        await db.drop_collection(name)
+
+    await indexes.ensure_indexes(db)
+    batches, counts = {}, {}
+    for collection, doc in generate_dataset(scale, seed_value):
+        batch = batches.setdefault(collection, [])
+        batch.append(InsertOne(doc))
+        counts[collection] = counts.get(collection, 0) + 1
+        if len(batch) >= SEED_BATCH_SIZE:
+            await db[collection].bulk_write(batch, ordered=False)
+            batch.clear()
+    for collection, batch in batches.items():
+        if batch:
+            await db[collection].bulk_write(batch, ordered=False)
+
+    # The API counts a referral as the user joins; the bulk insert skipped that
+    await count_referrals(db)
+    await counters.rebuild_counters(db)
+    await referrals.rebuild_graph(db)
+    await activity.backfill(db)
+    print(f"Seeded {db.name}: " + ", ".join(f"{n} {c}" for c, n in sorted(counts.items())), flush=True)
+    return counts
+
+
+# Load generation
+
+# (name, weight, method, path for a user id, admin)
+ROUTE_MIX = [
+    ("GET /bootstrap", 20, "GET", lambda uid: "/bootstrap", False),
+    ("GET /user/profile", 10, "GET", lambda uid: "/user/profile", False),
+    ("GET /settings", 10, "GET", lambda uid: "/settings", False),
+    ("GET /tasks/list", 10, "GET", lambda uid: "/tasks/list", False),
+    ("GET /user/referral-stats", 5, "GET", lambda uid: "/user/referral-stats", False),
+    ("GET /leaderboard", 10, "GET", lambda uid: "/leaderboard", False),
+    ("GET /leaderboard/me", 8, "GET", lambda uid: "/leaderboard/me", False),
+    ("GET /withdrawal/my-requests", 4, "GET", lambda uid: "/withdrawal/my-requests", False),
+    ("POST /user/checkin", 5, "POST", lambda uid: "/user/checkin", False),
+    ("GET /admin/stats", 2, "GET", lambda uid: "/admin/stats", True),
+    ("GET /admin/users", 2, "GET", lambda uid: "/admin/users?limit=100", True),
+    ("GET /admin/users/{id}", 2, "GET", lambda uid: f"/admin/users/{uid}", True),
+    ("GET /admin/withdrawals", 2, "GET", lambda uid: "/admin/withdrawals?limit=100", True),
+    ("GET /admin/recent-activities", 2, "GET", lambda uid: "/admin/recent-activities", True),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, rank - 1)]
+
+
+async def run_load(client, user_ids, concurrency, duration, requests_limit=None):
+    """Drive the route mix from ``concurrency`` workers; returns per-route samples"""
+    import server
+
+    tokens = {uid: server.create_jwt_token({"telegram_id": uid, "username": f"bench_{uid}"}) for uid in user_ids}
+    admin_token = server.create_jwt_token({"username": "benchmark", "is_admin": True})
+    weights = [r[1] for r in ROUTE_MIX]
+    samples = {r[0]: {"latencies": [], "statuses": {}, "errors": 0} for r in ROUTE_MIX}
+    deadline = time.monotonic() + duration
+    remaining = [requests_limit]
+
+    def more():
+        if remaining[0] is not None:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+        return time.monotonic() < deadline
+
+    async def worker():
+        while more():
+            name, _, method, path, admin = random.choices(ROUTE_MIX, weights)[0]
+            uid = random.choice(user_ids)
+            headers = {"Authorization": f"Bearer {admin_token if admin else tokens[uid]}"}
+            sample = samples[name]
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path(uid), headers=headers)
+            except Exception:
+                sample['errors'] += 1
+                continue
+            sample['latencies'].append(time.perf_counter() - started)
+            sample['statuses'][response.status_code] = sample['statuses'].get(response.status_code, 0) + 1
+            if response.status_code >= 500:
+                sample['errors'] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.monotonic() - started
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for name, sample in samples.items():
+        latencies = sorted(sample['latencies'])
+        if not latencies and not sample['errors']:
+            continue
+        ms = [round(v * 1000, 2) for v in latencies]
+        routes[name] = {
+            "requests": len(latencies),
+            "errors": sample['errors'],
+            "statuses": {str(k): v for k, v in sorted(sample['statuses'].items())},
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": percentile(ms, 50),
+            "p95_ms": percentile(ms, 95),
+            "p99_ms": percentile(ms, 99),
+            "max_ms": ms[-1] if ms else None,
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(r['errors'] for r in routes.values()),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0,
+        "routes": routes,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_report(report):
+    print(f"\n{'route':<32} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}  statuses")
+    for name, r in sorted(report['routes'].items()):
+        print(f"{name:<32} {r['requests']:>7} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['p99_ms']:>8}  {r['statuses']}")
+    print(f"\n{report['requests']} requests in {report['elapsed_seconds']}s "
+          f"({report['throughput_rps']} req/s), {report['errors']} errors")
+
+
+async def benchmark(args):
+    import repository
+    import server
+
+    db = repository.db
+    scale = {
+        "users": args.users,
+        "tasks": args.tasks,
+        "completions_per_user": args.completions_per_user,
+        "withdrawal_rate": args.withdrawal_rate,
+        "referral_rate": args.referral_rate,
+        "days": 12,
+    }
+    if args.seed:
+        await seed(db, scale, reset=args.reset, seed_value=args.random_seed)
+
+    user_ids = [u['telegram_id'] async for u in db.users.find({}, {"_id": 0, "telegram_id": 1}).limit(args.sample_users)]
+    if not user_ids:
+        raise SystemExit(f"No users in {db.name}; run with --seed first")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url.rstrip('/') + "/api", timeout=30)
+    else:
+        await server.start_background_services()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://benchmark/api", timeout=30
+        )
+    try:
+        if args.warmup:
+            await run_load(client, user_ids, args.concurrency, args.warmup)
+        samples, elapsed = await run_load(client, user_ids, args.concurrency, args.duration, args.requests)
+    finally:
+        await client.aclose()
+        if not args.url:
+            await server.shutdown_db_client()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "in-process",
+        "database": BENCH_DB_NAME,
+        "concurrency": args.concurrency,
+        "scale": scale,
+        **summarize(samples, elapsed),
+    }
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.output}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against a local MongoDB")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--seed", action="store_true", help="Seed the synthetic dataset first")
+    parser.add_argument("--reset", action="store_true", help="Drop the benchmark database before seeding")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--completions-per-user", type=float, default=5)
+    parser.add_argument("--withdrawal-rate", type=float, default=0.2)
+    parser.add_argument("--referral-rate", type=float, default=0.4)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--sample-users", type=int, default=1000, help="Distinct users the load is spread over")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured load first")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    # Per-request client logging would dominate the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(benchmark(args))
+    sys.exit(1 if report['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,25 @@
 import os
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from pathlib import Path
 
+import activity
+import broadcast
+import counters
+import metrics
+import referrals
+import repository
+from leaderboard import leaderboard
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB setup
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'test_database')]
+db = repository.db
 
 # Logging
 logging.basicConfig(
@@ -25,10 +31,13 @@ logger = logging.getLogger(__name__)
 # Bot token
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 WEB_APP_URL = os.environ.get('WEB_APP_URL', 'https://deploy-app-21.emergent.host')
+# Point at a local fake Bot API for testing, e.g. http://localhost:8081/bot
+TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL')
 ADMIN_TELEGRAM_USERNAME = os.environ.get('ADMIN_TELEGRAM_USERNAME', 'Noone55550')
 
 # Global application instance for webhook mode
 application = None
+_initialize_lock = asyncio.Lock()
 
 def get_countdown_text():
     """Generate countdown text"""
@@ -45,6 +54,7 @@ def get_countdown_text():
     
     return f"🎂 Speedy's Birthday in {days}d {hours}h {minutes}m 🎉"
 
+@metrics.timed_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
@@ -59,38 +69,28 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
     
-    # Check if user exists
-    existing_user = await db.users.find_one({"telegram_id": telegram_id})
-    
-    if not existing_user:
-        # Create new user
-        user_doc = {
-            "telegram_id": telegram_id,
-            "username": username,
-            "points": 0,
-            "join_date": datetime.now(timezone.utc).isoformat(),
-            "referral_count": 0,
-            "streak_day": 0,
-            "last_checkin": None,
-            "referred_by": referrer_id,
-            "join_bonus_claimed": False
-        }
-        await db.users.insert_one(user_doc)
+    # Create the user unless they already exist, in one round trip
+    user_doc, created = await repository.get_or_create_user(telegram_id, username, referrer_id)
+    
+    if created:
+        leaderboard.apply(user_doc)
         
-        # Update referrer count if exists
-        if referrer_id and referrer_id != telegram_id:
-            await db.users.update_one(
-                {"telegram_id": referrer_id},
-                {"$inc": {"referral_count": 1}}
-            )
-            # Notify referrer
+        # Count the referral up the referrer's chain if the referrer exists
+        referred = await referrals.record_referral(db, telegram_id, referrer_id)
+        await counters.record_user_joined(db, user_doc['join_date'], referred=referred)
+        await activity.record(
+            db, "user_joined", telegram_id, username,
+            f"@{username} joined the event" + (f" (referred by {referrer_id})" if referred else ""),
+            referred_by=referrer_id if referred else None
+        )
+        
+        if referred:
+            # Notify referrer (the update above already confirmed they exist)
             try:
-                referrer = await db.users.find_one({"telegram_id": referrer_id})
-                if referrer:
-                    await context.bot.send_message(
-                        chat_id=referrer_id,
-                        text=f"🎉 New referral! @{username} joined using your link!\n\n{get_countdown_text()}"
-                    )
+                await context.bot.send_message(
+                    chat_id=referrer_id,
+                    text=f"🎉 New referral! @{username} joined using your link!\n\n{get_countdown_text()}"
+                )
             except:
                 pass
     
@@ -111,6 +111,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
+@metrics.timed_handler
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks"""
     query = update.callback_query
@@ -120,8 +121,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     
     if query.data == "leaderboard":
-        # Get top 10 users
-        top_users = await db.users.find({}, {"_id": 0}).sort("points", -1).limit(10).to_list(10)
+        # Get top 10 users from the in-memory leaderboard
+        top_users = await leaderboard.top(db, 10)
         
         countdown = get_countdown_text()
         leaderboard_text = f"{countdown}\n\n🏆 TOP 10 LEADERBOARD 🏆\n\n"
@@ -133,7 +134,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(leaderboard_text)
     
     elif query.data == "referral":
-        user_data = await db.users.find_one({"telegram_id": telegram_id}, {"_id": 0})
+        user_data = await repository.get_user(telegram_id)
         if user_data:
             referral_link = f"https://t.me/{context.bot.username}?start={telegram_id}"
             countdown = get_countdown_text()
@@ -148,6 +149,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             await query.edit_message_text(referral_text)
 
+@metrics.timed_handler
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /admin command"""
     user = update.effective_user
@@ -161,11 +163,14 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     admin_text += "🔧 ADMIN COMMANDS\n\n"
     admin_text += "/stats - View statistics\n"
     admin_text += "/broadcast <message> - Send message to all users\n"
+    admin_text += "/broadcast_status - Progress of recent broadcasts\n"
+    admin_text += "/broadcast_resume - Resume interrupted broadcasts\n"
     admin_text += "/adjust @username <amount> - Adjust points\n"
     admin_text += "\n💻 Use the Admin Web Panel for full control"
     
     await update.message.reply_text(admin_text)
 
+@metrics.timed_handler
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stats command (admin only)"""
     user = update.effective_user
@@ -174,18 +179,17 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ You are not authorized.")
         return
     
-    total_users = await db.users.count_documents({})
-    total_points = await db.users.aggregate([{"$group": {"_id": None, "total": {"$sum": "$points"}}}]).to_list(1)
-    pending_withdrawals = await db.withdrawals.count_documents({"status": "pending"})
+    totals, _ = await counters.get_stats(db)
     
     stats_text = f"{get_countdown_text()}\n\n"
     stats_text += "📊 EVENT STATISTICS\n\n"
-    stats_text += f"👥 Total Users: {total_users}\n"
-    stats_text += f"💰 Total Points: {total_points[0]['total'] if total_points else 0}\n"
-    stats_text += f"⏳ Pending Withdrawals: {pending_withdrawals}\n"
+    stats_text += f"👥 Total Users: {totals['total_users']}\n"
+    stats_text += f"💰 Total Points: {totals['total_points']}\n"
+    stats_text += f"⏳ Pending Withdrawals: {totals['pending_withdrawals']}\n"
     
     await update.message.reply_text(stats_text)
 
+@metrics.timed_handler
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /broadcast command (admin only)"""
     user = update.effective_user
@@ -199,24 +203,80 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     message = ' '.join(context.args)
-    users = await db.users.find({}, {"_id": 0, "telegram_id": 1}).limit(10000).to_list(10000)
+    broadcast_text = f"{get_countdown_text()}\n\n📢 BROADCAST\n\n{message}"
     
-    success = 0
-    failed = 0
+    # Runs in the background so this handler returns immediately
+    chat_id = update.effective_chat.id
+    job = await broadcast.create_job(db, broadcast_text, report_chat_id=chat_id)
+    broadcast.start_job(db, context.bot, job, on_progress=broadcast_progress_reporter(context.bot, chat_id))
     
-    broadcast_text = f"{get_countdown_text()}\n\n📢 BROADCAST\n\n{message}"
+    await update.message.reply_text(f"📢 Broadcast started to ~{job['total']} users (job {job['job_id'][:8]})")
+
+def broadcast_progress_reporter(bot, chat_id):
+    """Keep one status message in the admin chat up to date while a job runs"""
+    status_message = None
+    
+    async def report(stats, finished):
+        nonlocal status_message
+        if chat_id is None:
+            return
+        if finished:
+            text = f"✅ Broadcast sent!\nSuccess: {stats['sent']}\nFailed: {stats['failed']}\n"
+            text += f"⏱ {stats['elapsed_seconds']}s ({stats['messages_per_second']} msg/s)"
+            await bot.send_message(chat_id=chat_id, text=text)
+            return
+        text = f"📢 Broadcasting... {stats['sent'] + stats['failed']}/~{stats['total']}\n"
+        text += f"Success: {stats['sent']}\nFailed: {stats['failed']}\n"
+        text += f"⚡ {stats['messages_per_second']} msg/s"
+        if status_message is None:
+            status_message = await bot.send_message(chat_id=chat_id, text=text)
+        else:
+            await status_message.edit_text(text)
+    
+    return report
+
+@metrics.timed_handler
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast_status command (admin only)"""
+    user = update.effective_user
     
-    for user_data in users:
-        try:
-            await context.bot.send_message(
-                chat_id=user_data['telegram_id'],
-                text=broadcast_text
-            )
-            success += 1
-        except:
-            failed += 1
+    if user.username != ADMIN_TELEGRAM_USERNAME.replace('@', ''):
+        await update.message.reply_text("⛔ You are not authorized.")
+        return
+    
+    jobs = await broadcast.latest_jobs(db)
+    if not jobs:
+        await update.message.reply_text("No broadcasts yet.")
+        return
+    
+    status_text = "📢 RECENT BROADCASTS\n\n"
+    for job in jobs:
+        status_text += f"• {job['job_id'][:8]} {job['status']}: {job['sent']} sent, {job['failed']} failed of ~{job['total']}"
+        if job.get('messages_per_second'):
+            status_text += f" ({job['messages_per_second']} msg/s)"
+        status_text += "\n"
     
-    await update.message.reply_text(f"✅ Broadcast sent!\nSuccess: {success}\nFailed: {failed}")
+    await update.message.reply_text(status_text)
+
+@metrics.timed_handler
+async def broadcast_resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast_resume command (admin only)"""
+    user = update.effective_user
+    
+    if user.username != ADMIN_TELEGRAM_USERNAME.replace('@', ''):
+        await update.message.reply_text("⛔ You are not authorized.")
+        return
+    
+    resumed = await resume_broadcasts(context.bot)
+    # Jobs still held by a live process (this one or another worker) are left alone
+    await update.message.reply_text(f"▶️ Resumed {len(resumed)} broadcast(s) whose runner had stopped")
+
+async def resume_broadcasts(bot):
+    """Restart broadcasts whose runner stopped renewing its lease (crash or redeploy)"""
+    return await broadcast.resume_jobs(
+        db, bot,
+        progress_factory=lambda job: broadcast_progress_reporter(bot, job.get('report_chat_id'))
+    )
 
 
 def create_application():
@@ -226,18 +286,44 @@ def create_application():
         logger.error("No TELEGRAM_BOT_TOKEN found in environment")
         return None
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(BOT_TOKEN).post_init(on_startup)
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    application = builder.build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status_command))
+    application.add_handler(CommandHandler("broadcast_resume", broadcast_resume_command))
     application.add_handler(CallbackQueryHandler(button_callback))
     
     return application
 
 
+async def on_startup(app: Application):
+    """Run once the application is initialized"""
+    resumed = await resume_broadcasts(app.bot)
+    if resumed:
+        logger.info(f"Resumed {len(resumed)} interrupted broadcast(s)")
+
+
+async def initialize_application():
+    """Initialize the application for webhook mode (post_init only runs when polling)"""
+    app = get_application()
+    if app is None:
+        return None
+    if not app._initialized:
+        # Queue workers may all arrive here with the first updates
+        async with _initialize_lock:
+            if not app._initialized:
+                await app.initialize()
+                await on_startup(app)
+    return app
+
+
 def get_application():
     """Get or create the application instance"""
     global application
@@ -266,7 +352,6 @@ def main():
     app = create_application()
     
     # Get bot info
-    import asyncio
     async def get_bot_info():
         bot = app.bot
         bot_data = await bot.get_me()
@@ -0,0 +1,313 @@
+"""Resumable, rate-limited broadcast jobs for the /broadcast command.
+
+Recipients are streamed from a users cursor in telegram_id order and sent by
+a bounded pool of workers sharing one global rate limiter. Progress is
+checkpointed in ``broadcast_jobs`` as the highest telegram_id below which
+every recipient has been handled, so an interrupted job resumes there.
+Delivery is at-least-once: messages in flight at the time of a crash may be
+sent again on resume.
+
+A job is run by whichever process holds its lease: ``owner`` plus a
+``lease_until`` renewed on every checkpoint. Only jobs whose lease has
+expired are resumed, and each is claimed with one atomic update, so API
+workers starting together or a repeated /broadcast_resume never run the same
+job twice. A runner that finds its lease taken over stops sending.
+
+The engine only needs an object with an async ``send_message(chat_id, text)``,
+so it runs the same against the real Bot API, a local fake Bot API (set
+TELEGRAM_API_BASE_URL) or a stub bot.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages/second per bot across all chats
+BROADCAST_MESSAGES_PER_SECOND = float(os.environ.get('BROADCAST_MESSAGES_PER_SECOND', '25'))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '16'))
+BROADCAST_MAX_ATTEMPTS = 3
+CHECKPOINT_EVERY = 200
+PROGRESS_INTERVAL_SECONDS = 5.0
+BROADCAST_LEASE_SECONDS = float(os.environ.get('BROADCAST_LEASE_SECONDS', '60'))
+
+# Identifies this process as the owner of the jobs it runs
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Jobs running in this process, by job_id
+running_jobs = {}
+
+
+class RateLimiter:
+    """Evenly spaced send slots shared by all workers, pausable on RetryAfter"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self._next_slot = max(self._next_slot, resume_at)
+
+
+class LeaseLost(Exception):
+    """Another process has claimed the job this runner was working on"""
+
+
+def _lease_until(seconds=BROADCAST_LEASE_SECONDS):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+async def create_job(db, text, report_chat_id=None):
+    """Persist a new broadcast job and return it"""
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "text": text,
+        "status": "running",
+        "report_chat_id": report_chat_id,
+        "owner": WORKER_ID,
+        "lease_until": _lease_until(),
+        "cursor": None,
+        "sent": 0,
+        "failed": 0,
+        "total": await db.users.estimated_document_count(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+        "messages_per_second": None,
+    }
+    await db.broadcast_jobs.insert_one(job)
+    job.pop('_id', None)
+    return job
+
+
+class BroadcastRunner:
+    """Runs one job to completion, checkpointing as it goes"""
+
+    def __init__(self, db, bot, job, concurrency=BROADCAST_CONCURRENCY,
+                 rate=BROADCAST_MESSAGES_PER_SECOND, on_progress=None):
+        self.db = db
+        self.bot = bot
+        self.job = job
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.on_progress = on_progress
+        self.sent = job.get('sent', 0)
+        self.failed = job.get('failed', 0)
+        self.cursor = job.get('cursor')
+        # Counts covering only recipients up to the cursor; these are what a resume starts from
+        self._committed = {"sent": self.sent, "failed": self.failed}
+        # telegram_ids handed to workers, in ascending order, and the outcome of finished ones
+        self._issued = deque()
+        self._done = {}
+        self._since_checkpoint = 0
+        self._started = None
+        self.lost = False
+
+    async def _send(self, chat_id):
+        failures = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=self.job['text'])
+                return True
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so every worker backs off
+                delay = _retry_after_seconds(e)
+                self.limiter.pause(delay)
+                await asyncio.sleep(delay)
+            except BadRequest:
+                return False
+            except NetworkError:
+                failures += 1
+                if failures >= BROADCAST_MAX_ATTEMPTS:
+                    return False
+                await asyncio.sleep(2 ** failures)
+            except TelegramError:
+                # Blocked the bot, deactivated account, chat not found...
+                return False
+
+    def _advance_cursor(self):
+        while self._issued and self._issued[0] in self._done:
+            telegram_id = self._issued.popleft()
+            delivered = self._done.pop(telegram_id)
+            self._committed["sent" if delivered else "failed"] += 1
+            self.cursor = telegram_id
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0
+        handled = self.sent + self.failed - self.job.get('sent', 0) - self.job.get('failed', 0)
+        return {
+            "job_id": self.job['job_id'],
+            "sent": self.sent,
+            "failed": self.failed,
+            "total": self.job.get('total'),
+            "elapsed_seconds": round(elapsed, 1),
+            "messages_per_second": round(handled / elapsed, 1) if elapsed else 0.0,
+        }
+
+    async def checkpoint(self, **fields):
+        """Save progress and renew the lease; raises LeaseLost if another process owns the job"""
+        result = await self.db.broadcast_jobs.update_one(
+            {"job_id": self.job['job_id'], "owner": WORKER_ID},
+            {"$set": {"cursor": self.cursor, **self._committed, "lease_until": _lease_until(), **fields}}
+        )
+        if result.matched_count == 0:
+            self.lost = True
+            raise LeaseLost(self.job['job_id'])
+
+    async def _worker(self, queue):
+        while True:
+            telegram_id = await queue.get()
+            if self.lost:
+                queue.task_done()
+                continue
+            try:
+                delivered = await self._send(telegram_id)
+            except Exception as e:
+                logger.warning(f"Broadcast to {telegram_id} failed: {e}")
+                delivered = False
+            if delivered:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._done[telegram_id] = delivered
+            self._advance_cursor()
+            self._since_checkpoint += 1
+            queue.task_done()
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL_SECONDS)
+            # Checkpoint even without progress (e.g. during flood waits) to keep the lease
+            self._since_checkpoint = 0
+            try:
+                await self.checkpoint()
+            except LeaseLost:
+                return
+            await self._notify(False)
+
+    async def _notify(self, finished):
+        if self.on_progress:
+            try:
+                await self.on_progress(self.stats(), finished)
+            except Exception as e:
+                logger.warning(f"Broadcast progress report failed: {e}")
+
+    async def run(self):
+        self._started = time.monotonic()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report_progress())
+
+        query = {"telegram_id": {"$gt": self.cursor}} if self.cursor is not None else {}
+        completed = False
+        try:
+            cursor = self.db.users.find(query, {"_id": 0, "telegram_id": 1}).sort("telegram_id", 1).batch_size(1000)
+            async for user in cursor:
+                if self.lost:
+                    raise LeaseLost(self.job['job_id'])
+                self._issued.append(user['telegram_id'])
+                await queue.put(user['telegram_id'])
+                if self._since_checkpoint >= CHECKPOINT_EVERY:
+                    self._since_checkpoint = 0
+                    await self.checkpoint()
+            await queue.join()
+            if self.lost:
+                raise LeaseLost(self.job['job_id'])
+
+            stats = self.stats()
+            await self.checkpoint(
+                status="completed",
+                finished_at=datetime.now(timezone.utc).isoformat(),
+                messages_per_second=stats['messages_per_second']
+            )
+            completed = True
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            if not completed and not self.lost:
+                # Interrupted jobs keep status "running" and give up the lease so
+                # another process can resume them straight away
+                await self.checkpoint(lease_until=datetime.now(timezone.utc).isoformat())
+
+        logger.info(f"Broadcast {self.job['job_id']} completed: {stats}")
+        await self._notify(True)
+        return stats
+
+
+def start_job(db, bot, job, on_progress=None):
+    """Run a job in the background unless it is already running in this process"""
+    job_id = job['job_id']
+    if job_id in running_jobs and not running_jobs[job_id].done():
+        return running_jobs[job_id]
+
+    async def run():
+        try:
+            return await BroadcastRunner(db, bot, job, on_progress=on_progress).run()
+        except asyncio.CancelledError:
+            raise
+        except LeaseLost:
+            logger.warning(f"Broadcast {job_id} was claimed by another process; stopped here")
+        except Exception as e:
+            logger.error(f"Broadcast {job_id} stopped: {e}")
+        finally:
+            running_jobs.pop(job_id, None)
+
+    running_jobs[job_id] = asyncio.create_task(run())
+    return running_jobs[job_id]
+
+
+async def claim_job(db):
+    """Take over one running job whose lease has expired, or return None"""
+    now = datetime.now(timezone.utc).isoformat()
+    return await db.broadcast_jobs.find_one_and_update(
+        # Jobs created before leases existed have no lease_until
+        {"status": "running", "$or": [{"lease_until": {"$lt": now}}, {"lease_until": None}]},
+        {"$set": {"owner": WORKER_ID, "lease_until": _lease_until()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def resume_jobs(db, bot, progress_factory=None):
+    """Claim and restart every job whose owner stopped renewing its lease"""
+    resumed = []
+    while True:
+        job = await claim_job(db)
+        if job is None:
+            break
+        if job['job_id'] in running_jobs:
+            # Our own runner stalled past its lease; it keeps the job
+            continue
+        logger.info(f"Resuming broadcast {job['job_id']} after telegram_id {job.get('cursor')}")
+        on_progress = progress_factory(job) if progress_factory else None
+        start_job(db, bot, job, on_progress=on_progress)
+        resumed.append(job)
+    return resumed
+
+
+async def latest_jobs(db, limit=5):
+    return await db.broadcast_jobs.find({}, {"_id": 0, "text": 0}).sort("created_at", -1).limit(limit).to_list(limit)
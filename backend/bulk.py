@@ -0,0 +1,218 @@
+"""Bulk withdrawal settlement and points adjustments for the admin panel.
+
+Items are processed in chunks of BULK_CHUNK_SIZE. Each chunk costs a
+fixed number of round trips, however many items it holds:
+
+- withdrawals: read the chunk, then one guarded ``update_many`` moves the
+  pending ones to their final status, tagged with the batch id. A read by
+  that tag shows which ones this batch settled, since a concurrent approve
+  or reject can win any of them.
+- users: one unordered ``bulk_write`` with every user's summed point and
+  reservation deltas, then one read of the new totals for the leaderboard
+- counters and histogram: one increment; activity: one insert
+
+Every item gets its own result. ``dry_run`` does the reads and reports
+what would happen without writing anything. Each real batch is recorded
+in ``admin_batches``. A resubmitted ``batch_id`` is refused, so retrying
+a request that timed out cannot apply it twice.
+"""
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+import activity
+import counters
+from leaderboard import LEADERBOARD_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', '20000'))
+
+SETTLE_PROJECTION = {"_id": 0, "withdrawal_id": 1, "user_id": 1, "username": 1, "amount": 1,
+                     "reserved": 1, "status": 1}
+BATCH_PROJECTION = {"_id": 0}
+
+
+def new_batch_id():
+    return str(uuid.uuid4())
+
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _summary(results):
+    counts = {}
+    for item in results:
+        counts[item['result']] = counts.get(item['result'], 0) + 1
+    return counts
+
+
+async def start_batch(db, batch_id, kind, admin, size):
+    """Record a batch before applying it; raises DuplicateKeyError for a reused id"""
+    await db.admin_batches.insert_one({
+        "batch_id": batch_id,
+        "kind": kind,
+        "admin": admin,
+        "size": size,
+        "status": "running",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    })
+
+
+async def finish_batch(db, batch_id, summary, status="done"):
+    await db.admin_batches.update_one({"batch_id": batch_id}, {"$set": {
+        "status": status,
+        "summary": summary,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }})
+
+
+async def get_batch(db, batch_id):
+    return await db.admin_batches.find_one({"batch_id": batch_id}, BATCH_PROJECTION)
+
+
+async def _apply_user_deltas(db, leaderboard, deltas_by_user, **global_deltas):
+    """Apply {telegram_id: {field: delta}} and record the points side of it"""
+    ops = [
+        UpdateOne({"telegram_id": telegram_id}, {"$inc": deltas})
+        for telegram_id, deltas in deltas_by_user.items()
+        if deltas
+    ]
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+    moved = [telegram_id for telegram_id, deltas in deltas_by_user.items() if deltas.get('points')]
+    users = await db.users.find(
+        {"telegram_id": {"$in": moved}}, LEADERBOARD_PROJECTION
+    ).to_list(len(moved)) if moved else []
+    for user in users:
+        leaderboard.apply(user)
+    await counters.record_points_many(
+        db, [(user.get('points', 0), deltas_by_user[user['telegram_id']]['points']) for user in users],
+        **global_deltas
+    )
+
+
+def _settlement_deltas(withdrawal, status):
+    """User deltas for settling one withdrawal, matching the single-item routes"""
+    amount = withdrawal['amount']
+    if status == "approved":
+        # Reserved points already left the balance; older requests deduct now
+        return {"reserved_points": -amount} if withdrawal.get('reserved') else {"points": -amount}
+    return {"points": amount, "reserved_points": -amount} if withdrawal.get('reserved') else {}
+
+
+async def settle_withdrawals(db, leaderboard, withdrawal_ids, status, admin_note, batch_id, dry_run=False):
+    """Approve or reject pending withdrawals; returns per-item results in input order"""
+    results = []
+    seen = set()
+    for chunk in _chunks(withdrawal_ids):
+        ids = []
+        for withdrawal_id in chunk:
+            if withdrawal_id not in seen:
+                seen.add(withdrawal_id)
+                ids.append(withdrawal_id)
+        found = {
+            w['withdrawal_id']: w
+            for w in await db.withdrawals.find({"withdrawal_id": {"$in": ids}}, SETTLE_PROJECTION).to_list(len(ids))
+        } if ids else {}
+        pending = [i for i in ids if found.get(i, {}).get('status') == "pending"]
+        settled = set(pending)
+        if pending and not dry_run:
+            await db.withdrawals.update_many(
+                {"withdrawal_id": {"$in": pending}, "status": "pending"},
+                {"$set": {"status": status, "admin_note": admin_note, "batch_id": batch_id}}
+            )
+            settled = {
+                w['withdrawal_id']
+                for w in await db.withdrawals.find(
+                    {"withdrawal_id": {"$in": pending}, "batch_id": batch_id}, {"_id": 0, "withdrawal_id": 1}
+                ).to_list(len(pending))
+            }
+
+        deltas_by_user, events = {}, []
+        chunk_ids = set(ids)
+        for withdrawal_id in chunk:
+            withdrawal = found.get(withdrawal_id)
+            if withdrawal_id not in chunk_ids:
+                results.append({"withdrawal_id": withdrawal_id, "result": "duplicate"})
+                continue
+            chunk_ids.discard(withdrawal_id)
+            if withdrawal is None:
+                results.append({"withdrawal_id": withdrawal_id, "result": "not_found"})
+                continue
+            if withdrawal_id not in settled:
+                results.append({"withdrawal_id": withdrawal_id, "result": "already_processed"})
+                continue
+            results.append({"withdrawal_id": withdrawal_id, "result": status,
+                            "user_id": withdrawal['user_id'], "amount": withdrawal['amount']})
+            user = deltas_by_user.setdefault(withdrawal['user_id'], {})
+            for field, delta in _settlement_deltas(withdrawal, status).items():
+                user[field] = user.get(field, 0) + delta
+            username = withdrawal.get('username', 'Unknown')
+            description = f"@{username}'s {withdrawal['amount']} pts withdrawal was {status}"
+            if status == "rejected":
+                description += f" ({admin_note})"
+            events.append(activity.event(f"withdrawal_{status}", withdrawal['user_id'], username, description,
+                                         withdrawal_id=withdrawal_id, amount=withdrawal['amount'],
+                                         batch_id=batch_id))
+
+        if events and not dry_run:
+            await _apply_user_deltas(db, leaderboard, deltas_by_user, pending_withdrawals=-len(events))
+            await activity.record_many(db, events)
+    return results
+
+
+async def adjust_points(db, leaderboard, adjustments, batch_id, dry_run=False):
+    """Apply (telegram_id, amount) pairs; several for one user are summed into one update"""
+    results = []
+    for chunk in _chunks(adjustments):
+        ids = list({telegram_id for telegram_id, _ in chunk})
+        users = {
+            u['telegram_id']: u
+            for u in await db.users.find({"telegram_id": {"$in": ids}}, LEADERBOARD_PROJECTION).to_list(len(ids))
+        }
+        deltas_by_user, events = {}, []
+        projected = {telegram_id: user.get('points', 0) for telegram_id, user in users.items()}
+        for telegram_id, amount in chunk:
+            user = users.get(telegram_id)
+            if user is None:
+                results.append({"telegram_id": telegram_id, "amount": amount, "result": "not_found"})
+                continue
+            projected[telegram_id] += amount
+            results.append({"telegram_id": telegram_id, "amount": amount, "result": "adjusted",
+                            "points_after": projected[telegram_id]})
+            deltas = deltas_by_user.setdefault(telegram_id, {"points": 0})
+            deltas['points'] += amount
+            events.append(activity.event("points_adjusted", telegram_id, user['username'],
+                                         f"Admin adjusted @{user['username']} by {amount:+} pts",
+                                         points=amount, batch_id=batch_id))
+
+        if events and not dry_run:
+            await _apply_user_deltas(db, leaderboard, deltas_by_user)
+            await activity.record_many(db, events)
+    return results
+
+
+async def run_batch(db, kind, admin, size, dry_run, batch_id, apply):
+    """Record the batch around ``apply(batch_id)``; returns the endpoint response"""
+    batch_id = batch_id or new_batch_id()
+    if not dry_run:
+        await start_batch(db, batch_id, kind, admin, size)
+    try:
+        results = await apply(batch_id)
+    except Exception:
+        # Chunks already written stay written; the batch record says it stopped
+        if not dry_run:
+            await finish_batch(db, batch_id, None, status="failed")
+        raise
+    summary = _summary(results)
+    if not dry_run:
+        await finish_batch(db, batch_id, summary)
+        logger.info(f"Batch {batch_id} ({kind}, {size} items): {summary}")
+    return {"batch_id": batch_id, "dry_run": dry_run, "summary": summary, "results": results}
@@ -0,0 +1,299 @@
+"""Materialized counters kept in step with the routes that change them.
+
+Global totals and per-day join counts live in the ``counters`` collection,
+per-task completion counts under ``task:<task_id>`` keys, and a histogram of
+user points under ``points_histogram`` that rank queries sum instead of
+counting the users collection. Per-user
+``tasks_completed`` and ``withdrawal_count`` are stored on the user document
+itself so they are incremented by the same update that changes the user.
+
+Run ``python counters.py rebuild`` to recompute everything from the raw
+collections, or ``python counters.py verify`` to report drift.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne, UpdateOne
+
+import live
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "global"
+GLOBAL_FIELDS = (
+    "total_users",
+    "total_points",
+    "pending_withdrawals",
+    "total_tasks",
+    "total_task_completions",
+    "total_checkins",
+    "total_referrals",
+    "join_bonus_claimed",
+)
+USER_FIELDS = ("tasks_completed", "withdrawal_count")
+
+HISTOGRAM_KEY = "points_histogram"
+# Buckets per power of two; a bucket spans at most 1/8 of its lower bound
+HISTOGRAM_SUB_BUCKETS = 8
+
+
+def task_key(task_id):
+    return f"task:{task_id}"
+
+
+def daily_key(day=None):
+    """Key for per-day counters; ``day`` is a datetime or an ISO date string"""
+    if day is None:
+        day = datetime.now(timezone.utc)
+    if isinstance(day, datetime):
+        day = day.astimezone(timezone.utc).date().isoformat()
+    return f"daily:{day[:10]}"
+
+
+def points_bucket(points):
+    """(lower, upper) bounds of the histogram bucket holding ``points``.
+
+    Zero and negative balances share bucket 0; above that buckets are
+    logarithmic, so there are only a few hundred whatever the point totals.
+    """
+    if points < 1:
+        return 0, 1
+    base = 1 << (points.bit_length() - 1)
+    width = max(1, base // HISTOGRAM_SUB_BUCKETS)
+    lower = base + (points - base) // width * width
+    return lower, lower + width
+
+
+def bucket_field(points):
+    return f"b{points_bucket(points)[0]}"
+
+
+def histogram_move(before, after):
+    """Histogram deltas for a user whose points went from ``before`` to ``after``"""
+    old, new = bucket_field(before), bucket_field(after)
+    return {} if old == new else {old: -1, new: 1}
+
+
+async def increment(db, deltas_by_key):
+    """Apply ``{counter_key: {field: delta}}`` in a single unordered bulk write"""
+    ops = [
+        UpdateOne({"_id": key}, {"$inc": deltas}, upsert=True)
+        for key, deltas in deltas_by_key.items()
+        if deltas
+    ]
+    if ops:
+        await db.counters.bulk_write(ops, ordered=False)
+        live.publish_stats(_dashboard_deltas(deltas_by_key))
+
+
+def _dashboard_deltas(deltas_by_key):
+    """Map counter deltas onto the field names /admin/stats returns"""
+    deltas = {f: d for f, d in deltas_by_key.get(GLOBAL_KEY, {}).items() if d and f in GLOBAL_FIELDS}
+    joined = deltas_by_key.get(daily_key(), {}).get("users_joined")
+    if joined:
+        deltas["users_today"] = joined
+    return deltas
+
+
+async def increment_global(db, **deltas):
+    await increment(db, {GLOBAL_KEY: deltas})
+
+
+async def record_points(db, points, delta, **deltas):
+    """Count a change of ``delta`` points for a user now at ``points``, along
+    with any other global deltas"""
+    await increment(db, {
+        GLOBAL_KEY: {"total_points": delta, **deltas},
+        HISTOGRAM_KEY: histogram_move(points - delta, points),
+    })
+
+
+async def record_points_many(db, changes, **deltas):
+    """``record_points`` for several users at once: ``changes`` is (points now, delta) pairs"""
+    total, histogram = 0, {}
+    for points, delta in changes:
+        total += delta
+        for field, change in histogram_move(points - delta, points).items():
+            histogram[field] = histogram.get(field, 0) + change
+    await increment(db, {
+        GLOBAL_KEY: {"total_points": total, **deltas},
+        HISTOGRAM_KEY: {field: change for field, change in histogram.items() if change},
+    })
+
+
+async def record_user_joined(db, join_date, referred=False):
+    deltas = {"total_users": 1}
+    if referred:
+        deltas["total_referrals"] = 1
+    await increment(db, {
+        GLOBAL_KEY: deltas,
+        daily_key(join_date): {"users_joined": 1},
+        # Every user starts with 0 points
+        HISTOGRAM_KEY: {bucket_field(0): 1},
+    })
+
+
+async def get_stats(db, day=None):
+    """Return (global counters, today's counters) with missing fields as 0"""
+    today = daily_key(day)
+    docs = await db.counters.find({"_id": {"$in": [GLOBAL_KEY, today]}}).to_list(2)
+    by_key = {d['_id']: d for d in docs}
+    totals = {field: by_key.get(GLOBAL_KEY, {}).get(field, 0) for field in GLOBAL_FIELDS}
+    daily = {"users_joined": by_key.get(today, {}).get("users_joined", 0)}
+    return totals, daily
+
+
+async def get_histogram(db):
+    """Return {bucket lower bound: user count}"""
+    doc = await db.counters.find_one({"_id": HISTOGRAM_KEY}) or {}
+    return {int(field[1:]): count for field, count in doc.items() if field.startswith("b")}
+
+
+async def get_task_counts(db, task_ids):
+    """Return {task_id: completion_count} for the given tasks"""
+    if not task_ids:
+        return {}
+    docs = await db.counters.find(
+        {"_id": {"$in": [task_key(t) for t in task_ids]}}
+    ).to_list(len(task_ids))
+    return {d['_id'][len("task:"):]: d.get('completion_count', 0) for d in docs}
+
+
+async def _sum_field(db, collection, field):
+    result = await db[collection].aggregate(
+        [{"$group": {"_id": None, "total": {"$sum": f"${field}"}}}]
+    ).to_list(1)
+    return result[0]['total'] if result else 0
+
+
+async def compute_counters(db):
+    """Recompute every counter from the raw collections.
+
+    Returns (counters by key, per-user counts by telegram_id).
+    """
+    totals = {
+        "total_users": await db.users.count_documents({}),
+        "total_points": await _sum_field(db, "users", "points"),
+        "pending_withdrawals": await db.withdrawals.count_documents({"status": "pending"}),
+        "total_tasks": await db.tasks.count_documents({"active": True}),
+        "total_task_completions": await db.task_completions.count_documents({}),
+        "total_checkins": await db.users.count_documents({"last_checkin": {"$ne": None}}),
+        "total_referrals": await _sum_field(db, "users", "referral_count"),
+        "join_bonus_claimed": await db.users.count_documents({"join_bonus_claimed": True}),
+    }
+    counters = {GLOBAL_KEY: totals}
+
+    async for row in db.users.aggregate([
+        {"$group": {"_id": {"$substrCP": ["$join_date", 0, 10]}, "count": {"$sum": 1}}}
+    ]):
+        counters[daily_key(row['_id'])] = {"users_joined": row['count']}
+
+    async for row in db.task_completions.aggregate([
+        {"$group": {"_id": "$task_id", "count": {"$sum": 1}}}
+    ]):
+        counters[task_key(row['_id'])] = {"completion_count": row['count']}
+
+    histogram = {}
+    async for user in db.users.find({}, {"_id": 0, "points": 1}):
+        field = bucket_field(user.get('points', 0))
+        histogram[field] = histogram.get(field, 0) + 1
+    counters[HISTOGRAM_KEY] = histogram
+
+    per_user = {}
+    async for row in db.task_completions.aggregate([
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]):
+        per_user.setdefault(row['_id'], {})["tasks_completed"] = row['count']
+    async for row in db.withdrawals.aggregate([
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]):
+        per_user.setdefault(row['_id'], {})["withdrawal_count"] = row['count']
+
+    return counters, per_user
+
+
+async def rebuild_counters(db, batch_size=1000):
+    """Overwrite all counters with values recomputed from the raw collections"""
+    counters, per_user = await compute_counters(db)
+
+    await db.counters.delete_many({"_id": {"$nin": list(counters)}})
+    # Replace rather than $set so fields that no longer apply (empty histogram buckets) go away
+    await db.counters.bulk_write(
+        [ReplaceOne({"_id": key}, fields, upsert=True) for key, fields in counters.items()],
+        ordered=False
+    )
+
+    await db.users.update_many({}, {"$set": {field: 0 for field in USER_FIELDS}})
+    ops = [
+        UpdateOne({"telegram_id": telegram_id}, {"$set": fields})
+        for telegram_id, fields in per_user.items()
+    ]
+    for start in range(0, len(ops), batch_size):
+        await db.users.bulk_write(ops[start:start + batch_size], ordered=False)
+
+    logger.info(f"Rebuilt {len(counters)} counters and {len(per_user)} per-user counts")
+    return counters
+
+
+async def verify_counters(db):
+    """Return a list of (key, field, stored, expected) for every drifted counter"""
+    counters, per_user = await compute_counters(db)
+    mismatches = []
+
+    stored = {d['_id']: d async for d in db.counters.find({})}
+    for key, fields in counters.items():
+        for field in set(fields) | (set(stored.get(key, {})) - {"_id"}):
+            expected = fields.get(field, 0)
+            actual = stored.get(key, {}).get(field, 0)
+            if actual != expected:
+                mismatches.append((key, field, actual, expected))
+
+    async for user in db.users.find({}, {"_id": 0, "telegram_id": 1, **{f: 1 for f in USER_FIELDS}}):
+        expected = per_user.get(user['telegram_id'], {})
+        for field in USER_FIELDS:
+            actual = user.get(field, 0)
+            if actual != expected.get(field, 0):
+                mismatches.append((f"user:{user['telegram_id']}", field, actual, expected.get(field, 0)))
+
+    return mismatches
+
+
+async def ensure_counters(db):
+    """Build counters on first start so existing data is counted"""
+    found = await db.counters.count_documents({"_id": {"$in": [GLOBAL_KEY, HISTOGRAM_KEY]}})
+    if found < 2:
+        logger.info("Counters missing, rebuilding from raw collections")
+        await rebuild_counters(db)
+
+
+def main():
+    import repository
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify materialized counters")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = repository.db
+
+    async def run():
+        if args.command == "rebuild":
+            await rebuild_counters(db)
+            return 0
+        mismatches = await verify_counters(db)
+        for key, field, actual, expected in mismatches:
+            print(f"{key}.{field}: stored={actual} expected={expected}")
+        print(f"{len(mismatches)} mismatched counters")
+        return 1 if mismatches else 0
+
+    try:
+        sys.exit(asyncio.run(run()))
+    finally:
+        repository.close()
+
+
+if __name__ == '__main__':
+    main()
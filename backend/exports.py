@@ -0,0 +1,134 @@
+"""Streaming CSV / NDJSON exports for the admin API.
+
+Rows are read from a Motor cursor in batches and encoded into chunks of
+roughly CHUNK_SIZE bytes as they arrive, so memory stays flat whatever the
+size of the export and the first chunk goes out as soon as the first batch
+is read. gzip is applied incrementally to the same chunks.
+"""
+import csv
+import io
+import json
+import zlib
+
+EXPORT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+# collection, columns in output order, and the field date filters apply to
+EXPORTS = {
+    "users": {
+        "collection": "users",
+        "columns": [
+            "telegram_id", "username", "points", "reserved_points", "join_date",
+            "referral_count", "referral_network", "referral_depth", "streak_day", "last_checkin", "referred_by",
+            "join_bonus_claimed", "tasks_completed", "withdrawal_count",
+        ],
+        "date_field": "join_date",
+    },
+    "withdrawals": {
+        "collection": "withdrawals",
+        "columns": ["withdrawal_id", "user_id", "username", "amount", "status", "timestamp", "admin_note"],
+        "date_field": "timestamp",
+    },
+    "task_completions": {
+        "collection": "task_completions",
+        "columns": ["user_id", "task_id", "completed_at"],
+        "date_field": "completed_at",
+    },
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Spreadsheets run a cell starting with one of these as a formula; usernames
+# and admin notes are user input, so such cells are quoted with a leading '
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def build_query(kind, status=None, since=None, until=None, min_points=None):
+    """Filter for an export; ``since``/``until`` are ISO-8601 strings"""
+    spec = EXPORTS[kind]
+    query = {}
+    if status is not None and kind == "withdrawals":
+        query["status"] = status
+    if min_points is not None and kind == "users":
+        query["points"] = {"$gte": min_points}
+    date_range = {}
+    if since:
+        date_range["$gte"] = since
+    if until:
+        date_range["$lt"] = until
+    if date_range:
+        query[spec["date_field"]] = date_range
+    return query
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _encode_csv(columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows):
+        for row in rows:
+            writer.writerow([_csv_cell(row.get(c)) for c in columns])
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    return encode
+
+
+def _encode_ndjson(columns):
+    def encode(rows):
+        return "".join(json.dumps({c: row.get(c) for c in columns}, default=str) + "\n" for row in rows)
+    return encode
+
+
+async def stream_export(db, kind, fmt, query, gzip=False):
+    """Yield the encoded export as bytes chunks"""
+    columns = EXPORTS[kind]["columns"]
+    encode = _encode_csv(columns) if fmt == "csv" else _encode_ndjson(columns)
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    def emit(text):
+        data = text.encode()
+        if not compressor:
+            return data
+        # Sync-flush so every chunk is decodable as soon as it arrives
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    # The CSV header goes out before the first read
+    if fmt == "csv":
+        yield emit(",".join(columns) + "\r\n")
+
+    projection = {"_id": 0, **{c: 1 for c in columns}}
+    cursor = db[EXPORTS[kind]["collection"]].find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    rows, pending, size = [], [], 0
+    async for row in cursor:
+        rows.append(row)
+        if len(rows) < EXPORT_BATCH_SIZE:
+            continue
+        text = encode(rows)
+        rows = []
+        pending.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield emit("".join(pending))
+            pending, size = [], 0
+
+    if rows:
+        pending.append(encode(rows))
+    tail = emit("".join(pending)) if pending else b""
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
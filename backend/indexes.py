@@ -0,0 +1,326 @@
+"""Declarative index definitions for every query the API and bot run.
+
+``ensure_indexes`` is idempotent and runs at API startup. A failed index is
+logged and skipped, except for the unique indexes in REQUIRED_UNIQUE: the
+API relies on those to keep one user per Telegram id, one row per
+withdrawal id, and to reject repeat task completions and milestone
+rewards, so startup stops with a MissingGuardIndex naming the duplicate
+rows to clean up. ``audit_indexes`` reports indexes that are declared but
+missing, or present but undeclared.
+
+Run ``python indexes.py ensure|audit|explain`` by hand; ``explain`` plans
+every shape in QUERY_SHAPES against the live database and exits non-zero if
+any of them would use a COLLSCAN.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+import activity
+import profiler
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("telegram_id", ASCENDING)], name="telegram_id_unique", unique=True),
+        IndexModel([("points", DESCENDING), ("telegram_id", ASCENDING)], name="points_desc"),
+        IndexModel([("join_date", DESCENDING), ("telegram_id", DESCENDING)], name="join_date_telegram_id"),
+        IndexModel([("last_checkin", DESCENDING)], name="last_checkin_desc"),
+        IndexModel([("referred_by", ASCENDING)], name="referred_by"),
+        IndexModel([("referral_count", DESCENDING), ("telegram_id", ASCENDING)], name="referral_count_desc"),
+        IndexModel([("referral_network", DESCENDING), ("telegram_id", ASCENDING)], name="referral_network_desc"),
+        IndexModel([("referral_depth", DESCENDING)], name="referral_depth_desc"),
+        IndexModel([("username_lower", ASCENDING), ("telegram_id", ASCENDING)], name="username_lower"),
+        IndexModel([("username_ngrams", ASCENDING)], name="username_ngrams"),
+    ],
+    "tasks": [
+        IndexModel([("task_id", ASCENDING)], name="task_id_unique", unique=True),
+        IndexModel([("active", ASCENDING)], name="active"),
+    ],
+    "task_completions": [
+        IndexModel([("user_id", ASCENDING), ("task_id", ASCENDING)], name="user_task_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("completed_at", DESCENDING)], name="user_completed_at"),
+        IndexModel([("completed_at", DESCENDING)], name="completed_at_desc"),
+    ],
+    "withdrawals": [
+        IndexModel([("withdrawal_id", ASCENDING)], name="withdrawal_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING)], name="status_timestamp"),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("withdrawal_id", DESCENDING)],
+                   name="user_timestamp_withdrawal_id"),
+        IndexModel([("timestamp", DESCENDING), ("withdrawal_id", DESCENDING)], name="timestamp_withdrawal_id"),
+    ],
+    "broadcast_jobs": [
+        IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+    ],
+    "activity_events": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_desc"),
+    ],
+    "admin_batches": [
+        IndexModel([("batch_id", ASCENDING)], name="batch_id_unique", unique=True),
+    ],
+    "profiles": [
+        IndexModel([("profile_id", ASCENDING)], name="profile_id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at_ttl",
+                   expireAfterSeconds=profiler.PROFILE_TTL_SECONDS),
+    ],
+    "stream_tickets": [
+        IndexModel([("ticket", ASCENDING)], name="ticket_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "referral_milestones": [
+        IndexModel([("user_id", ASCENDING), ("milestone", ASCENDING)], name="user_milestone_unique", unique=True),
+    ],
+}
+
+# Unique indexes the write paths depend on instead of checking first
+REQUIRED_UNIQUE = {
+    ("users", "telegram_id_unique"),
+    ("withdrawals", "withdrawal_id_unique"),
+    ("task_completions", "user_task_unique"),
+    ("referral_milestones", "user_milestone_unique"),
+}
+DUPLICATE_SAMPLE_SIZE = 20
+
+
+class MissingGuardIndex(Exception):
+    """A unique index in REQUIRED_UNIQUE could not be built"""
+
+# Every filtered or sorted query in server.py and bot.py, with sample values.
+# Unfiltered listings of tiny collections (admin tasks, the admin_settings
+# singleton) and lookups by _id (counters) are deliberately left out.
+QUERY_SHAPES = [
+    {"source": "telegram_auth / get_current_user routes / bot", "collection": "users",
+     "filter": {"telegram_id": 1}},
+    {"source": "daily_checkin guarded update", "collection": "users",
+     "filter": {"telegram_id": 1, "$or": [{"last_checkin": None}, {"last_checkin": {"$lte": "2026-01-01"}}]}},
+    {"source": "get_leaderboard / bot leaderboard", "collection": "users",
+     "filter": {}, "sort": [("points", -1), ("telegram_id", 1)], "limit": 500},
+    {"source": "leaderboard rank within a histogram bucket", "collection": "users",
+     "filter": {"$or": [{"points": {"$gt": 1000, "$lt": 1024}}, {"points": 1000, "telegram_id": {"$lt": 1}}]}},
+    {"source": "leaderboard rank of a negative balance", "collection": "users",
+     "filter": {"$or": [{"points": {"$lt": -50}}, {"points": -50, "telegram_id": {"$gt": 1}}]}},
+    {"source": "leaderboard window above", "collection": "users",
+     "filter": {"$or": [{"points": {"$gt": 1000}}, {"points": 1000, "telegram_id": {"$lt": 1}}]},
+     "sort": [("points", 1), ("telegram_id", -1)], "limit": 25},
+    {"source": "leaderboard window below", "collection": "users",
+     "filter": {"$or": [{"points": {"$lt": 1000}}, {"points": 1000, "telegram_id": {"$gt": 1}}]},
+     "sort": [("points", -1), ("telegram_id", 1)], "limit": 25},
+    {"source": "broadcast recipient stream", "collection": "users",
+     "filter": {"telegram_id": {"$gt": 1}}, "sort": [("telegram_id", 1)]},
+    {"source": "get_all_users", "collection": "users",
+     "filter": {"$or": [{"join_date": {"$lt": "2026-01-01"}}, {"join_date": "2026-01-01", "telegram_id": {"$lt": 1}}]},
+     "sort": [("join_date", -1), ("telegram_id", -1)], "limit": 101},
+    {"source": "get_user_details referred users", "collection": "users",
+     "filter": {"referred_by": 1}, "limit": 100},
+    {"source": "top referrers by direct referrals", "collection": "users",
+     "filter": {}, "sort": [("referral_count", -1), ("telegram_id", 1)], "limit": 50},
+    {"source": "top referrers by network size", "collection": "users",
+     "filter": {}, "sort": [("referral_network", -1), ("telegram_id", 1)], "limit": 50},
+    {"source": "deepest referral", "collection": "users",
+     "filter": {"referral_depth": {"$gt": 0}}, "sort": [("referral_depth", -1)], "limit": 1},
+    {"source": "referral graph rebuild $graphLookup", "collection": "users",
+     "filter": {"telegram_id": 1}},
+    {"source": "admin user search prefix", "collection": "users",
+     "filter": {"username_lower": {"$gte": "spe", "$lt": "spe\uffff"}},
+     "sort": [("username_lower", 1), ("telegram_id", 1)], "limit": 21},
+    {"source": "admin user search substring, first page", "collection": "users",
+     "filter": {"username_ngrams": {"$all": ["eed", "pee", "spe"]}},
+     "sort": [("telegram_id", 1)], "limit": 84},
+    {"source": "admin user search substring", "collection": "users",
+     "filter": {"username_ngrams": {"$all": ["eed", "pee", "spe"]}, "telegram_id": {"$gt": 1}},
+     "sort": [("telegram_id", 1)], "limit": 84},
+    {"source": "list_tasks", "collection": "tasks",
+     "filter": {"active": True}, "limit": 100},
+    {"source": "complete_task", "collection": "tasks",
+     "filter": {"task_id": "t", "active": True}},
+    {"source": "get_user_details completions $lookup to tasks", "collection": "tasks",
+     "filter": {"task_id": "t"}},
+    {"source": "list_tasks completions", "collection": "task_completions",
+     "filter": {"user_id": 1}, "limit": 1000},
+    {"source": "get_user_details completions", "collection": "task_completions",
+     "filter": {"user_id": 1}, "sort": [("completed_at", -1)], "limit": 100},
+    {"source": "approve_withdrawal / reject_withdrawal", "collection": "withdrawals",
+     "filter": {"withdrawal_id": "w"}},
+    {"source": "get_my_withdrawals", "collection": "withdrawals",
+     "filter": {"user_id": 1, "$or": [{"timestamp": {"$lt": "2026-01-01"}}, {"timestamp": "2026-01-01", "withdrawal_id": {"$lt": "w"}}]},
+     "sort": [("timestamp", -1), ("withdrawal_id", -1)], "limit": 101},
+    {"source": "get_user_details withdrawals", "collection": "withdrawals",
+     "filter": {"user_id": 1}, "sort": [("timestamp", -1)], "limit": 50},
+    {"source": "get_all_withdrawals", "collection": "withdrawals",
+     "filter": {"$or": [{"timestamp": {"$lt": "2026-01-01"}}, {"timestamp": "2026-01-01", "withdrawal_id": {"$lt": "w"}}]},
+     "sort": [("timestamp", -1), ("withdrawal_id", -1)], "limit": 101},
+    {"source": "withdrawals export by status and date", "collection": "withdrawals",
+     "filter": {"status": "approved", "timestamp": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}},
+    {"source": "withdrawals export by date", "collection": "withdrawals",
+     "filter": {"timestamp": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}},
+    {"source": "users export by minimum points", "collection": "users",
+     "filter": {"points": {"$gte": 1000}}},
+    {"source": "users export by join date", "collection": "users",
+     "filter": {"join_date": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}},
+    {"source": "task_completions export by date", "collection": "task_completions",
+     "filter": {"completed_at": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}},
+    {"source": "pending withdrawal queue", "collection": "withdrawals",
+     "filter": {"status": "pending"}, "sort": [("timestamp", -1)], "limit": 500},
+    {"source": "broadcast resume (expired leases)", "collection": "broadcast_jobs",
+     "filter": {"status": "running", "$or": [{"lease_until": {"$lt": "2026-01-01"}}, {"lease_until": None}]}},
+    {"source": "broadcast status", "collection": "broadcast_jobs",
+     "filter": {}, "sort": [("created_at", -1)], "limit": 5},
+    {"source": "admin_stream ticket", "collection": "stream_tickets",
+     "filter": {"ticket": "t", "expires_at": {"$gt": "2026-01-01"}}},
+    {"source": "get_recent_activities", "collection": "activity_events",
+     "filter": {"timestamp": {"$lt": "2026-01-01"}}, "sort": [("timestamp", -1)], "limit": 50},
+    {"source": "bulk withdrawal settlement read-back", "collection": "withdrawals",
+     "filter": {"withdrawal_id": {"$in": ["w"]}, "batch_id": "b"}},
+    {"source": "admin batch by id", "collection": "admin_batches",
+     "filter": {"batch_id": "b"}},
+    {"source": "admin profile list", "collection": "profiles",
+     "filter": {}, "sort": [("created_at", -1)], "limit": 50},
+    {"source": "admin profile by id", "collection": "profiles",
+     "filter": {"profile_id": "p"}},
+    {"source": "get_referral_stats", "collection": "referral_milestones",
+     "filter": {"user_id": 1}, "limit": 10},
+]
+
+
+def _key_of(key):
+    # Server-side index specs may report 1.0 instead of 1, or "text" for special indexes
+    return tuple(
+        (field, direction if isinstance(direction, str) else int(direction))
+        for field, direction in key
+    )
+
+
+async def find_duplicates(db, collection, fields, limit=DUPLICATE_SAMPLE_SIZE):
+    """Up to ``limit`` key values held by more than one document, with their counts"""
+    pipeline = [
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit},
+    ]
+    return [{**row['_id'], "count": row['count']}
+            async for row in db[collection].aggregate(pipeline, allowDiskUse=True)]
+
+
+async def _guard_failure(db, collection, model, error):
+    name = model.document['name']
+    fields = list(model.document['key'])
+    duplicates = await find_duplicates(db, collection, fields)
+    if not duplicates:
+        return f"{collection}.{name}: {error}"
+    listed = "; ".join(", ".join(f"{k}={v!r}" for k, v in row.items()) for row in duplicates)
+    more = f" (first {len(duplicates)})" if len(duplicates) == DUPLICATE_SAMPLE_SIZE else ""
+    return (f"{collection}.{name}: duplicate ({', '.join(fields)}) values{more}: {listed}. "
+            f"Remove the extra {collection} documents, then restart")
+
+
+async def ensure_indexes(db):
+    """Create any declared index that does not exist yet; raises MissingGuardIndex"""
+    # Must exist as a capped collection before create_indexes would create it plain
+    await activity.ensure_activity_log(db)
+    missing_guards = []
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                if (collection, model.document['name']) in REQUIRED_UNIQUE:
+                    missing_guards.append(await _guard_failure(db, collection, model, e))
+                    continue
+                # Conflicting options or duplicate data; keep the API up and report it
+                logger.error(f"Index {collection}.{model.document['name']} not created: {e}")
+    if missing_guards:
+        raise MissingGuardIndex("Required unique indexes not created:\n" + "\n".join(missing_guards))
+
+
+async def audit_indexes(db):
+    """Return {"missing": [...], "extra": [...]} as "collection.name" strings"""
+    missing, extra = [], []
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing_keys = {_key_of(info['key']): name for name, info in existing.items()}
+        declared_keys = set()
+        for model in models:
+            key = _key_of(model.document['key'].items())
+            declared_keys.add(key)
+            if key not in existing_keys:
+                missing.append(f"{collection}.{model.document['name']}")
+        for key, name in existing_keys.items():
+            if name != "_id_" and key not in declared_keys:
+                extra.append(f"{collection}.{name}")
+    return {"missing": missing, "extra": extra}
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+async def explain_query_shapes(db):
+    """Return [(source, collection, stages)] for every shape whose winning plan has a COLLSCAN"""
+    failures = []
+    for shape in QUERY_SHAPES:
+        command = {"find": shape['collection'], "filter": shape['filter']}
+        if shape.get('sort'):
+            command['sort'] = dict(shape['sort'])
+        if shape.get('limit'):
+            command['limit'] = shape['limit']
+        result = await db.command("explain", command, verbosity="queryPlanner")
+        stages = list(_plan_stages(result['queryPlanner']['winningPlan']))
+        if "COLLSCAN" in stages:
+            failures.append((shape['source'], shape['collection'], stages))
+    return failures
+
+
+def main():
+    import repository
+
+    parser = argparse.ArgumentParser(description="Manage and audit MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "audit", "explain"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = repository.db
+
+    async def run():
+        if args.command == "ensure":
+            try:
+                await ensure_indexes(db)
+            except MissingGuardIndex as e:
+                print(e)
+                return 1
+            return 0
+        if args.command == "audit":
+            report = await audit_indexes(db)
+            for name in report['missing']:
+                print(f"missing: {name}")
+            for name in report['extra']:
+                print(f"extra: {name}")
+            return 1 if report['missing'] else 0
+        failures = await explain_query_shapes(db)
+        for source, collection, stages in failures:
+            print(f"COLLSCAN: {collection} ({source}): {' -> '.join(stages)}")
+        print(f"{len(QUERY_SHAPES) - len(failures)}/{len(QUERY_SHAPES)} query shapes use an index")
+        return 1 if failures else 0
+
+    try:
+        sys.exit(asyncio.run(run()))
+    finally:
+        repository.close()
+
+
+if __name__ == '__main__':
+    main()
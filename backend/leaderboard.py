@@ -0,0 +1,189 @@
+"""Process-local top-K leaderboard kept in step with every points change"""
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+import counters
+
+logger = logging.getLogger(__name__)
+
+# Fields served by /api/leaderboard and the bot leaderboard button
+LEADERBOARD_PROJECTION = {"_id": 0, "telegram_id": 1, "username": 1, "points": 1}
+LEADERBOARD_SORT = [("points", -1), ("telegram_id", 1)]
+
+LEADERBOARD_CAPACITY = int(os.environ.get('LEADERBOARD_CAPACITY', '500'))
+LEADERBOARD_RECONCILE_SECONDS = float(os.environ.get('LEADERBOARD_RECONCILE_SECONDS', '60'))
+# Largest histogram bucket rank_of counts exactly; bigger ones are estimated
+RANK_EXACT_BUCKET_MAX = int(os.environ.get('RANK_EXACT_BUCKET_MAX', '5000'))
+
+
+def _sort_key(doc):
+    return (-doc.get('points', 0), doc['telegram_id'])
+
+
+class Leaderboard:
+    """Top users ordered by points (desc) then telegram_id (asc).
+
+    Invariant: every user whose sort key is at or before ``_boundary`` is
+    tracked. When the last load returned fewer rows than ``capacity`` the
+    whole collection is tracked and ``_boundary`` is None.
+    """
+
+    def __init__(self, capacity=LEADERBOARD_CAPACITY, max_age=LEADERBOARD_RECONCILE_SECONDS):
+        self.capacity = capacity
+        self.max_age = max_age
+        self._entries = {}
+        self._keys = []
+        self._boundary = None
+        self._loaded_at = None
+        self._generation = 0
+        self._pending = None
+        self._lock = asyncio.Lock()
+        self._background = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _reset(self, rows):
+        self._entries = {row['telegram_id']: dict(row) for row in rows}
+        self._keys = sorted(_sort_key(row) for row in rows)
+        self._boundary = self._keys[-1] if len(rows) >= self.capacity else None
+
+    def _remove(self, telegram_id):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            key = _sort_key(entry)
+            idx = bisect.bisect_left(self._keys, key)
+            if idx < len(self._keys) and self._keys[idx] == key:
+                del self._keys[idx]
+
+    def _apply(self, doc):
+        telegram_id = doc['telegram_id']
+        previous = self._entries.get(telegram_id)
+        self._remove(telegram_id)
+
+        entry = {
+            "telegram_id": telegram_id,
+            "username": doc.get('username', previous['username'] if previous else None),
+            "points": doc.get('points', 0),
+        }
+        key = _sort_key(entry)
+        if self._boundary is None or key <= self._boundary:
+            self._entries[telegram_id] = entry
+            bisect.insort(self._keys, key)
+
+        # Keep memory bounded: tighten the boundary instead of growing forever
+        if self._boundary is not None and len(self._keys) > 2 * self.capacity:
+            for _, dropped_id in self._keys[self.capacity:]:
+                self._entries.pop(dropped_id, None)
+            del self._keys[self.capacity:]
+            self._boundary = self._keys[-1]
+
+    def apply(self, doc):
+        """Record a user's current points (doc must carry telegram_id and points)"""
+        if not doc or (not self.loaded and self._pending is None):
+            return
+        if self._pending is not None:
+            self._pending[doc['telegram_id']] = doc
+        self._apply(doc)
+
+    async def refresh(self, db):
+        """Reload the top ``capacity`` users from the database"""
+        generation = self._generation
+        async with self._lock:
+            if self._generation != generation:
+                # Another caller reloaded while we were waiting
+                return
+            self._pending = {}
+            try:
+                rows = await db.users.find({}, LEADERBOARD_PROJECTION).sort(
+                    LEADERBOARD_SORT
+                ).limit(self.capacity).to_list(self.capacity)
+                drift = sum(
+                    1 for row in rows[:100]
+                    if self._entries.get(row['telegram_id'], {}).get('points') != row.get('points')
+                ) if self.loaded else 0
+                pending = self._pending
+                self._reset(rows)
+                # Updates that landed while the query was in flight are newer than the snapshot
+                for doc in pending.values():
+                    self._apply(doc)
+            finally:
+                self._pending = None
+            self._loaded_at = time.monotonic()
+            self._generation += 1
+            if drift:
+                logger.info(f"Leaderboard reconciled {drift} drifted entries")
+
+    def _refresh_in_background(self, db):
+        if self._background is None or self._background.done():
+            self._background = asyncio.ensure_future(self.refresh(db))
+
+    async def top(self, db, limit):
+        """Return the top ``limit`` users, loading from the database only when needed"""
+        incomplete = self._boundary is not None and len(self._keys) < min(limit, self.capacity)
+        if not self.loaded or incomplete:
+            await self.refresh(db)
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self._refresh_in_background(db)
+
+        return [dict(self._entries[telegram_id]) for _, telegram_id in self._keys[:limit]]
+
+    async def run_reconciler(self, db, interval=None):
+        """Periodically reload from the database to correct any drift"""
+        interval = interval or self.max_age
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(db)
+            except Exception as e:
+                logger.error(f"Leaderboard reconcile error: {e}")
+
+
+async def rank_of(db, telegram_id, points):
+    """Return (1-based rank, total users, exact) in leaderboard order.
+
+    Users in higher buckets come from the points histogram. Within the
+    caller's own bucket, users are counted on the points index only while
+    the histogram says the bucket holds at most RANK_EXACT_BUCKET_MAX users,
+    so no request counts more than that many. Larger buckets (bucket 0,
+    where every new user sits, and big tie groups) are estimated instead:
+    users scoring more are spread evenly over the bucket's range, and the
+    caller is ranked first among everyone on the same points, as in
+    standard competition ranking.
+
+    Negative balances (left by admin adjustments) share bucket 0 with zero,
+    so they are ranked from the bottom by counting the few users below them.
+    """
+    histogram = await counters.get_histogram(db)
+    total = sum(histogram.values())
+    if points < 0:
+        below = await db.users.count_documents({"$or": [
+            {"points": {"$lt": points}},
+            {"points": points, "telegram_id": {"$gt": telegram_id}},
+        ]}, limit=RANK_EXACT_BUCKET_MAX)
+        position = max(total - below, 1)
+        return position, max(total, position), below < RANK_EXACT_BUCKET_MAX
+
+    lower, upper = counters.points_bucket(points)
+    above = sum(count for bucket, count in histogram.items() if bucket > lower)
+    in_bucket = histogram.get(lower, 0)
+    if in_bucket <= RANK_EXACT_BUCKET_MAX:
+        # Ties are ordered by telegram_id, as on the leaderboard
+        above += await db.users.count_documents({"$or": [
+            {"points": {"$gt": points, "$lt": upper}},
+            {"points": points, "telegram_id": {"$lt": telegram_id}},
+        ]}, limit=RANK_EXACT_BUCKET_MAX)
+        exact = True
+    else:
+        # Scores above the caller's take up (upper - 1 - points) of the bucket's (upper - lower) values
+        above += in_bucket * (upper - 1 - points) // (upper - lower)
+        exact = False
+    position = above + 1
+    return position, max(total, position), exact
+
+
+leaderboard = Leaderboard()
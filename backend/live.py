@@ -0,0 +1,162 @@
+"""In-process pub/sub feeding the admin dashboard's Server-Sent Events stream.
+
+Routes publish through ``activity.record`` and ``counters.increment``. Every
+connected admin gets its own bounded queue fed by the one broker, so extra
+viewers add no database reads after the initial snapshot. A viewer that
+falls ``LIVE_QUEUE_SIZE`` events behind is dropped to a single "resync" event
+and re-fetches over REST instead of holding up publishers.
+
+With several API workers, set LIVE_CHANGE_STREAMS=1 (requires a replica set):
+events then come from change streams on ``activity_events`` and ``counters``
+so every worker sees every write, and local publishing is switched off.
+"""
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', '256'))
+LIVE_CHANGE_STREAMS = os.environ.get('LIVE_CHANGE_STREAMS', '').lower() in ('1', 'true', 'yes')
+HEARTBEAT_SECONDS = 15.0
+
+# Activity types that change a withdrawal, and the status they leave it in
+WITHDRAWAL_STATUS = {
+    "withdrawal": "pending",
+    "withdrawal_approved": "approved",
+    "withdrawal_rejected": "rejected",
+}
+
+
+class Subscription:
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, message):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Drop the backlog; the client re-fetches once instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.overflowed = True
+            self.queue.put_nowait(("resync", {}))
+
+
+class Broker:
+    def __init__(self, queue_size=LIVE_QUEUE_SIZE, local=not LIVE_CHANGE_STREAMS):
+        self.queue_size = queue_size
+        self.local = local
+        self._subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        self.published += 1
+        for subscription in self._subscribers:
+            was_overflowed = subscription.overflowed
+            subscription.offer((event, data))
+            if subscription.overflowed and not was_overflowed:
+                self.dropped += 1
+
+    def publish_activity(self, doc):
+        self.publish("activity", doc)
+        status = WITHDRAWAL_STATUS.get(doc.get('type'))
+        if status and doc.get('withdrawal_id'):
+            self.publish("withdrawal", {
+                "withdrawal_id": doc['withdrawal_id'],
+                "user_id": doc['telegram_id'],
+                "username": doc['username'],
+                "amount": doc.get('amount'),
+                "status": status,
+                "timestamp": doc['timestamp'],
+            })
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "change_streams": not self.local,
+        }
+
+
+broker = Broker()
+
+
+def publish_activity(doc):
+    """Called after an activity event is stored"""
+    if broker.local:
+        broker.publish_activity(doc)
+
+
+def publish_stats(deltas):
+    """Called with dashboard stat deltas, e.g. {"total_users": 1}"""
+    if broker.local and deltas:
+        broker.publish("stats", {"deltas": deltas})
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream(subscription, snapshot):
+    """Yield SSE frames: the snapshot first, then events, with heartbeats"""
+    yield format_sse("snapshot", snapshot)
+    while True:
+        try:
+            event, data = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            # Comment frame keeps proxies from closing an idle connection
+            yield ": ping\n\n"
+            continue
+        if event == "resync":
+            subscription.overflowed = False
+        yield format_sse(event, data)
+
+
+async def watch_changes(db):
+    """Publish from change streams so every worker sees writes from all of them"""
+    import activity
+    import counters
+
+    async def watch_activity():
+        async with db[activity.COLLECTION].watch([{"$match": {"operationType": "insert"}}]) as changes:
+            async for change in changes:
+                doc = change['fullDocument']
+                doc.pop('_id', None)
+                broker.publish_activity(doc)
+
+    async def watch_counters():
+        async with db.counters.watch(full_document="updateLookup") as changes:
+            async for change in changes:
+                key = change['documentKey']['_id']
+                doc = change.get('fullDocument') or {}
+                if key == counters.GLOBAL_KEY:
+                    totals = {f: doc.get(f, 0) for f in counters.GLOBAL_FIELDS}
+                elif key == counters.daily_key():
+                    totals = {"users_today": doc.get("users_joined", 0)}
+                else:
+                    continue
+                broker.publish("stats", {"totals": totals})
+
+    while True:
+        try:
+            await asyncio.gather(watch_activity(), watch_counters())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Change stream error, retrying: {e}")
+            await asyncio.sleep(5)
@@ -0,0 +1,303 @@
+"""In-process metrics exposed at ``/metrics`` in the Prometheus text format.
+
+Three sources feed it:
+
+- ``MetricsMiddleware``: per-route request latency, status counts and the
+  number of requests in flight; routes are labelled by their template
+  (``/api/admin/users/{telegram_id}``), unknown paths as ``unmatched``
+- ``command_listener``: a pymongo CommandListener timing every command per
+  collection, with commands slower than MONGO_SLOW_QUERY_MS logged and kept
+  in a short in-memory slow-query log
+- ``timed_handler``: a decorator timing the bot's update handlers
+
+Values are recorded without locks: every thread (the event loop, Motor's
+executor threads) writes only to its own shard, and a scrape sums the
+shards. A scrape can see one thread's update half-applied to a histogram,
+which Prometheus tolerates; nothing is ever lost.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+MONGO_SLOW_QUERY_MS = float(os.environ.get('MONGO_SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', '200'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_shards = []
+_families = {}
+
+
+def _shard():
+    """This thread's {(metric name, labels): value}; created on first use"""
+    shard = getattr(_local, 'values', None)
+    if shard is None:
+        shard = _local.values = {}
+        _shards.append(shard)
+    return shard
+
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        _families[name] = self
+
+    def collect(self):
+        """{labels: value} summed over every thread's shard"""
+        totals = {}
+        for shard in list(_shards):
+            for (name, labels), value in list(shard.items()):
+                if name == self.name:
+                    totals[labels] = self._merge(totals.get(labels), value)
+        return totals
+
+    @staticmethod
+    def _merge(total, value):
+        return value if total is None else total + value
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = _shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """A counter that can go down; each thread keeps its own running delta"""
+    kind = "gauge"
+
+    def add(self, amount, *labels):
+        self.inc(*labels, amount=amount)
+
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = _shard()
+        key = (self.name, labels)
+        row = shard.get(key)
+        if row is None:
+            # Per-bucket counts, the +Inf overflow, then the sum of observations
+            row = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @staticmethod
+    def _merge(total, value):
+        value = list(value)
+        return value if total is None else [a + b for a, b in zip(total, value)]
+
+
+class Callback(_Family):
+    """A metric read at scrape time from ``fn() -> {labels: value}``"""
+
+    def __init__(self, name, help, kind, fn, labels=()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def collect(self):
+        return self.fn()
+
+
+http_requests = Counter("http_requests_total", "HTTP responses by route, method and status",
+                        ("route", "method", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route",
+                         ("route", "method"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served")
+mongo_latency = Histogram("mongodb_command_duration_seconds", "MongoDB command latency by collection",
+                          ("collection", "command"))
+mongo_failures = Counter("mongodb_command_failures_total", "Failed MongoDB commands by collection",
+                         ("collection", "command"))
+mongo_slow = Counter("mongodb_slow_commands_total", "MongoDB commands slower than MONGO_SLOW_QUERY_MS",
+                     ("collection", "command"))
+bot_latency = Histogram("bot_handler_duration_seconds", "Telegram bot handler latency", ("handler",))
+bot_errors = Counter("bot_handler_errors_total", "Telegram bot handlers that raised", ("handler",))
+
+
+# Rendering
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for name in sorted(_families):
+        family = _families[name]
+        try:
+            values = family.collect()
+        except Exception as e:
+            logger.error(f"Metrics collection error for {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {family.help}")
+        lines.append(f"# TYPE {name} {family.kind}")
+        for labels in sorted(values, key=lambda ls: tuple(map(str, ls))):
+            value = values[labels]
+            if family.kind != "histogram":
+                lines.append(f"{name}{_labels(family.labels, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(family.buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{name}_bucket{_labels(family.labels, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(family.labels, labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(family.labels, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.add(1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.add(-1)
+            # The router stores the matched route in the scope it was given
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_latency.observe(time.perf_counter() - start, route, scope["method"])
+            http_requests.inc(route, scope["method"], str(status))
+
+
+# MongoDB
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def _collection(command_name, command):
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+def _shape(command_name, command):
+    """Field names (never values) of a command's filter, or an aggregation's stages"""
+    if command_name == "aggregate":
+        return [next(iter(stage), "") for stage in command.get("pipeline", [])]
+    filter_ = command.get("filter") or command.get("query")
+    statements = command.get("updates") or command.get("deletes")
+    if filter_ is None and statements:
+        filter_ = statements[0].get("q")
+    return sorted(filter_) if isinstance(filter_, dict) else []
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Times every command the client sends; pymongo calls this from Motor's worker threads"""
+
+    def __init__(self, slow_ms=MONGO_SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        # (connection, request id) -> (collection, shape); started/finished pairs share a thread
+        self._pending = {}
+
+    def started(self, event):
+        self._pending[(event.connection_id, event.request_id)] = (
+            _collection(event.command_name, event.command),
+            _shape(event.command_name, event.command),
+        )
+
+    def _finished(self, event, failed):
+        collection, shape = self._pending.pop((event.connection_id, event.request_id), ("", []))
+        seconds = event.duration_micros / 1e6
+        mongo_latency.observe(seconds, collection, event.command_name)
+        if failed:
+            mongo_failures.inc(collection, event.command_name)
+        if seconds * 1000 >= self.slow_ms:
+            mongo_slow.inc(collection, event.command_name)
+            slow_queries.append({
+                "at": datetime.now(timezone.utc).isoformat(),
+                "collection": collection,
+                "command": event.command_name,
+                "shape": shape,
+                "duration_ms": round(seconds * 1000, 2),
+                "failed": failed,
+            })
+            logger.warning(f"Slow MongoDB {event.command_name} on {collection or event.database_name} "
+                           f"{shape}: {seconds * 1000:.1f}ms")
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+
+command_listener = CommandTimer()
+
+
+# Bot
+
+def timed_handler(handler):
+    """Record a bot handler's latency and errors under its function name"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            bot_errors.inc(name)
+            raise
+        finally:
+            bot_latency.observe(time.perf_counter() - start, name)
+
+    return wrapper
@@ -0,0 +1,88 @@
+"""Keyset pagination with opaque cursors.
+
+A page is sorted descending on a (sort field, unique tiebreaker) pair and the
+cursor encodes that pair for the last item returned, so the next page starts
+with a range condition the compound index can seek to, however deep it is.
+
+Cursors come back from clients, so every decoded value is checked against
+the type its sort key holds before it goes into a query; anything else
+(an operator document such as ``{"$gt": ""}``) is an InvalidCursor.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '500'))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+# Checks for decoded cursor values, one per sort key
+
+def string(value):
+    return isinstance(value, str)
+
+
+def integer(value):
+    # bool is an int subclass but never a sort key value
+    return type(value) is int
+
+
+def iso_date(value):
+    """An ISO-8601 timestamp string, as join_date and timestamp are stored"""
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def decode_cursor(cursor, checks):
+    """The cursor's values, which must pass ``checks`` (one per value); raises InvalidCursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(checks):
+        raise InvalidCursor(cursor)
+    if not all(check(value) for check, value in zip(checks, values)):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def page_size(limit=None):
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE"""
+    if not limit:
+        return PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def after_filter(keys, values):
+    """Filter for items strictly after ``values`` in descending (keys) order"""
+    (field, tiebreak), (value, tiebreak_value) = keys, values
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, tiebreak: {"$lt": tiebreak_value}},
+    ]}
+
+
+def page(items, keys, limit):
+    """Build {"items", "next_cursor"} from up to limit + 1 fetched items"""
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor([last.get(keys[0]), last[keys[1]]])
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,273 @@
+"""On-demand profiling of single API requests.
+
+An admin request sent with ``X-Profile: 1`` (or ``?profile=1``) runs under
+a sampling profiler. A background thread looks at the request's coroutine
+every PROFILE_INTERVAL_MS:
+
+- while it is running, the event loop thread's stack above it is recorded
+  as on-CPU time (route code, sorting, pydantic validation, JSON encoding)
+- while it is suspended, its chain of awaits is recorded as waiting time,
+  counted as database time when one of its MongoDB commands is in flight
+
+A command listener adds the exact MongoDB commands the request sent, found
+through a context variable that Motor carries into its worker threads.
+Tasks the request spawns appear as a ``<future>`` await in its stack; their
+database commands are still counted.
+
+The profile is stored in the ``profiles`` collection for PROFILE_TTL_SECONDS
+and its id returned in ``X-Profile-Id``, with a ``Server-Timing`` header
+summarising it. Stacks are in the collapsed format read by flamegraph.pl
+and speedscope, weighted in microseconds. Requests without the flag only pay for the flag check.
+"""
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '2'))
+PROFILE_TTL_SECONDS = int(os.environ.get('PROFILE_TTL_SECONDS', '86400'))
+PROFILE_MAX_CONCURRENT = int(os.environ.get('PROFILE_MAX_CONCURRENT', '2'))
+PROFILE_SUMMARY_PROJECTION = {"_id": 0, "stacks": 0, "db.commands": 0}
+
+_active = contextvars.ContextVar("profile", default=None)
+_running = 0
+
+
+def _label(code):
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _await_chain(coro, thread_frame):
+    """(stack labels root first, on_cpu) for a coroutine at this instant"""
+    labels = []
+    obj = coro
+    while obj is not None:
+        frame = getattr(obj, 'cr_frame', None) or getattr(obj, 'gi_frame', None) or getattr(obj, 'ag_frame', None)
+        if frame is None:
+            # A future (Motor calls, tasks, sleeps) ends the chain
+            labels.append("<future>")
+            return labels, False
+        if getattr(obj, 'cr_running', False) or getattr(obj, 'gi_running', False) or getattr(obj, 'ag_running', False):
+            frames = []
+            current = thread_frame
+            while current is not None and current is not frame:
+                frames.append(current)
+                current = current.f_back
+            if current is None:
+                # Finished between the two reads; drop the sample
+                return None, True
+            return labels + [_label(f.f_code) for f in reversed(frames + [frame])], True
+        labels.append(_label(frame.f_code))
+        obj = getattr(obj, 'cr_await', None) or getattr(obj, 'gi_yieldfrom', None) or getattr(obj, 'ag_await', None)
+    return labels, False
+
+
+class Profile:
+    def __init__(self, method, path):
+        self.profile_id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stacks = {}
+        self.samples = 0
+        self.time_ms = {"cpu": 0.0, "db": 0.0, "other": 0.0}
+        # Written from Motor's worker threads; each command only touches its own entry
+        self.db_pending = {}
+        self.db_commands = []
+
+    def sample(self, coro, thread_frame, elapsed_ms):
+        labels, on_cpu = _await_chain(coro, thread_frame)
+        if labels is None:
+            return
+        kind = "cpu" if on_cpu else ("db" if self.db_pending else "other")
+        if kind == "db":
+            labels = labels[:-1] + ["[mongodb]"]
+        stack = ";".join(labels)
+        # Weighted by time, since samples are further apart while the loop holds the GIL
+        self.stacks[stack] = self.stacks.get(stack, 0) + round(elapsed_ms * 1000)
+        self.samples += 1
+        self.time_ms[kind] += elapsed_ms
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.stacks.items()))
+
+    def duration_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def db_summary(self):
+        by_command = {}
+        for collection, command, ms in self.db_commands:
+            entry = by_command.setdefault((collection, command), {
+                "collection": collection, "command": command, "count": 0, "total_ms": 0.0
+            })
+            entry['count'] += 1
+            entry['total_ms'] = round(entry['total_ms'] + ms, 3)
+        return {
+            "count": len(self.db_commands),
+            "total_ms": round(sum(ms for _, _, ms in self.db_commands), 3),
+            "by_command": sorted(by_command.values(), key=lambda e: -e['total_ms']),
+            "commands": [{"collection": c, "command": n, "ms": round(ms, 3)} for c, n, ms in self.db_commands],
+        }
+
+    def server_timing(self):
+        return ", ".join([
+            f"cpu;dur={self.time_ms['cpu']:.1f}",
+            f"db;dur={self.time_ms['db']:.1f}",
+            f"wait;dur={self.time_ms['other']:.1f}",
+            f"total;dur={self.duration_ms():.1f}",
+        ])
+
+    def to_doc(self, route, status):
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status,
+            "created_at": self.started_at,
+            "duration_ms": round(self.duration_ms(), 3),
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "samples": self.samples,
+            "breakdown_ms": {kind: round(ms, 3) for kind, ms in self.time_ms.items()},
+            "db": self.db_summary(),
+            "stacks": self.collapsed(),
+        }
+
+
+class Sampler(threading.Thread):
+    def __init__(self, profile, coro, thread_id):
+        super().__init__(name=f"profiler-{profile.profile_id[:8]}", daemon=True)
+        self.profile = profile
+        self.coro = coro
+        self.thread_id = thread_id
+        self._done = threading.Event()
+
+    def run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        last = time.perf_counter()
+        while not self._done.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.profile.sample(self.coro, frame, (now - last) * 1000)
+            last = now
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Attributes MongoDB commands to the profile active in the caller's context"""
+
+    def started(self, event):
+        profile = _active.get()
+        if profile is not None:
+            profile.db_pending[(event.connection_id, event.request_id)] = event.command.get(event.command_name)
+
+    def _finished(self, event):
+        profile = _active.get()
+        if profile is not None:
+            collection = profile.db_pending.pop((event.connection_id, event.request_id), None)
+            profile.db_commands.append((
+                collection if isinstance(collection, str) else "",
+                event.command_name,
+                event.duration_micros / 1000,
+            ))
+
+    succeeded = failed = _finished
+
+
+command_listener = CommandRecorder()
+
+
+def _requested(scope):
+    if b"profile=" in scope.get("query_string", b""):
+        values = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [])
+        if values and values[0] not in ("", "0", "false"):
+            return True
+    for name, value in scope["headers"]:
+        if name == b"x-profile" and value not in (b"", b"0", b"false"):
+            return True
+    return False
+
+
+def _bearer_token(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            return value[7:].decode("latin-1")
+    return None
+
+
+class ProfilerMiddleware:
+    """Profiles flagged requests from admins; ``authorize(token)`` decides who counts as one"""
+
+    def __init__(self, app, authorize, store):
+        self.app = app
+        self.authorize = authorize
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        global _running
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+        token = _bearer_token(scope)
+        if _running >= PROFILE_MAX_CONCURRENT or not token or not self.authorize(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"])
+        status = 500
+
+        async def send_with_profile(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.profile_id.encode()),
+                    (b"server-timing", profile.server_timing().encode()),
+                ]}
+            await send(message)
+
+        coro = self.app(scope, receive, send_with_profile)
+        sampler = Sampler(profile, coro, threading.get_ident())
+        context_token = _active.set(profile)
+        _running += 1
+        sampler.start()
+        try:
+            await coro
+        finally:
+            sampler.stop()
+            _running -= 1
+            _active.reset(context_token)
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            try:
+                await self.store(profile.to_doc(route, status))
+            except Exception as e:
+                logger.error(f"Profile store error: {e}")
+
+
+# Storage
+
+async def save(db, doc):
+    await db.profiles.insert_one(dict(doc))
+
+
+async def recent(db, limit=50):
+    return await db.profiles.find({}, PROFILE_SUMMARY_PROJECTION).sort("created_at", -1).limit(limit).to_list(limit)
+
+
+async def get(db, profile_id):
+    return await db.profiles.find_one({"profile_id": profile_id}, {"_id": 0})
@@ -0,0 +1,161 @@
+"""Per-user token buckets and in-flight limits for the write endpoints.
+
+Each (telegram_id, route) pair gets a bucket of ``capacity`` tokens that
+refills over ``period`` seconds. A request that finds its bucket empty is
+answered 429 with Retry-After before the route touches the database.
+
+Rates come from RATE_LIMIT_<ROUTE> as "capacity/period", e.g.
+RATE_LIMIT_CHECKIN=5/60. Buckets are process-local unless RATE_LIMIT_REDIS_URL
+is set (requires the ``redis`` package), in which case all workers share
+them. Redis errors fail open so an outage never blocks users.
+
+Separately, each route admits at most RATE_LIMIT_MAX_IN_FLIGHT concurrent
+requests; beyond that requests are shed with 503 instead of queueing on
+the database.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Route name -> default "capacity/period"
+DEFAULT_RATES = {
+    "checkin": "5/60",
+    "claim_join_bonus": "5/60",
+    "claim_referral_reward": "10/60",
+    "tap_batch": "60/60",
+    "tasks_complete": "30/60",
+    "withdrawal_request": "5/60",
+}
+
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_MAX_IN_FLIGHT = int(os.environ.get('RATE_LIMIT_MAX_IN_FLIGHT', '200'))
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+
+
+def parse_rate(spec):
+    """"capacity/period" -> (capacity, period seconds)"""
+    capacity, period = spec.split('/')
+    return int(capacity), float(period)
+
+
+RATES = {
+    route: parse_rate(os.environ.get(f"RATE_LIMIT_{route.upper()}", spec))
+    for route, spec in DEFAULT_RATES.items()
+}
+
+
+class LocalBuckets:
+    """Token buckets in an LRU; evicting a bucket only ever forgives a client"""
+
+    def __init__(self, maxsize=RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    async def acquire(self, key, capacity, period):
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        rate = capacity / period
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+# Same algorithm as LocalBuckets, atomically in Redis
+_REDIS_ACQUIRE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker through Redis"""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._acquire = self._client.register_script(_REDIS_ACQUIRE)
+
+    async def acquire(self, key, capacity, period):
+        try:
+            result = await self._acquire(
+                keys=[self.prefix + key], args=[capacity, capacity / period, time.time()]
+            )
+        except Exception as e:
+            logger.error(f"Rate limit backend error, allowing request: {e}")
+            return 0.0
+        return float(result)
+
+
+def create_buckets(url=RATE_LIMIT_REDIS_URL):
+    if url and redis is None:
+        logger.warning("RATE_LIMIT_REDIS_URL is set but redis is not installed; using process-local buckets")
+    if url and redis is not None:
+        return RedisBuckets(url)
+    return LocalBuckets()
+
+
+class Limiter:
+    def __init__(self, buckets=None, max_in_flight=RATE_LIMIT_MAX_IN_FLIGHT):
+        self.buckets = buckets or create_buckets()
+        self.max_in_flight = max_in_flight
+        self._in_flight = {}
+        self.limited = 0
+        self.shed = 0
+
+    async def check(self, route, telegram_id):
+        """Seconds to wait before retrying, rounded up, or 0 if allowed"""
+        capacity, period = RATES[route]
+        retry_after = await self.buckets.acquire(f"{route}:{telegram_id}", capacity, period)
+        if retry_after > 0:
+            self.limited += 1
+            return max(1, math.ceil(retry_after))
+        return 0
+
+    def enter(self, route):
+        """Admit a request to ``route``; False if it is already at capacity"""
+        if self._in_flight.get(route, 0) >= self.max_in_flight:
+            self.shed += 1
+            return False
+        self._in_flight[route] = self._in_flight.get(route, 0) + 1
+        return True
+
+    def leave(self, route):
+        self._in_flight[route] -= 1
+
+    def stats(self):
+        return {"in_flight": dict(self._in_flight), "limited": self.limited, "shed": self.shed}
+
+
+limiter = Limiter()
@@ -0,0 +1,197 @@
+"""Referral graph maintained incrementally as users join through a link.
+
+Besides ``referred_by`` and the direct ``referral_count``, every user carries:
+
+- ``referral_path``: ancestor telegram_ids, nearest (the referrer) first,
+  up to REFERRAL_MAX_DEPTH of them
+- ``referral_depth``: length of that path (0 for users who joined directly)
+- ``referral_network``: everyone below the user in the tree, at any level
+- ``referral_levels``: that network broken down by level, ``{"1": n, "2": m}``
+
+``record_referral`` updates the new user and all their ancestors when a
+referral is counted, so top referrers and tree shapes are plain indexed
+reads. Run ``python referrals.py rebuild`` to recompute the graph with
+``$graphLookup``, ``verify`` to report drift, or ``top`` to list referrers.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_MAX_DEPTH = int(os.environ.get('REFERRAL_MAX_DEPTH', '10'))
+GRAPH_FIELDS = ("referral_path", "referral_depth", "referral_network", "referral_levels")
+
+# Sort orders for top referrers
+TOP_REFERRER_SORTS = {
+    "direct": [("referral_count", -1), ("telegram_id", 1)],
+    "network": [("referral_network", -1), ("telegram_id", 1)],
+}
+REFERRER_PROJECTION = {
+    "_id": 0, "telegram_id": 1, "username": 1, "referral_count": 1,
+    "referral_network": 1, "referral_levels": 1, "referral_depth": 1, "join_date": 1,
+}
+
+
+def _level_deltas(level):
+    return {"referral_network": 1, f"referral_levels.{level}": 1}
+
+
+async def record_referral(db, telegram_id, referrer_id):
+    """Count a new user's referral; returns False if the referrer does not exist"""
+    if not referrer_id or referrer_id == telegram_id:
+        return False
+    referrer = await db.users.find_one_and_update(
+        {"telegram_id": referrer_id},
+        {"$inc": {"referral_count": 1, **_level_deltas(1)}},
+        projection={"_id": 0, "referral_path": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not referrer:
+        return False
+
+    path = ([referrer_id] + (referrer.get('referral_path') or []))[:REFERRAL_MAX_DEPTH]
+    ops = [UpdateOne(
+        {"telegram_id": telegram_id},
+        {"$set": {"referral_path": path, "referral_depth": len(path)}}
+    )]
+    # The referrer is already counted; everyone above them gains an indirect referral
+    ops += [
+        UpdateOne({"telegram_id": ancestor}, {"$inc": _level_deltas(level)})
+        for level, ancestor in enumerate(path[1:], start=2)
+    ]
+    await db.users.bulk_write(ops, ordered=False)
+    return True
+
+
+async def top_referrers(db, by="network", limit=50):
+    users = await db.users.find({}, REFERRER_PROJECTION).sort(TOP_REFERRER_SORTS[by]).limit(limit).to_list(limit)
+    for user in users:
+        user['indirect_referral_count'] = user.get('referral_network', 0) - user.get('referral_levels', {}).get('1', 0)
+    return users
+
+
+async def deepest_referral(db):
+    """The user at the greatest referral depth, or None"""
+    return await db.users.find_one(
+        {"referral_depth": {"$gt": 0}},
+        {"_id": 0, "telegram_id": 1, "username": 1, "referral_depth": 1, "referral_path": 1},
+        sort=[("referral_depth", -1)]
+    )
+
+
+async def compute_graph(db):
+    """Recompute every user's graph fields from ``referred_by`` with $graphLookup.
+
+    Returns {telegram_id: fields}; only referrers that exist are followed.
+    """
+    pipeline = [
+        {"$match": {"referred_by": {"$ne": None}}},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": "$referred_by",
+            "connectFromField": "referred_by",
+            "connectToField": "telegram_id",
+            "as": "ancestors",
+            "maxDepth": REFERRAL_MAX_DEPTH - 1,
+            "depthField": "level",
+        }},
+        {"$project": {"_id": 0, "telegram_id": 1, "ancestors.telegram_id": 1, "ancestors.level": 1}},
+    ]
+    graph = {}
+
+    def fields(telegram_id):
+        return graph.setdefault(telegram_id, {
+            "referral_path": [], "referral_depth": 0, "referral_network": 0, "referral_levels": {}
+        })
+
+    async for row in db.users.aggregate(pipeline):
+        path = []
+        for ancestor in sorted(row['ancestors'], key=lambda a: a['level']):
+            # Stop at a gap (missing referrer) or a cycle back to the user
+            if ancestor['level'] != len(path) or ancestor['telegram_id'] == row['telegram_id']:
+                break
+            path.append(ancestor['telegram_id'])
+        user = fields(row['telegram_id'])
+        user['referral_path'] = path
+        user['referral_depth'] = len(path)
+        for level, ancestor in enumerate(path, start=1):
+            counts = fields(ancestor)
+            counts['referral_network'] += 1
+            counts['referral_levels'][str(level)] = counts['referral_levels'].get(str(level), 0) + 1
+    return graph
+
+
+async def rebuild_graph(db, batch_size=1000):
+    """Overwrite every user's graph fields with values recomputed from referred_by"""
+    graph = await compute_graph(db)
+    await db.users.update_many({}, {"$set": {
+        "referral_path": [], "referral_depth": 0, "referral_network": 0, "referral_levels": {}
+    }})
+    ops = [UpdateOne({"telegram_id": telegram_id}, {"$set": fields}) for telegram_id, fields in graph.items()]
+    for start in range(0, len(ops), batch_size):
+        await db.users.bulk_write(ops[start:start + batch_size], ordered=False)
+    logger.info(f"Rebuilt the referral graph for {len(graph)} users")
+    return graph
+
+
+async def verify_graph(db):
+    """Return a list of (telegram_id, field, stored, expected) for every drifted field"""
+    graph = await compute_graph(db)
+    empty = {"referral_path": [], "referral_depth": 0, "referral_network": 0, "referral_levels": {}}
+    mismatches = []
+    async for user in db.users.find({}, {"_id": 0, "telegram_id": 1, **{f: 1 for f in GRAPH_FIELDS}}):
+        expected = graph.get(user['telegram_id'], empty)
+        for field in GRAPH_FIELDS:
+            actual = user.get(field, empty[field])
+            if actual != expected[field]:
+                mismatches.append((user['telegram_id'], field, actual, expected[field]))
+    return mismatches
+
+
+async def ensure_graph(db):
+    """Build the graph on first start so referrals made before it existed are counted"""
+    if await db.users.find_one({"referred_by": {"$ne": None}, "referral_path": {"$exists": False}}, {"_id": 1}):
+        logger.info("Referral graph missing, rebuilding from referred_by")
+        await rebuild_graph(db)
+
+
+def main():
+    import repository
+
+    parser = argparse.ArgumentParser(description="Rebuild, verify or report on the referral graph")
+    parser.add_argument("command", choices=["rebuild", "verify", "top"])
+    parser.add_argument("--by", choices=list(TOP_REFERRER_SORTS), default="network")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = repository.db
+
+    async def run():
+        if args.command == "rebuild":
+            await rebuild_graph(db)
+            return 0
+        if args.command == "top":
+            for user in await top_referrers(db, args.by, args.limit):
+                print(f"{user['telegram_id']:>12} @{user.get('username')}: direct={user.get('referral_count', 0)} "
+                      f"network={user.get('referral_network', 0)} levels={user.get('referral_levels', {})}")
+            return 0
+        mismatches = await verify_graph(db)
+        for telegram_id, field, actual, expected in mismatches:
+            print(f"user:{telegram_id}.{field}: stored={actual} expected={expected}")
+        print(f"{len(mismatches)} mismatched fields")
+        return 1 if mismatches else 0
+
+    try:
+        sys.exit(asyncio.run(run()))
+    finally:
+        repository.close()
+
+
+if __name__ == '__main__':
+    main()
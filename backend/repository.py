@@ -0,0 +1,369 @@
+"""Shared MongoDB access for the API and the bot.
+
+Owns the single Motor client, so both entry points share one connection pool
+when they run in the same process, and holds the query shapes they use for
+users, tasks, task completions, withdrawals, referral milestones,
+settings and admin stream tickets.
+"""
+import asyncio
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+import pagination
+import profiler
+import user_search
+from leaderboard import LEADERBOARD_PROJECTION
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MONGO_URL = os.environ['MONGO_URL']
+DB_NAME = os.environ['DB_NAME']
+
+
+def create_client(event_listeners=None) -> AsyncIOMotorClient:
+    """Build the process-wide client with pool and timeout settings from the environment"""
+    return AsyncIOMotorClient(
+        MONGO_URL,
+        appname="hbd-speedy",
+        maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '5')),
+        maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+        serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+        # zstd/snappy need their optional packages; zlib always works
+        compressors=os.environ.get('MONGO_COMPRESSORS', 'zlib'),
+        retryWrites=True,
+        retryReads=True,
+        event_listeners=event_listeners or [],
+    )
+
+
+client = create_client([metrics.command_listener, profiler.command_listener])
+db = client[DB_NAME]
+
+# Users
+
+USER_PROJECTION = {"_id": 0, "username_ngrams": 0}
+# Keyset pagination orders: descending sort field, then a unique tiebreaker
+USER_PAGE_KEYS = ("join_date", "telegram_id")
+WITHDRAWAL_PAGE_KEYS = ("timestamp", "withdrawal_id")
+USER_CURSOR_CHECKS = (pagination.iso_date, pagination.integer)
+WITHDRAWAL_CURSOR_CHECKS = (pagination.iso_date, pagination.string)
+
+
+def new_user_doc(telegram_id: int, username: str, referred_by: Optional[int] = None) -> dict:
+    """The document every new user starts with, whichever entry point creates it"""
+    return {
+        "telegram_id": telegram_id,
+        "username": username,
+        **user_search.search_fields(username),
+        "points": 0,
+        "join_date": datetime.now(timezone.utc).isoformat(),
+        "referral_count": 0,
+        "streak_day": 0,
+        "last_checkin": None,
+        "referred_by": referred_by,
+        # Filled in by referrals.record_referral once the referral is counted
+        "referral_path": [],
+        "referral_depth": 0,
+        "referral_network": 0,
+        "referral_levels": {},
+        "join_bonus_claimed": False,
+        "tasks_completed": 0,
+        "withdrawal_count": 0
+    }
+
+
+async def get_user(telegram_id: int, projection: Optional[dict] = None) -> Optional[dict]:
+    return await db.users.find_one({"telegram_id": telegram_id}, projection or USER_PROJECTION)
+
+
+async def user_exists(telegram_id: int) -> bool:
+    return await db.users.find_one({"telegram_id": telegram_id}, {"_id": 1}) is not None
+
+
+async def get_or_create_user(telegram_id: int, username: str,
+                             referred_by: Optional[int] = None) -> Tuple[dict, bool]:
+    """Return (user, created) in a single upsert round trip"""
+    user_doc = new_user_doc(telegram_id, username, referred_by)
+    try:
+        # The pre-image is None exactly when the upsert inserted our document
+        existing = await db.users.find_one_and_update(
+            {"telegram_id": telegram_id},
+            {"$setOnInsert": user_doc},
+            projection=USER_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Lost a race with a concurrent upsert for the same user
+        return await get_user(telegram_id), False
+    if existing is None:
+        # Shaped like a read with USER_PROJECTION
+        user_doc.pop('username_ngrams')
+        return user_doc, True
+    return existing, False
+
+
+async def update_user(telegram_id: int, update, guard: Optional[dict] = None,
+                      projection: Optional[dict] = None, after: bool = True) -> Optional[dict]:
+    """Apply ``update`` if the user matches ``guard``; returns the post- (or pre-) image.
+
+    The default projection is what ``leaderboard.apply`` needs.
+    """
+    return await db.users.find_one_and_update(
+        {"telegram_id": telegram_id, **(guard or {})},
+        update,
+        projection=projection or LEADERBOARD_PROJECTION,
+        return_document=ReturnDocument.AFTER if after else ReturnDocument.BEFORE
+    )
+
+
+async def increment_user(telegram_id: int, **deltas) -> bool:
+    result = await db.users.update_one({"telegram_id": telegram_id}, {"$inc": deltas})
+    return result.modified_count > 0
+
+
+async def page_users(limit: int, cursor: Optional[str] = None) -> dict:
+    """One page of users, newest first; raises pagination.InvalidCursor"""
+    query = {}
+    if cursor:
+        query = pagination.after_filter(USER_PAGE_KEYS, pagination.decode_cursor(cursor, USER_CURSOR_CHECKS))
+    users = await db.users.find(query, USER_PROJECTION).sort(
+        [(USER_PAGE_KEYS[0], -1), (USER_PAGE_KEYS[1], -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return pagination.page(users, USER_PAGE_KEYS, limit)
+
+
+async def users_around(telegram_id: int, points: int, count: int) -> Tuple[List[dict], List[dict]]:
+    """Up to ``count`` users directly above and below a user in leaderboard order"""
+    if count <= 0:
+        return [], []
+    above, below = await asyncio.gather(
+        db.users.find(
+            {"$or": [{"points": {"$gt": points}}, {"points": points, "telegram_id": {"$lt": telegram_id}}]},
+            LEADERBOARD_PROJECTION
+        ).sort([("points", 1), ("telegram_id", -1)]).limit(count).to_list(count),
+        db.users.find(
+            {"$or": [{"points": {"$lt": points}}, {"points": points, "telegram_id": {"$gt": telegram_id}}]},
+            LEADERBOARD_PROJECTION
+        ).sort([("points", -1), ("telegram_id", 1)]).limit(count).to_list(count)
+    )
+    above.reverse()
+    return above, below
+
+
+# Per-section limits for user_details
+USER_DETAIL_LIMITS = {"completions": 100, "withdrawals": 50, "referred_users": 100}
+
+
+def _user_lookup(collection: str, field: str, pipeline: list, output: str) -> dict:
+    """$lookup of ``collection`` rows whose ``field`` is the user's telegram_id"""
+    return {"$lookup": {
+        "from": collection,
+        "let": {"telegram_id": "$telegram_id"},
+        "pipeline": [{"$match": {"$expr": {"$eq": [f"${field}", "$$telegram_id"]}}}] + pipeline,
+        "as": output,
+    }}
+
+
+async def user_details(telegram_id: int, limits: Optional[dict] = None) -> Optional[dict]:
+    """A user with recent completions (joined to tasks), withdrawals, milestones
+    and referred users, read in one aggregation; None if the user does not exist"""
+    limits = {**USER_DETAIL_LIMITS, **(limits or {})}
+    pipeline = [
+        {"$match": {"telegram_id": telegram_id}},
+        {"$limit": 1},
+        _user_lookup("task_completions", "user_id", [
+            {"$sort": {"completed_at": -1}},
+            {"$limit": limits["completions"]},
+            {"$lookup": {"from": "tasks", "localField": "task_id", "foreignField": "task_id", "as": "task"}},
+            # Completions of tasks that no longer exist are left out
+            {"$unwind": "$task"},
+            {"$project": {
+                "_id": 0,
+                "task_id": "$task.task_id",
+                "title": "$task.title",
+                "reward_points": "$task.reward_points",
+                "completed_at": 1,
+            }},
+        ], "completed_tasks"),
+        _user_lookup("withdrawals", "user_id", [
+            {"$sort": {"timestamp": -1}},
+            {"$limit": limits["withdrawals"]},
+            {"$project": {"_id": 0}},
+        ], "withdrawals"),
+        _user_lookup("referral_milestones", "user_id", [
+            {"$limit": 10},
+            {"$project": {"_id": 0}},
+        ], "referral_milestones"),
+        _user_lookup("users", "referred_by", [
+            {"$limit": limits["referred_users"]},
+            {"$project": {"_id": 0, "telegram_id": 1, "username": 1, "join_date": 1, "points": 1}},
+        ], "referred_users"),
+        {"$project": USER_PROJECTION},
+    ]
+    docs = await db.users.aggregate(pipeline).to_list(1)
+    if not docs:
+        return None
+    user = docs[0]
+    details = {key: user.pop(key) for key in
+               ("completed_tasks", "withdrawals", "referral_milestones", "referred_users")}
+    details["user"] = user
+    return details
+
+# Tasks
+
+async def list_tasks(active_only: bool = False, limit: int = 100) -> List[dict]:
+    query = {"active": True} if active_only else {}
+    return await db.tasks.find(query, {"_id": 0}).limit(limit).to_list(limit)
+
+
+async def get_active_task(task_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+    return await db.tasks.find_one({"task_id": task_id, "active": True}, projection or {"_id": 0})
+
+
+async def insert_task(task_doc: dict):
+    await db.tasks.insert_one(task_doc)
+    task_doc.pop('_id', None)
+
+
+async def deactivate_task(task_id: str) -> Optional[dict]:
+    """Deactivate an active task; returns it, or None if it was not active"""
+    return await db.tasks.find_one_and_update(
+        {"task_id": task_id, "active": True},
+        {"$set": {"active": False}},
+        projection={"_id": 0, "task_id": 1, "title": 1}
+    )
+
+# Task completions
+
+async def completed_task_ids(user_id: int, limit: int = 1000) -> Set[str]:
+    completed = await db.task_completions.find(
+        {"user_id": user_id}, {"_id": 0, "task_id": 1}
+    ).limit(limit).to_list(limit)
+    return {c['task_id'] for c in completed}
+
+
+async def insert_completion(user_id: int, task_id: str) -> bool:
+    """Record a completion; False if the user already completed the task (unique index)"""
+    try:
+        await db.task_completions.insert_one({
+            "user_id": user_id,
+            "task_id": task_id,
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def delete_completion(user_id: int, task_id: str):
+    """Undo insert_completion when the points could not be awarded"""
+    await db.task_completions.delete_one({"user_id": user_id, "task_id": task_id})
+
+# Withdrawals
+
+async def insert_withdrawal(withdrawal_doc: dict):
+    await db.withdrawals.insert_one(withdrawal_doc)
+    withdrawal_doc.pop('_id', None)
+
+
+async def withdrawal_exists(withdrawal_id: str) -> bool:
+    return await db.withdrawals.find_one({"withdrawal_id": withdrawal_id}, {"_id": 1}) is not None
+
+
+async def transition_withdrawal(withdrawal_id: str, status: str, admin_note: str) -> Optional[dict]:
+    """Move a pending withdrawal to ``status``; returns it, or None if it was not pending"""
+    return await db.withdrawals.find_one_and_update(
+        {"withdrawal_id": withdrawal_id, "status": "pending"},
+        {"$set": {"status": status, "admin_note": admin_note}},
+        projection={"_id": 0, "user_id": 1, "username": 1, "amount": 1, "reserved": 1}
+    )
+
+
+async def page_withdrawals(limit: int, cursor: Optional[str] = None,
+                           user_id: Optional[int] = None) -> dict:
+    """One page of withdrawals, newest first, optionally for one user"""
+    query = {"user_id": user_id} if user_id is not None else {}
+    if cursor:
+        values = pagination.decode_cursor(cursor, WITHDRAWAL_CURSOR_CHECKS)
+        query.update(pagination.after_filter(WITHDRAWAL_PAGE_KEYS, values))
+    withdrawals = await db.withdrawals.find(query, {"_id": 0}).sort(
+        [(WITHDRAWAL_PAGE_KEYS[0], -1), (WITHDRAWAL_PAGE_KEYS[1], -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return pagination.page(withdrawals, WITHDRAWAL_PAGE_KEYS, limit)
+
+# Referral milestones
+
+async def claimed_milestones(user_id: int) -> List[dict]:
+    return await db.referral_milestones.find({"user_id": user_id}, {"_id": 0}).limit(10).to_list(10)
+
+
+async def claim_milestone(user_id: int, milestone: int) -> bool:
+    """Record a claim; False if already claimed (unique index)"""
+    try:
+        await db.referral_milestones.insert_one({
+            "user_id": user_id,
+            "milestone": milestone,
+            "claimed_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def release_milestone(user_id: int, milestone: int):
+    await db.referral_milestones.delete_one({"user_id": user_id, "milestone": milestone})
+
+# Settings
+
+async def get_settings() -> Optional[dict]:
+    return await db.admin_settings.find_one({}, {"_id": 0})
+
+
+async def insert_settings(settings: dict):
+    await db.admin_settings.insert_one(settings)
+    settings.pop('_id', None)
+
+
+async def update_settings(update_data: dict):
+    await db.admin_settings.update_one({}, {"$set": update_data}, upsert=True)
+
+
+# Admin stream tickets
+
+async def create_stream_ticket(username: str, ttl_seconds: float) -> str:
+    """A random single-use ticket for opening the admin event stream"""
+    ticket = secrets.token_urlsafe(32)
+    await db.stream_tickets.insert_one({
+        "ticket": ticket,
+        "username": username,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+    })
+    return ticket
+
+
+async def consume_stream_ticket(ticket: str) -> Optional[dict]:
+    """Delete and return an unexpired ticket; None if unknown, used or expired"""
+    # The TTL monitor only sweeps once a minute, so expiry is checked here too
+    return await db.stream_tickets.find_one_and_delete(
+        {"ticket": ticket, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "username": 1}
+    )
+
+
+def close():
+    client.close()
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -12,14 +13,32 @@ import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
+from pymongo.errors import DuplicateKeyError
+
+import activity
+import bulk
+import counters
+import exports
+import indexes
+import live
+import metrics
+import pagination
+import profiler
+import referrals
+import repository
+import taps
+import user_search
+from ratelimit import limiter
+from settings_cache import settings_cache
+from token_cache import token_cache
+from update_queue import UpdateQueue, QueueFull
+from leaderboard import leaderboard, rank_of
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, shared with the bot
+db = repository.db
 
 # JWT Secret (required, no fallback for security)
 JWT_SECRET = os.environ['JWT_SECRET']
@@ -36,6 +55,13 @@ async def health_check():
     """Health check endpoint for Kubernetes liveness/readiness probes"""
     return {"status": "healthy", "service": "hbd-speedy-api"}
 
+# Prometheus scrape endpoint, also at root; set METRICS_TOKEN to require a bearer token
+@app.get("/metrics")
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    if metrics.METRICS_TOKEN and authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -77,6 +103,11 @@ class TaskCreateRequest(BaseModel):
 class TaskCompleteRequest(BaseModel):
     task_id: str
 
+class TapBatchRequest(BaseModel):
+    session_id: str = Field(min_length=1, max_length=64)
+    seq: int = Field(ge=1)
+    taps: int = Field(ge=1, le=taps.TAP_MAX_BATCH)
+
 class WithdrawalRequest(BaseModel):
     amount: int
 
@@ -88,6 +119,17 @@ class AdminPointsAdjustRequest(BaseModel):
     telegram_id: int
     amount: int
 
+class BulkWithdrawalRequest(BaseModel):
+    withdrawal_ids: List[str] = Field(min_length=1, max_length=bulk.BULK_MAX_ITEMS)
+    reason: str = "Rejected"
+    dry_run: bool = False
+    batch_id: Optional[str] = Field(default=None, max_length=64)
+
+class BulkPointsAdjustRequest(BaseModel):
+    adjustments: List[AdminPointsAdjustRequest] = Field(min_length=1, max_length=bulk.BULK_MAX_ITEMS)
+    dry_run: bool = False
+    batch_id: Optional[str] = Field(default=None, max_length=64)
+
 class AdminSettingsUpdate(BaseModel):
     background_image_url: Optional[str] = None
     tap_image_url: Optional[str] = None
@@ -101,11 +143,19 @@ def create_jwt_token(data: dict):
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 def verify_jwt_token(token: str):
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except:
         return None
+    token_cache.put(token, payload)
+    return payload
+
+def is_admin_token(token: str):
+    payload = verify_jwt_token(token)
+    return bool(payload and payload.get('is_admin'))
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
@@ -121,11 +171,70 @@ async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(sec
         raise HTTPException(status_code=403, detail="Admin access required")
     return payload
 
+class UserLoader:
+    """Dependency that loads the caller's user document once per request.
+
+    The document is kept on ``request.state`` so every handler and
+    sub-dependency in the request shares it; a later loader only reads
+    again if it needs fields the first one did not fetch.
+    """
+    def __init__(self, *fields: str):
+        self.fields = set(fields)
+    
+    async def __call__(self, request: Request, current_user = Depends(get_current_user)):
+        if 'telegram_id' not in current_user:
+            raise HTTPException(status_code=403, detail="Admin cannot access user profile")
+        
+        cached = getattr(request.state, 'user', None)
+        if cached is not None:
+            user, fetched = cached
+            # fetched is None when the whole document was loaded
+            if fetched is None or (self.fields and self.fields <= fetched):
+                return user
+        
+        projection = {"_id": 0, **{f: 1 for f in self.fields}} if self.fields else None
+        user = await repository.get_user(current_user['telegram_id'], projection)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        request.state.user = (user, self.fields or None)
+        return user
+
+class RateLimit:
+    """Dependency that applies the caller's token bucket for ``route``.
+
+    Runs on the JWT alone, so a limited or shed request is refused before
+    the route does any database work. Yields the current user.
+    """
+    def __init__(self, route: str):
+        self.route = route
+    
+    async def __call__(self, current_user = Depends(get_current_user)):
+        if 'telegram_id' in current_user:
+            retry_after = await limiter.check(self.route, current_user['telegram_id'])
+            if retry_after:
+                raise HTTPException(status_code=429, detail="Too many requests",
+                                    headers={"Retry-After": str(retry_after)})
+        if not limiter.enter(self.route):
+            raise HTTPException(status_code=503, detail="Server busy, try again",
+                                headers={"Retry-After": "1"})
+        try:
+            yield current_user
+        finally:
+            limiter.leave(self.route)
+
 def calculate_join_bonus():
     """Calculate join bonus - same amount for everyone"""
     # Everyone gets 1200 points when they join, regardless of date
     return 1200
 
+# Check-in points double each streak day, capped at 12800 (day 8)
+CHECKIN_BASE_POINTS = 100
+CHECKIN_MAX_DOUBLINGS = 7
+
+def calculate_checkin_points(streak_day: int):
+    """Calculate check-in points for a streak day"""
+    return CHECKIN_BASE_POINTS * (2 ** min(streak_day - 1, CHECKIN_MAX_DOUBLINGS))
+
 def get_countdown_data():
     """Get countdown data"""
     target = datetime(2026, 1, 21, 0, 0, 0, tzinfo=timezone.utc)
@@ -154,28 +263,91 @@ def get_countdown_data():
 async def root():
     return {"message": "HBD Speedy API", "version": "1.0.0"}
 
+# Optional secret Telegram echoes in X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+
+async def handle_telegram_update(update_data: dict):
+    """Run one queued update through the bot handlers"""
+    from bot import process_update, initialize_application
+    
+    # Initialize the application if needed
+    if await initialize_application() is None:
+        logger.error("Dropping update: bot not initialized")
+        return
+    await process_update(update_data)
+
+webhook_queue = UpdateQueue(handle_telegram_update)
+
 # Telegram Bot Webhook endpoint (under /api for Kubernetes routing)
 @api_router.post("/webhook/telegram")
 async def telegram_webhook(request: Request):
-    """Handle incoming Telegram updates via webhook"""
+    """Validate and enqueue incoming Telegram updates; handlers run in the background"""
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    
     try:
-        from bot import process_update, get_application
-        
-        # Initialize the application if needed
-        app_bot = get_application()
-        if app_bot is None:
-            return {"ok": False, "error": "Bot not initialized"}
-        
-        # Initialize the application
-        if not app_bot._initialized:
-            await app_bot.initialize()
-        
         update_data = await request.json()
-        await process_update(update_data)
-        return {"ok": True}
-    except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        return {"ok": False, "error": str(e)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(update_data, dict) or not isinstance(update_data.get('update_id'), int):
+        raise HTTPException(status_code=400, detail="Invalid update")
+    
+    try:
+        webhook_queue.submit(update_data)
+    except QueueFull:
+        # A non-2xx makes Telegram redeliver later instead of losing the update
+        raise HTTPException(status_code=503, detail="Update queue full")
+    return {"ok": True}
+
+@api_router.get("/webhook/stats")
+async def webhook_stats(admin = Depends(get_admin_user)):
+    """Webhook queue depth, throughput and lag"""
+    return webhook_queue.stats()
+
+@api_router.get("/admin/rate-limits")
+async def rate_limit_stats(admin = Depends(get_admin_user)):
+    """Requests refused by the per-user buckets or shed at the in-flight cap"""
+    return limiter.stats()
+
+@api_router.get("/admin/slow-queries")
+async def slow_query_log(admin = Depends(get_admin_user)):
+    """Recent MongoDB commands slower than MONGO_SLOW_QUERY_MS, newest first"""
+    return {"threshold_ms": metrics.MONGO_SLOW_QUERY_MS, "queries": list(reversed(metrics.slow_queries))}
+
+@api_router.get("/admin/profiles")
+async def list_profiles(admin = Depends(get_admin_user)):
+    """Stored request profiles, newest first, without their stacks"""
+    return {"profiles": await profiler.recent(db)}
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json", admin = Depends(get_admin_user)):
+    """One profile; ``format=collapsed`` returns only its stacks for flamegraph.pl or speedscope"""
+    profile = await profiler.get(db, profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return Response(content=profile['stacks'] + "\n", media_type="text/plain")
+    return profile
+
+# Read at scrape time from the components that already keep these numbers
+metrics.Callback("webhook_queue_depth", "Telegram updates waiting to be handled", "gauge",
+                 lambda: {(): webhook_queue.depth})
+metrics.Callback("webhook_updates_total", "Telegram updates by outcome", "counter",
+                 lambda: {(outcome,): webhook_queue.stats()[outcome]
+                          for outcome in ("received", "processed", "failed", "duplicates", "rejected")},
+                 ("outcome",))
+metrics.Callback("rate_limit_refusals_total", "Requests refused by the rate limiter", "counter",
+                 lambda: {("limited",): limiter.limited, ("shed",): limiter.shed}, ("reason",))
+metrics.Callback("jwt_cache_lookups_total", "Verified-token cache lookups", "counter",
+                 lambda: {("hit",): token_cache.hits, ("miss",): token_cache.misses}, ("result",))
+metrics.Callback("tap_events_total", "Tap accumulator events by outcome", "counter",
+                 lambda: {(outcome,): tap_accumulator.stats()[outcome]
+                          for outcome in ("accepted", "capped", "duplicates", "flushes", "written", "failed")},
+                 ("outcome",))
+metrics.Callback("tap_pending_users", "Users with taps waiting for the next flush", "gauge",
+                 lambda: {(): tap_accumulator.stats()['pending_users']})
+metrics.Callback("live_stream_subscribers", "Open admin live streams", "gauge",
+                 lambda: {(): live.broker.stats()['subscribers']})
 
 # Endpoint to set up the webhook
 @api_router.get("/webhook/setup")
@@ -191,7 +363,7 @@ async def setup_webhook():
         async with httpx.AsyncClient() as http_client:
             response = await http_client.post(
                 f"https://api.telegram.org/bot{bot_token}/setWebhook",
-                json={"url": webhook_url}
+                json={"url": webhook_url, **({"secret_token": TELEGRAM_WEBHOOK_SECRET} if TELEGRAM_WEBHOOK_SECRET else {})}
             )
             result = response.json()
             
@@ -227,116 +399,119 @@ async def get_countdown():
 @api_router.post("/auth/telegram")
 async def telegram_auth(auth_req: TelegramAuthRequest):
     """Authenticate Telegram user"""
-    user = await db.users.find_one({"telegram_id": auth_req.telegram_id}, {"_id": 0})
+    user, created = await repository.get_or_create_user(auth_req.telegram_id, auth_req.username)
     
-    if not user:
-        # Create new user
-        user_doc = {
-            "telegram_id": auth_req.telegram_id,
-            "username": auth_req.username,
-            "points": 0,
-            "join_date": datetime.now(timezone.utc).isoformat(),
-            "referral_count": 0,
-            "streak_day": 0,
-            "last_checkin": None,
-            "referred_by": None,
-            "join_bonus_claimed": False
-        }
-        await db.users.insert_one(user_doc)
-        # Return user without _id
-        user = {k: v for k, v in user_doc.items() if k != '_id'}
+    if created:
+        leaderboard.apply(user)
+        await asyncio.gather(
+            counters.record_user_joined(db, user['join_date']),
+            activity.record(db, "user_joined", user['telegram_id'], user['username'],
+                            f"@{user['username']} joined the event"),
+        )
     
     token = create_jwt_token({"telegram_id": auth_req.telegram_id, "username": auth_req.username})
     return {"token": token, "user": user}
 
 @api_router.get("/user/profile")
-async def get_user_profile(current_user = Depends(get_current_user)):
-    # Check if it's an admin token (has 'username' but no 'telegram_id')
-    if 'telegram_id' not in current_user:
-        raise HTTPException(status_code=403, detail="Admin cannot access user profile")
-    
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def get_user_profile(user = Depends(UserLoader())):
+    # UserLoader rejects admin tokens (no telegram_id) and unknown users
     return user
 
 @api_router.post("/user/claim-join-bonus")
-async def claim_join_bonus(current_user = Depends(get_current_user)):
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']})
+async def claim_join_bonus(current_user = Depends(RateLimit("claim_join_bonus"))):
+    bonus = calculate_join_bonus()
     
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    # The guard is part of the filter, so concurrent taps can only award once
+    updated = await repository.update_user(
+        current_user['telegram_id'],
+        {"$set": {"join_bonus_claimed": True}, "$inc": {"points": bonus}},
+        guard={"join_bonus_claimed": {"$ne": True}}
+    )
     
-    if user.get('join_bonus_claimed'):
+    if not updated:
+        # Rejected claims only: tell a missing user apart from a repeat claim
+        if not await repository.user_exists(current_user['telegram_id']):
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=400, detail="Join bonus already claimed")
     
-    bonus = calculate_join_bonus()
-    
-    await db.users.update_one(
-        {"telegram_id": current_user['telegram_id']},
-        {"$set": {"join_bonus_claimed": True}, "$inc": {"points": bonus}}
+    leaderboard.apply(updated)
+    # Counters and the activity log are independent writes; don't queue them
+    await asyncio.gather(
+        counters.record_points(db, updated['points'], bonus, join_bonus_claimed=1),
+        activity.record(db, "join_bonus", updated['telegram_id'], updated['username'],
+                        f"@{updated['username']} claimed the join bonus (+{bonus} pts)", points=bonus),
     )
     
     return {"success": True, "bonus": bonus, "message": f"Claimed {bonus} points!"}
 
 @api_router.post("/user/checkin")
-async def daily_checkin(current_user = Depends(get_current_user)):
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']})
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def daily_checkin(current_user = Depends(RateLimit("checkin"))):
     now = datetime.now(timezone.utc)
-    last_checkin = user.get('last_checkin')
+    # ISO-8601 UTC strings compare in time order, so the 24h/48h rules become string bounds
+    checkin_cutoff = (now - timedelta(hours=24)).isoformat()
+    streak_cutoff = (now - timedelta(hours=48)).isoformat()
+    
+    # One conditional update: the 24h guard is in the filter, the streak logic in the pipeline
+    previous = await repository.update_user(
+        current_user['telegram_id'],
+        [
+            {"$set": {"streak_day": {"$cond": [
+                {"$gte": ["$last_checkin", streak_cutoff]},
+                {"$add": [{"$ifNull": ["$streak_day", 0]}, 1]},
+                1
+            ]}}},
+            {"$set": {
+                "last_checkin": now.isoformat(),
+                "points": {"$add": [
+                    {"$ifNull": ["$points", 0]},
+                    {"$multiply": [
+                        CHECKIN_BASE_POINTS,
+                        {"$pow": [2, {"$min": [{"$subtract": ["$streak_day", 1]}, CHECKIN_MAX_DOUBLINGS]}]}
+                    ]}
+                ]}
+            }}
+        ],
+        guard={"$or": [{"last_checkin": None}, {"last_checkin": {"$lte": checkin_cutoff}}]},
+        projection={"_id": 0, "telegram_id": 1, "username": 1, "points": 1, "streak_day": 1, "last_checkin": 1},
+        after=False
+    )
     
-    if last_checkin:
-        last_checkin_dt = datetime.fromisoformat(last_checkin) if isinstance(last_checkin, str) else last_checkin
-        hours_diff = (now - last_checkin_dt).total_seconds() / 3600
-        
-        # Must wait 24 hours between check-ins
-        if hours_diff < 24:
-            remaining_hours = 24 - hours_diff
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Already checked in today. Come back in {int(remaining_hours)}h {int((remaining_hours % 1) * 60)}m"
-            )
-        
-        # Check if consecutive (within 48 hours)
-        if hours_diff <= 48:
-            streak_day = user.get('streak_day', 0) + 1
-        else:
-            # Reset streak if more than 48 hours
-            streak_day = 1
+    if not previous:
+        user = await repository.get_user(current_user['telegram_id'], {"_id": 0, "last_checkin": 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        last_checkin_dt = datetime.fromisoformat(user['last_checkin'])
+        remaining_hours = max(24 - (now - last_checkin_dt).total_seconds() / 3600, 0)
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Already checked in today. Come back in {int(remaining_hours)}h {int((remaining_hours % 1) * 60)}m"
+        )
+    
+    # Mirror the pipeline from the pre-update document
+    last_checkin = previous.get('last_checkin')
+    if last_checkin and last_checkin >= streak_cutoff:
+        streak_day = (previous.get('streak_day') or 0) + 1
     else:
         streak_day = 1
-    
-    # Calculate points (doubles each day of streak)
-    points = 100 * (2 ** (streak_day - 1))
-    
-    # Cap points at a reasonable maximum (e.g., 12800 for day 8)
-    points = min(points, 12800)
-    
-    await db.users.update_one(
-        {"telegram_id": current_user['telegram_id']},
-        {
-            "$set": {"last_checkin": now.isoformat(), "streak_day": streak_day},
-            "$inc": {"points": points}
-        }
+    points = calculate_checkin_points(streak_day)
+    
+    leaderboard.apply({**previous, "points": previous.get('points', 0) + points})
+    await asyncio.gather(
+        counters.record_points(
+            db, previous.get('points', 0) + points, points, total_checkins=0 if last_checkin else 1
+        ),
+        activity.record(db, "checkin", previous['telegram_id'], previous['username'],
+                        f"@{previous['username']} checked in (Day {streak_day} streak)",
+                        points=points, streak_day=streak_day),
     )
     
     return {"success": True, "points": points, "streak_day": streak_day}
 
-@api_router.get("/user/referral-stats")
-async def get_referral_stats(current_user = Depends(get_current_user)):
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']}, {"_id": 0})
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def build_referral_stats(user):
     referral_count = user.get('referral_count', 0)
     
     # Check claimed milestones
-    milestones = await db.referral_milestones.find({"user_id": current_user['telegram_id']}, {"_id": 0}).limit(10).to_list(10)
+    milestones = await repository.claimed_milestones(user['telegram_id'])
     claimed = {m['milestone'] for m in milestones}
     
     # Calculate available rewards
@@ -354,100 +529,124 @@ async def get_referral_stats(current_user = Depends(get_current_user)):
         "available_rewards": available_rewards
     }
 
+@api_router.get("/user/referral-stats")
+async def get_referral_stats(user = Depends(UserLoader("telegram_id", "referral_count"))):
+    return await build_referral_stats(user)
+
 @api_router.post("/user/claim-referral-reward")
-async def claim_referral_reward(milestone: int, current_user = Depends(get_current_user)):
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']})
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    referral_count = user.get('referral_count', 0)
-    
-    # Check if already claimed
-    existing = await db.referral_milestones.find_one({
-        "user_id": current_user['telegram_id'],
-        "milestone": milestone
-    })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Reward already claimed")
-    
+async def claim_referral_reward(milestone: int, current_user = Depends(RateLimit("claim_referral_reward"))):
     # Validate milestone
     rewards = {1: 1000, 3: 5000, 5: 10000}
-    if milestone not in rewards or referral_count < milestone:
+    if milestone not in rewards:
         raise HTTPException(status_code=400, detail="Milestone not reached")
     
     reward = rewards[milestone]
     
-    # Claim reward
-    await db.referral_milestones.insert_one({
-        "user_id": current_user['telegram_id'],
-        "milestone": milestone,
-        "claimed_at": datetime.now(timezone.utc).isoformat()
-    })
+    # Claim reward; the unique (user_id, milestone) index rejects double claims
+    if not await repository.claim_milestone(current_user['telegram_id'], milestone):
+        raise HTTPException(status_code=400, detail="Reward already claimed")
     
-    await db.users.update_one(
-        {"telegram_id": current_user['telegram_id']},
-        {"$inc": {"points": reward}}
+    updated = await repository.update_user(
+        current_user['telegram_id'],
+        {"$inc": {"points": reward}},
+        guard={"referral_count": {"$gte": milestone}}
+    )
+    
+    if not updated:
+        # Not eligible after all: release the claim record
+        await repository.release_milestone(current_user['telegram_id'], milestone)
+        if not await repository.user_exists(current_user['telegram_id']):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail="Milestone not reached")
+    
+    leaderboard.apply(updated)
+    await asyncio.gather(
+        counters.record_points(db, updated['points'], reward),
+        activity.record(db, "referral_reward", updated['telegram_id'], updated['username'],
+                        f"@{updated['username']} claimed the {milestone}-referral reward (+{reward} pts)",
+                        milestone=milestone, points=reward),
     )
     
     return {"success": True, "reward": reward}
 
-@api_router.get("/tasks/list")
-async def list_tasks(current_user = Depends(get_current_user)):
-    tasks = await db.tasks.find({"active": True}, {"_id": 0}).limit(100).to_list(100)
-    
-    # Get user's completed tasks
-    completed = await db.task_completions.find(
-        {"user_id": current_user['telegram_id']},
-        {"_id": 0, "task_id": 1}
-    ).limit(1000).to_list(1000)
-    completed_ids = {c['task_id'] for c in completed}
+async def build_task_list(telegram_id: int):
+    # Active tasks and the user's completions are independent reads
+    tasks, completed_ids = await asyncio.gather(
+        repository.list_tasks(active_only=True),
+        repository.completed_task_ids(telegram_id)
+    )
     
     for task in tasks:
         task['completed'] = task['task_id'] in completed_ids
     
     return tasks
 
+@api_router.get("/tasks/list")
+async def list_tasks(current_user = Depends(get_current_user)):
+    return await build_task_list(current_user['telegram_id'])
+
 @api_router.post("/tasks/complete")
-async def complete_task(req: TaskCompleteRequest, current_user = Depends(get_current_user)):
+async def complete_task(req: TaskCompleteRequest, current_user = Depends(RateLimit("tasks_complete"))):
     # Check if task exists
-    task = await db.tasks.find_one({"task_id": req.task_id, "active": True})
+    task = await repository.get_active_task(req.task_id, {"_id": 0, "title": 1, "reward_points": 1})
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    # Check if already completed
-    existing = await db.task_completions.find_one({
-        "user_id": current_user['telegram_id'],
-        "task_id": req.task_id
-    })
-    
-    if existing:
+    # Mark as completed; the unique (user_id, task_id) index rejects repeats
+    if not await repository.insert_completion(current_user['telegram_id'], req.task_id):
         raise HTTPException(status_code=400, detail="Task already completed")
     
-    # Mark as completed
-    await db.task_completions.insert_one({
-        "user_id": current_user['telegram_id'],
-        "task_id": req.task_id,
-        "completed_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Award points
-    await db.users.update_one(
-        {"telegram_id": current_user['telegram_id']},
-        {"$inc": {"points": task['reward_points']}}
+    # Award points and bump the user's completion count in the same update
+    updated = await repository.update_user(
+        current_user['telegram_id'],
+        {"$inc": {"points": task['reward_points'], "tasks_completed": 1}}
+    )
+    if not updated:
+        # The user was deleted after authenticating; don't leave an unrewarded completion
+        await repository.delete_completion(current_user['telegram_id'], req.task_id)
+        raise HTTPException(status_code=404, detail="User not found")
+    leaderboard.apply(updated)
+    await asyncio.gather(
+        counters.increment(db, {
+            counters.GLOBAL_KEY: {"total_task_completions": 1, "total_points": task['reward_points']},
+            counters.task_key(req.task_id): {"completion_count": 1},
+            counters.HISTOGRAM_KEY: counters.histogram_move(updated['points'] - task['reward_points'], updated['points'])
+        }),
+        activity.record(db, "task_completed", updated['telegram_id'], updated['username'],
+                        f"@{updated['username']} completed '{task['title']}' (+{task['reward_points']} pts)",
+                        task_id=req.task_id, points=task['reward_points']),
     )
     
     return {"success": True, "reward": task['reward_points']}
 
+# Tap for fun
+tap_accumulator = taps.TapAccumulator(db, leaderboard)
+
+@api_router.post("/tap/batch")
+async def tap_batch(req: TapBatchRequest, current_user = Depends(RateLimit("tap_batch"))):
+    """Queue a batch of taps for the next flush; replays of a seq are acknowledged without counting"""
+    if 'telegram_id' not in current_user:
+        raise HTTPException(status_code=403, detail="Admin cannot tap")
+    accepted, duplicate = tap_accumulator.add(current_user['telegram_id'], req.session_id, req.seq, req.taps)
+    return {"success": True, "seq": req.seq, "accepted": accepted, "duplicate": duplicate,
+            "points": accepted * taps.TAP_POINTS}
+
 @api_router.post("/withdrawal/request")
-async def request_withdrawal(req: WithdrawalRequest, current_user = Depends(get_current_user)):
-    user = await db.users.find_one({"telegram_id": current_user['telegram_id']})
+async def request_withdrawal(req: WithdrawalRequest, current_user = Depends(RateLimit("withdrawal_request"))):
+    if req.amount <= 0:
+        raise HTTPException(status_code=400, detail="Invalid amount")
+    
+    # Reserve the points in the same operation as the balance check, so
+    # several pending requests can never commit more than the balance
+    user = await repository.update_user(
+        current_user['telegram_id'],
+        {"$inc": {"points": -req.amount, "reserved_points": req.amount, "withdrawal_count": 1}},
+        guard={"points": {"$gte": req.amount}}
+    )
     
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user['points'] < req.amount:
+        if not await repository.user_exists(current_user['telegram_id']):
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=400, detail="Insufficient points")
     
     # Create withdrawal request
@@ -458,34 +657,81 @@ async def request_withdrawal(req: WithdrawalRequest, current_user = Depends(get_
         "amount": req.amount,
         "status": "pending",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "admin_note": None
+        "admin_note": None,
+        "reserved": True
     }
     
-    await db.withdrawals.insert_one(withdrawal_doc)
+    try:
+        await repository.insert_withdrawal(withdrawal_doc)
+    except Exception:
+        await repository.increment_user(
+            current_user['telegram_id'],
+            points=req.amount, reserved_points=-req.amount, withdrawal_count=-1
+        )
+        raise
+    
+    leaderboard.apply(user)
+    await asyncio.gather(
+        counters.record_points(db, user['points'], -req.amount, pending_withdrawals=1),
+        activity.record(db, "withdrawal", user['telegram_id'], user['username'],
+                        f"@{user['username']} requested {req.amount} pts withdrawal",
+                        withdrawal_id=withdrawal_doc['withdrawal_id'], amount=req.amount),
+    )
     
     return {"success": True, "message": "Withdrawal request submitted"}
 
 @api_router.get("/withdrawal/my-requests")
-async def get_my_withdrawals(current_user = Depends(get_current_user)):
-    withdrawals = await db.withdrawals.find(
-        {"user_id": current_user['telegram_id']},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(100).to_list(100)
-    
-    return withdrawals
+async def get_my_withdrawals(cursor: Optional[str] = None, limit: Optional[int] = None,
+                             current_user = Depends(get_current_user)):
+    try:
+        return await repository.page_withdrawals(
+            pagination.page_size(limit), cursor, user_id=current_user['telegram_id']
+        )
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @api_router.get("/leaderboard")
 async def get_leaderboard():
-    top_users = await db.users.find(
-        {},
-        {"_id": 0, "username": 1, "points": 1, "telegram_id": 1}
-    ).sort("points", -1).limit(100).to_list(100)
+    # Served from the in-memory index; it reloads itself only when cold or stale
+    return await leaderboard.top(db, 100)
+
+# Users shown on each side of the caller by /leaderboard/me
+LEADERBOARD_WINDOW_MAX = 25
+
+@api_router.get("/leaderboard/me")
+async def get_my_rank(window: int = 5, user = Depends(UserLoader("telegram_id", "username", "points"))):
+    """The caller's rank and percentile with ``window`` users above and below"""
+    window = max(0, min(window, LEADERBOARD_WINDOW_MAX))
+    points = user.get('points', 0)
+    (position, total, exact), (above, below) = await asyncio.gather(
+        rank_of(db, user['telegram_id'], points),
+        repository.users_around(user['telegram_id'], points, window)
+    )
+    
+    for offset, entry in enumerate(above):
+        entry['rank'] = position - len(above) + offset
+    for offset, entry in enumerate(below):
+        entry['rank'] = position + 1 + offset
     
-    return top_users
+    return {
+        "telegram_id": user['telegram_id'],
+        "username": user.get('username'),
+        "points": points,
+        "rank": position,
+        # False when the caller's points bucket was too large to count and the rank is estimated
+        "rank_exact": exact,
+        "total_users": total,
+        # Share of users ranked at or below the caller
+        "percentile": round(100.0 * (total - position + 1) / total, 2),
+        "above": above,
+        "below": below
+    }
 
-@api_router.get("/settings")
-async def get_settings():
-    settings = await db.admin_settings.find_one({}, {"_id": 0})
+# Clients may keep settings but must revalidate; a matching ETag costs no DB read
+SETTINGS_CACHE_CONTROL = "public, no-cache"
+
+async def load_settings():
+    settings = await repository.get_settings()
     if not settings:
         # Default settings
         settings = {
@@ -493,10 +739,69 @@ async def get_settings():
             "tap_image_url": "https://customer-assets.emergentagent.com/job_ff141841-2e59-4507-96bf-1bcd7ee18354/artifacts/neszsaji_gpt-image-1.5_a_made_this_pic_into_a.png",
             "tap_video_url": "https://customer-assets.emergentagent.com/job_ff141841-2e59-4507-96bf-1bcd7ee18354/artifacts/ind1ownr_m.mp4"
         }
-        await db.admin_settings.insert_one(settings)
+        await repository.insert_settings(settings)
     
     return settings
 
+@api_router.get("/settings")
+async def get_settings(request: Request, response: Response):
+    settings, etag = await settings_cache.get(load_settings)
+    headers = {"ETag": etag, "Cache-Control": SETTINGS_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return settings
+
+# Sections the mini-app needs at startup, in one authenticated round trip
+BOOTSTRAP_SECTIONS = ("profile", "countdown", "settings", "tasks", "referral_stats")
+
+@api_router.get("/bootstrap")
+async def bootstrap(request: Request, sections: Optional[str] = None,
+                    current_user = Depends(get_current_user)):
+    """Combined startup payload; ``sections`` is a comma-separated subset"""
+    requested = [s.strip() for s in sections.split(',') if s.strip()] if sections else list(BOOTSTRAP_SECTIONS)
+    unknown = [s for s in requested if s not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    
+    if 'telegram_id' not in current_user:
+        raise HTTPException(status_code=403, detail="Admin cannot access user profile")
+    
+    # Profile and referral stats share one user read, started alongside the rest
+    user_load = None
+    if "profile" in requested or "referral_stats" in requested:
+        user_load = asyncio.ensure_future(UserLoader()(request, current_user))
+    
+    async def profile():
+        return await user_load
+    
+    async def countdown():
+        return get_countdown_data()
+    
+    async def settings():
+        value, _ = await settings_cache.get(load_settings)
+        return value
+    
+    async def tasks():
+        return await build_task_list(current_user['telegram_id'])
+    
+    async def referral_stats():
+        return await build_referral_stats(await user_load)
+    
+    loaders = {
+        "profile": profile,
+        "countdown": countdown,
+        "settings": settings,
+        "tasks": tasks,
+        "referral_stats": referral_stats,
+    }
+    names = list(dict.fromkeys(requested))
+    results = await asyncio.gather(*(loaders[name]() for name in names))
+    return dict(zip(names, results))
+
 # Admin Routes
 @api_router.post("/admin/login")
 async def admin_login(req: AdminLoginRequest):
@@ -510,217 +815,142 @@ async def admin_login(req: AdminLoginRequest):
     token = create_jwt_token({"username": req.username, "is_admin": True})
     return {"token": token}
 
-@api_router.get("/admin/stats")
-async def get_admin_stats(admin = Depends(get_admin_user)):
-    total_users = await db.users.count_documents({})
-    total_points_result = await db.users.aggregate([{"$group": {"_id": None, "total": {"$sum": "$points"}}}]).to_list(1)
-    total_points = total_points_result[0]['total'] if total_points_result else 0
-    pending_withdrawals = await db.withdrawals.count_documents({"status": "pending"})
-    total_tasks = await db.tasks.count_documents({"active": True})
-    total_task_completions = await db.task_completions.count_documents({})
-    total_checkins = await db.users.count_documents({"last_checkin": {"$ne": None}})
-    total_referrals_result = await db.users.aggregate([{"$group": {"_id": None, "total": {"$sum": "$referral_count"}}}]).to_list(1)
-    total_referrals = total_referrals_result[0]['total'] if total_referrals_result else 0
-    join_bonus_claimed = await db.users.count_documents({"join_bonus_claimed": True})
-    
-    # Get users joined today
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    users_today = await db.users.count_documents({"join_date": {"$gte": today.isoformat()}})
+async def load_admin_stats():
+    # Single read of the materialized counters instead of scanning users
+    totals, today = await counters.get_stats(db)
     
     return {
-        "total_users": total_users,
-        "total_points": total_points,
-        "pending_withdrawals": pending_withdrawals,
-        "total_tasks": total_tasks,
-        "total_task_completions": total_task_completions,
-        "total_checkins": total_checkins,
-        "total_referrals": total_referrals,
-        "join_bonus_claimed": join_bonus_claimed,
-        "users_today": users_today
+        "total_users": totals['total_users'],
+        "total_points": totals['total_points'],
+        "pending_withdrawals": totals['pending_withdrawals'],
+        "total_tasks": totals['total_tasks'],
+        "total_task_completions": totals['total_task_completions'],
+        "total_checkins": totals['total_checkins'],
+        "total_referrals": totals['total_referrals'],
+        "join_bonus_claimed": totals['join_bonus_claimed'],
+        "users_today": today['users_joined']
     }
 
+@api_router.get("/admin/stats")
+async def get_admin_stats(admin = Depends(get_admin_user)):
+    return await load_admin_stats()
+
+# Lifetime of a ticket from /admin/stream/ticket; the client opens the stream straight away
+STREAM_TICKET_TTL_SECONDS = 30
+
+@api_router.post("/admin/stream/ticket")
+async def create_stream_ticket(admin = Depends(get_admin_user)):
+    """A short-lived, single-use ticket for /admin/stream, so the JWT never goes in a URL"""
+    ticket = await repository.create_stream_ticket(admin.get('username'), STREAM_TICKET_TTL_SECONDS)
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_TTL_SECONDS}
+
+@api_router.get("/admin/stream")
+async def admin_stream(ticket: str):
+    """Server-Sent Events: a stats snapshot, then stats deltas, activity and withdrawal changes"""
+    # EventSource cannot send headers, so it presents a ticket in the query string
+    if not await repository.consume_stream_ticket(ticket):
+        raise HTTPException(status_code=403, detail="Invalid or expired stream ticket")
+    
+    subscription = live.broker.subscribe()
+    try:
+        snapshot = await load_admin_stats()
+    except Exception:
+        live.broker.unsubscribe(subscription)
+        raise
+    
+    async def events():
+        try:
+            async for frame in live.stream(subscription, snapshot):
+                yield frame
+        finally:
+            live.broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/admin/users")
-async def get_all_users(admin = Depends(get_admin_user)):
-    users = await db.users.find({}, {"_id": 0}).sort("join_date", -1).limit(1000).to_list(1000)
-    
-    # Batch fetch task completion counts using aggregation
-    user_ids = [u['telegram_id'] for u in users]
+async def get_all_users(cursor: Optional[str] = None, limit: Optional[int] = None,
+                        admin = Depends(get_admin_user)):
+    try:
+        result = await repository.page_users(pagination.page_size(limit), cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Aggregate task completions by user
-    task_counts = await db.task_completions.aggregate([
-        {"$match": {"user_id": {"$in": user_ids}}},
-        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
-    ]).to_list(1000)
-    task_count_map = {tc['_id']: tc['count'] for tc in task_counts}
+    # tasks_completed / withdrawal_count are maintained on the user document
+    for user in result['items']:
+        for field in counters.USER_FIELDS:
+            user.setdefault(field, 0)
     
-    # Aggregate withdrawal counts by user
-    withdrawal_counts = await db.withdrawals.aggregate([
-        {"$match": {"user_id": {"$in": user_ids}}},
-        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
-    ]).to_list(1000)
-    withdrawal_count_map = {wc['_id']: wc['count'] for wc in withdrawal_counts}
+    return result
+
+# Declared before /admin/users/{telegram_id} so "search" is not taken for an id
+@api_router.get("/admin/users/search")
+async def search_users(q: str, cursor: Optional[str] = None, limit: int = 20,
+                       admin = Depends(get_admin_user)):
+    """Users by exact telegram_id, username prefix, then username substring"""
+    try:
+        result = await user_search.search(db, q, max(1, min(limit, 100)), cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Enrich users with counts
-    for user in users:
-        user['tasks_completed'] = task_count_map.get(user['telegram_id'], 0)
-        user['withdrawal_count'] = withdrawal_count_map.get(user['telegram_id'], 0)
+    for user in result['items']:
+        for field in counters.USER_FIELDS:
+            user.setdefault(field, 0)
     
-    return users
+    return result
 
 @api_router.get("/admin/users/{telegram_id}")
-async def get_user_details(telegram_id: int, admin = Depends(get_admin_user)):
+async def get_user_details(telegram_id: int, completions_limit: int = 100, withdrawals_limit: int = 50,
+                           referrals_limit: int = 100, admin = Depends(get_admin_user)):
     """Get detailed information about a specific user"""
-    user = await db.users.find_one({"telegram_id": telegram_id}, {"_id": 0})
-    if not user:
+    details = await repository.user_details(telegram_id, {
+        "completions": pagination.page_size(completions_limit),
+        "withdrawals": pagination.page_size(withdrawals_limit),
+        "referred_users": pagination.page_size(referrals_limit),
+    })
+    if not details:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get all task completions for this user
-    task_completions = await db.task_completions.find(
-        {"user_id": telegram_id},
-        {"_id": 0}
-    ).sort("completed_at", -1).limit(100).to_list(100)
-    
-    # Batch fetch all tasks for completions
-    task_ids = [c['task_id'] for c in task_completions]
-    tasks_list = await db.tasks.find({"task_id": {"$in": task_ids}}, {"_id": 0}).to_list(100) if task_ids else []
-    tasks_map = {t['task_id']: t for t in tasks_list}
-    
-    # Build completed tasks list
-    completed_tasks = []
-    for completion in task_completions:
-        task = tasks_map.get(completion['task_id'])
-        if task:
-            completed_tasks.append({
-                "task_id": task['task_id'],
-                "title": task['title'],
-                "reward_points": task['reward_points'],
-                "completed_at": completion['completed_at']
-            })
-    
-    # Get all withdrawals for this user
-    withdrawals = await db.withdrawals.find(
-        {"user_id": telegram_id},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(50).to_list(50)
-    
-    # Get referral milestones claimed
-    milestones = await db.referral_milestones.find(
-        {"user_id": telegram_id},
-        {"_id": 0}
-    ).limit(10).to_list(10)
-    
-    # Get users referred by this user
-    referred_users = await db.users.find(
-        {"referred_by": telegram_id},
-        {"_id": 0, "telegram_id": 1, "username": 1, "join_date": 1, "points": 1}
-    ).limit(100).to_list(100)
-    
+    # Totals come from the counters on the user document, not the truncated lists
+    user = details['user']
     return {
         "user": user,
-        "completed_tasks": completed_tasks,
-        "withdrawals": withdrawals,
-        "referral_milestones": milestones,
-        "referred_users": referred_users,
-        "total_tasks_completed": len(completed_tasks),
-        "total_withdrawals": len(withdrawals)
+        "completed_tasks": details['completed_tasks'],
+        "withdrawals": details['withdrawals'],
+        "referral_milestones": details['referral_milestones'],
+        "referred_users": details['referred_users'],
+        "total_tasks_completed": user.get('tasks_completed', len(details['completed_tasks'])),
+        "total_withdrawals": user.get('withdrawal_count', len(details['withdrawals'])),
+        "total_referred_users": user.get('referral_count', len(details['referred_users']))
     }
 
+@api_router.get("/admin/referrals/top")
+async def get_top_referrers(by: str = "network", limit: int = 50, admin = Depends(get_admin_user)):
+    """Top referrers by direct referrals or by whole referral network"""
+    if by not in referrals.TOP_REFERRER_SORTS:
+        raise HTTPException(status_code=400, detail=f"by must be one of: {', '.join(referrals.TOP_REFERRER_SORTS)}")
+    top, deepest = await asyncio.gather(
+        referrals.top_referrers(db, by, pagination.page_size(limit)),
+        referrals.deepest_referral(db)
+    )
+    return {"referrers": top, "max_depth": deepest['referral_depth'] if deepest else 0, "deepest": deepest}
+
 @api_router.get("/admin/recent-activities")
-async def get_recent_activities(admin = Depends(get_admin_user), limit: int = 50):
-    """Get recent activities across the platform"""
-    activities = []
-    
-    # Get recent user registrations
-    recent_users = await db.users.find(
-        {},
-        {"_id": 0, "telegram_id": 1, "username": 1, "join_date": 1}
-    ).sort("join_date", -1).limit(20).to_list(20)
-    
-    for user in recent_users:
-        activities.append({
-            "type": "user_joined",
-            "telegram_id": user['telegram_id'],
-            "username": user['username'],
-            "timestamp": user['join_date'],
-            "description": f"@{user['username']} joined the event"
-        })
-    
-    # Get recent task completions
-    recent_completions = await db.task_completions.find(
-        {},
-        {"_id": 0}
-    ).sort("completed_at", -1).limit(20).to_list(20)
-    
-    # Batch fetch users and tasks for completions
-    if recent_completions:
-        user_ids = list(set(c['user_id'] for c in recent_completions))
-        task_ids = list(set(c['task_id'] for c in recent_completions))
-        
-        users_list = await db.users.find({"telegram_id": {"$in": user_ids}}, {"_id": 0, "telegram_id": 1, "username": 1}).to_list(100)
-        users_map = {u['telegram_id']: u for u in users_list}
-        
-        tasks_list = await db.tasks.find({"task_id": {"$in": task_ids}}, {"_id": 0, "task_id": 1, "title": 1, "reward_points": 1}).to_list(100)
-        tasks_map = {t['task_id']: t for t in tasks_list}
-        
-        for completion in recent_completions:
-            user = users_map.get(completion['user_id'])
-            task = tasks_map.get(completion['task_id'])
-            if user and task:
-                activities.append({
-                    "type": "task_completed",
-                    "telegram_id": completion['user_id'],
-                    "username": user.get('username', 'Unknown'),
-                    "timestamp": completion['completed_at'],
-                    "description": f"@{user.get('username', 'Unknown')} completed '{task['title']}' (+{task['reward_points']} pts)"
-                })
-    
-    # Get recent withdrawals
-    recent_withdrawals = await db.withdrawals.find(
-        {},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(20).to_list(20)
-    
-    for withdrawal in recent_withdrawals:
-        activities.append({
-            "type": "withdrawal",
-            "telegram_id": withdrawal['user_id'],
-            "username": withdrawal.get('username', 'Unknown'),
-            "timestamp": withdrawal['timestamp'],
-            "description": f"@{withdrawal.get('username', 'Unknown')} requested {withdrawal['amount']} pts withdrawal ({withdrawal['status']})"
-        })
-    
-    # Get recent check-ins (users with last_checkin)
-    recent_checkins = await db.users.find(
-        {"last_checkin": {"$ne": None}},
-        {"_id": 0, "telegram_id": 1, "username": 1, "last_checkin": 1, "streak_day": 1}
-    ).sort("last_checkin", -1).limit(20).to_list(20)
-    
-    for checkin in recent_checkins:
-        activities.append({
-            "type": "checkin",
-            "telegram_id": checkin['telegram_id'],
-            "username": checkin['username'],
-            "timestamp": checkin['last_checkin'],
-            "description": f"@{checkin['username']} checked in (Day {checkin['streak_day']} streak)"
-        })
-    
-    # Sort all activities by timestamp
-    activities.sort(key=lambda x: x['timestamp'] if x['timestamp'] else '', reverse=True)
-    
-    return activities[:limit]
+async def get_recent_activities(admin = Depends(get_admin_user), limit: int = 50, before: Optional[str] = None):
+    """Get recent activities across the platform, newest first"""
+    # One range read on the activity log's timestamp index
+    return await activity.recent(db, min(max(limit, 1), 500), before=before)
 
 @api_router.get("/admin/task-stats")
 async def get_task_stats(admin = Depends(get_admin_user)):
     """Get statistics for each task"""
-    tasks = await db.tasks.find({}, {"_id": 0}).limit(100).to_list(100)
+    tasks = await repository.list_tasks()
     
-    # Batch fetch completion counts using aggregation
-    task_ids = [t['task_id'] for t in tasks]
-    completion_counts = await db.task_completions.aggregate([
-        {"$match": {"task_id": {"$in": task_ids}}},
-        {"$group": {"_id": "$task_id", "count": {"$sum": 1}}}
-    ]).to_list(100) if task_ids else []
-    completion_map = {cc['_id']: cc['count'] for cc in completion_counts}
+    # Completion counts come from the per-task counters
+    completion_map = await counters.get_task_counts(db, [t['task_id'] for t in tasks])
     
     task_stats = []
     for task in tasks:
@@ -735,47 +965,158 @@ async def get_task_stats(admin = Depends(get_admin_user)):
 
 @api_router.post("/admin/adjust-points")
 async def adjust_points(req: AdminPointsAdjustRequest, admin = Depends(get_admin_user)):
-    await db.users.update_one(
-        {"telegram_id": req.telegram_id},
-        {"$inc": {"points": req.amount}}
-    )
+    updated = await repository.update_user(req.telegram_id, {"$inc": {"points": req.amount}})
+    leaderboard.apply(updated)
+    if updated:
+        await counters.record_points(db, updated['points'], req.amount)
+        await activity.record(db, "points_adjusted", updated['telegram_id'], updated['username'],
+                              f"Admin adjusted @{updated['username']} by {req.amount:+} pts", points=req.amount)
     return {"success": True}
 
+async def run_bulk(kind: str, size: int, req, admin, apply):
+    try:
+        return await bulk.run_batch(db, kind, admin.get('username'), size, req.dry_run, req.batch_id, apply)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Batch already submitted")
+
+@api_router.post("/admin/adjust-points/bulk")
+async def bulk_adjust_points(req: BulkPointsAdjustRequest, admin = Depends(get_admin_user)):
+    """Adjust many users' points; per-item results, optionally as a dry run"""
+    adjustments = [(item.telegram_id, item.amount) for item in req.adjustments]
+    return await run_bulk("adjust_points", len(adjustments), req, admin, lambda batch_id: bulk.adjust_points(
+        db, leaderboard, adjustments, batch_id, req.dry_run
+    ))
+
+@api_router.get("/admin/batches/{batch_id}")
+async def get_bulk_batch(batch_id: str, admin = Depends(get_admin_user)):
+    batch = await bulk.get_batch(db, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
 @api_router.get("/admin/withdrawals")
-async def get_all_withdrawals(admin = Depends(get_admin_user)):
-    withdrawals = await db.withdrawals.find({}, {"_id": 0}).sort("timestamp", -1).limit(500).to_list(500)
-    return withdrawals
+async def get_all_withdrawals(cursor: Optional[str] = None, limit: Optional[int] = None,
+                              admin = Depends(get_admin_user)):
+    try:
+        return await repository.page_withdrawals(pagination.page_size(limit), cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-@api_router.post("/admin/withdrawal/{withdrawal_id}/approve")
-async def approve_withdrawal(withdrawal_id: str, admin = Depends(get_admin_user)):
-    withdrawal = await db.withdrawals.find_one({"withdrawal_id": withdrawal_id})
+async def transition_withdrawal(withdrawal_id: str, status: str, admin_note: str):
+    """Move a pending withdrawal to its final status in one guarded update"""
+    withdrawal = await repository.transition_withdrawal(withdrawal_id, status, admin_note)
     if not withdrawal:
-        raise HTTPException(status_code=404, detail="Withdrawal not found")
-    
-    await db.withdrawals.update_one(
-        {"withdrawal_id": withdrawal_id},
-        {"$set": {"status": "approved", "admin_note": "Approved"}}
-    )
-    
-    # Deduct points from user
-    await db.users.update_one(
-        {"telegram_id": withdrawal['user_id']},
-        {"$inc": {"points": -withdrawal['amount']}}
+        if not await repository.withdrawal_exists(withdrawal_id):
+            raise HTTPException(status_code=404, detail="Withdrawal not found")
+        raise HTTPException(status_code=400, detail="Withdrawal already processed")
+    return withdrawal
+
+@api_router.get("/admin/export/{kind}")
+async def export_collection(
+    kind: str,
+    format: str = "csv",
+    gzip: bool = False,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    min_points: Optional[int] = None,
+    admin = Depends(get_admin_user)
+):
+    """Stream users, withdrawals or task_completions as CSV or NDJSON"""
+    if kind not in exports.EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if format not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    
+    # Stored dates are UTC ISO strings; naive bounds are taken as UTC
+    def bound(value):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+    
+    query = exports.build_query(kind, status=status, since=bound(since), until=bound(until), min_points=min_points)
+    filename = f"{kind}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.{format}"
+    media_type = exports.FORMATS[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        exports.stream_export(db, kind, format, query, gzip=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
+
+@api_router.post("/admin/withdrawal/{withdrawal_id}/approve")
+async def approve_withdrawal(withdrawal_id: str, admin = Depends(get_admin_user)):
+    withdrawal = await transition_withdrawal(withdrawal_id, "approved", "Approved")
+    
+    if withdrawal.get('reserved'):
+        # Points left the balance at request time; just settle the reservation
+        await asyncio.gather(
+            repository.increment_user(withdrawal['user_id'], reserved_points=-withdrawal['amount']),
+            counters.increment_global(db, pending_withdrawals=-1)
+        )
+    else:
+        # Requests filed before reservations existed still deduct on approval
+        updated = await repository.update_user(withdrawal['user_id'], {"$inc": {"points": -withdrawal['amount']}})
+        leaderboard.apply(updated)
+        if updated:
+            await counters.record_points(db, updated['points'], -withdrawal['amount'], pending_withdrawals=-1)
+        else:
+            await counters.increment_global(db, pending_withdrawals=-1)
     
+    username = withdrawal.get('username', 'Unknown')
+    await activity.record(db, "withdrawal_approved", withdrawal['user_id'], username,
+                          f"@{username}'s {withdrawal['amount']} pts withdrawal was approved",
+                          withdrawal_id=withdrawal_id, amount=withdrawal['amount'])
     return {"success": True}
 
 @api_router.post("/admin/withdrawal/{withdrawal_id}/reject")
 async def reject_withdrawal(withdrawal_id: str, reason: str = "Rejected", admin = Depends(get_admin_user)):
-    await db.withdrawals.update_one(
-        {"withdrawal_id": withdrawal_id},
-        {"$set": {"status": "rejected", "admin_note": reason}}
-    )
+    withdrawal = await transition_withdrawal(withdrawal_id, "rejected", reason)
+    
+    if not withdrawal.get('reserved'):
+        await counters.increment_global(db, pending_withdrawals=-1)
+    else:
+        # Release the reservation back to the user's balance
+        updated = await repository.update_user(
+            withdrawal['user_id'],
+            {"$inc": {"points": withdrawal['amount'], "reserved_points": -withdrawal['amount']}}
+        )
+        leaderboard.apply(updated)
+        if updated:
+            await counters.record_points(db, updated['points'], withdrawal['amount'], pending_withdrawals=-1)
+        else:
+            await counters.increment_global(db, pending_withdrawals=-1)
+    
+    username = withdrawal.get('username', 'Unknown')
+    await activity.record(db, "withdrawal_rejected", withdrawal['user_id'], username,
+                          f"@{username}'s {withdrawal['amount']} pts withdrawal was rejected ({reason})",
+                          withdrawal_id=withdrawal_id, amount=withdrawal['amount'])
     return {"success": True}
 
+@api_router.post("/admin/withdrawals/bulk-approve")
+async def bulk_approve_withdrawals(req: BulkWithdrawalRequest, admin = Depends(get_admin_user)):
+    """Approve many pending withdrawals; per-item results, optionally as a dry run"""
+    return await run_bulk("approve_withdrawals", len(req.withdrawal_ids), req, admin,
+                          lambda batch_id: bulk.settle_withdrawals(
+                              db, leaderboard, req.withdrawal_ids, "approved", "Approved", batch_id, req.dry_run
+                          ))
+
+@api_router.post("/admin/withdrawals/bulk-reject")
+async def bulk_reject_withdrawals(req: BulkWithdrawalRequest, admin = Depends(get_admin_user)):
+    """Reject many pending withdrawals with one reason, releasing their reservations"""
+    return await run_bulk("reject_withdrawals", len(req.withdrawal_ids), req, admin,
+                          lambda batch_id: bulk.settle_withdrawals(
+                              db, leaderboard, req.withdrawal_ids, "rejected", req.reason, batch_id, req.dry_run
+                          ))
+
 @api_router.get("/admin/tasks")
 async def get_admin_tasks(admin = Depends(get_admin_user)):
-    tasks = await db.tasks.find({}, {"_id": 0}).limit(100).to_list(100)
+    tasks = await repository.list_tasks()
     return tasks
 
 @api_router.post("/admin/tasks")
@@ -791,7 +1132,10 @@ async def create_task(req: TaskCreateRequest, admin = Depends(get_admin_user)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.tasks.insert_one(task_doc)
+    await repository.insert_task(task_doc)
+    await counters.increment_global(db, total_tasks=1)
+    await activity.record(db, "task_created", None, None,
+                          f"Task '{req.title}' created (+{req.reward_points} pts)", task_id=task_doc['task_id'])
     
     # Return without _id
     return {"success": True, "task": {
@@ -806,27 +1150,30 @@ async def create_task(req: TaskCreateRequest, admin = Depends(get_admin_user)):
 
 @api_router.delete("/admin/tasks/{task_id}")
 async def delete_task(task_id: str, admin = Depends(get_admin_user)):
-    await db.tasks.update_one(
-        {"task_id": task_id},
-        {"$set": {"active": False}}
-    )
+    task = await repository.deactivate_task(task_id)
+    if task:
+        await counters.increment_global(db, total_tasks=-1)
+        await activity.record(db, "task_deleted", None, None, f"Task '{task['title']}' deleted", task_id=task_id)
     return {"success": True}
 
 @api_router.put("/admin/settings")
 async def update_settings(req: AdminSettingsUpdate, admin = Depends(get_admin_user)):
     update_data = {k: v for k, v in req.model_dump().items() if v is not None}
     
-    await db.admin_settings.update_one(
-        {},
-        {"$set": update_data},
-        upsert=True
-    )
+    await repository.update_settings(update_data)
+    settings_cache.invalidate()
+    await activity.record(db, "settings_updated", None, None,
+                          f"Event settings updated ({', '.join(sorted(update_data)) or 'no changes'})")
     
     return {"success": True}
 
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.ProfilerMiddleware, authorize=is_admin_token,
+                   store=lambda doc: profiler.save(db, doc))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -835,6 +1182,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_services():
+    try:
+        await indexes.ensure_indexes(db)
+        report = await indexes.audit_indexes(db)
+        if report['missing'] or report['extra']:
+            logger.warning(f"Index audit: missing={report['missing']} extra={report['extra']}")
+    except indexes.MissingGuardIndex as e:
+        # Serving without these would let users claim the same reward twice
+        logger.error(str(e))
+        raise
+    except Exception as e:
+        logger.error(f"Index setup error: {e}")
+    try:
+        await leaderboard.refresh(db)
+    except Exception as e:
+        logger.error(f"Leaderboard load error: {e}")
+    try:
+        await counters.ensure_counters(db)
+    except Exception as e:
+        logger.error(f"Counters bootstrap error: {e}")
+    try:
+        await referrals.ensure_graph(db)
+    except Exception as e:
+        logger.error(f"Referral graph bootstrap error: {e}")
+    try:
+        await user_search.ensure_search_fields(db)
+    except Exception as e:
+        logger.error(f"User search backfill error: {e}")
+    background_tasks.append(asyncio.create_task(leaderboard.run_reconciler(db)))
+    if not live.broker.local:
+        background_tasks.append(asyncio.create_task(live.watch_changes(db)))
+    webhook_queue.start()
+    tap_accumulator.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await webhook_queue.stop()
+    await tap_accumulator.stop()
+    for task in background_tasks:
+        task.cancel()
+    repository.close()
\ No newline at end of file
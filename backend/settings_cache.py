@@ -0,0 +1,55 @@
+"""Process-local cache for the admin_settings singleton.
+
+Settings are read on every mini-app screen load but only change through
+``PUT /api/admin/settings``, which invalidates this process's copy. The TTL
+bounds how long other API processes can serve a stale copy.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '30'))
+
+
+def compute_etag(settings):
+    """Strong ETag over the canonical JSON encoding of the settings"""
+    body = json.dumps(settings, sort_keys=True, separators=(',', ':'), default=str)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+class SettingsCache:
+    def __init__(self, ttl=SETTINGS_CACHE_TTL):
+        self.ttl = ttl
+        self._value = None
+        self._etag = None
+        self._loaded_at = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def get(self, loader):
+        """Return (settings, etag), calling ``loader()`` at most once per expiry"""
+        if self._fresh():
+            return self._value, self._etag
+        async with self._lock:
+            if self._fresh():
+                return self._value, self._etag
+            generation = self._generation
+            value = await loader()
+            etag = compute_etag(value)
+            # An invalidation during the load means the value may predate the write
+            if generation == self._generation:
+                self._value, self._etag = value, etag
+                self._loaded_at = time.monotonic()
+            return value, etag
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = None
+
+
+settings_cache = SettingsCache()
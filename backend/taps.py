@@ -0,0 +1,186 @@
+"""Tap-for-fun points, coalesced in memory and written in periodic batches.
+
+Clients count taps locally and post them as numbered batches per page
+session. ``TapAccumulator.add`` drops replayed sequence numbers, caps each
+user at TAP_MAX_PER_SECOND sustained taps (bursts up to TAP_BURST), and
+adds the accepted points to a per-user delta without touching the database.
+
+Every TAP_FLUSH_INTERVAL_MS the deltas are swapped out and written as one
+unordered ``bulk_write``, followed by one read of the new totals for the
+leaderboard and one counters increment, so sustained tap traffic costs
+three round trips per interval however many users are tapping. A flush
+also runs early when TAP_MAX_PENDING_USERS users are waiting, and once
+more on shutdown.
+
+Sequence numbers and rate caps are tracked per process. Histogram moves use
+the totals read back after the write, so a concurrent points change for the
+same user can place them one bucket off until ``counters.py rebuild``.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import counters
+from leaderboard import LEADERBOARD_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+TAP_POINTS = int(os.environ.get('TAP_POINTS', '1'))
+TAP_MAX_PER_SECOND = float(os.environ.get('TAP_MAX_PER_SECOND', '10'))
+TAP_BURST = int(os.environ.get('TAP_BURST', '50'))
+TAP_MAX_BATCH = int(os.environ.get('TAP_MAX_BATCH', '500'))
+TAP_FLUSH_INTERVAL_MS = int(os.environ.get('TAP_FLUSH_INTERVAL_MS', '250'))
+TAP_MAX_PENDING_USERS = int(os.environ.get('TAP_MAX_PENDING_USERS', '5000'))
+TAP_MAX_SESSIONS = int(os.environ.get('TAP_MAX_SESSIONS', '100000'))
+
+
+class TapAccumulator:
+    def __init__(self, db, leaderboard, interval=TAP_FLUSH_INTERVAL_MS / 1000):
+        self.db = db
+        self.leaderboard = leaderboard
+        self.interval = interval
+        # telegram_id -> [points, taps] not yet written
+        self._pending = {}
+        # (telegram_id, session_id) -> last accepted seq; telegram_id -> (allowance, updated)
+        self._sessions = OrderedDict()
+        self._allowance = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self._flushing = asyncio.Lock()
+        self.accepted = 0
+        self.capped = 0
+        self.duplicates = 0
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+
+    def _take_allowance(self, telegram_id, taps):
+        """How many of ``taps`` fit under the user's sustained rate"""
+        now = time.monotonic()
+        allowance, updated = self._allowance.get(telegram_id, (TAP_BURST, now))
+        allowance = min(TAP_BURST, allowance + (now - updated) * TAP_MAX_PER_SECOND)
+        accepted = min(taps, int(allowance))
+        self._allowance[telegram_id] = (allowance - accepted, now)
+        self._allowance.move_to_end(telegram_id)
+        if len(self._allowance) > TAP_MAX_SESSIONS:
+            self._allowance.popitem(last=False)
+        return accepted
+
+    def add(self, telegram_id, session_id, seq, taps):
+        """Accept a batch; returns (taps accepted, whether it was a replay)"""
+        key = (telegram_id, session_id)
+        if seq <= self._sessions.get(key, 0):
+            self.duplicates += 1
+            return 0, True
+        self._sessions[key] = seq
+        self._sessions.move_to_end(key)
+        if len(self._sessions) > TAP_MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+
+        accepted = self._take_allowance(telegram_id, taps)
+        self.capped += taps - accepted
+        if accepted:
+            pending = self._pending.setdefault(telegram_id, [0, 0])
+            pending[0] += accepted * TAP_POINTS
+            pending[1] += accepted
+            self.accepted += accepted
+            if len(self._pending) >= TAP_MAX_PENDING_USERS:
+                self._wake.set()
+        return accepted, False
+
+    def _restore(self, batch):
+        for telegram_id, (points, taps) in batch.items():
+            pending = self._pending.setdefault(telegram_id, [0, 0])
+            pending[0] += points
+            pending[1] += taps
+
+    async def flush(self):
+        """Write every pending delta; returns the number of users written"""
+        async with self._flushing:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            ids = list(batch)
+            ops = [
+                UpdateOne({"telegram_id": telegram_id}, {"$inc": {"points": points, "taps": taps}})
+                for telegram_id, (points, taps) in batch.items()
+            ]
+            try:
+                await self.db.users.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # The others were applied; keep only the failed deltas for the next flush
+                failed_ids = [ids[error['index']] for error in e.details.get('writeErrors', [])]
+                self._restore({telegram_id: batch[telegram_id] for telegram_id in failed_ids})
+                for telegram_id in failed_ids:
+                    del batch[telegram_id]
+                self.failed += len(failed_ids)
+                logger.error(f"Tap flush: {len(failed_ids)} of {len(ops)} updates failed")
+            except Exception as e:
+                self._restore(batch)
+                self.failed += len(batch)
+                logger.error(f"Tap flush error, retrying next interval: {e}")
+                return 0
+
+            self.flushes += 1
+            self.written += len(batch)
+            try:
+                await self._record(batch)
+            except Exception as e:
+                logger.error(f"Tap counters update error: {e}")
+            return len(batch)
+
+    async def _record(self, batch):
+        """Update the leaderboard and counters from the users' new totals"""
+        users = await self.db.users.find(
+            {"telegram_id": {"$in": list(batch)}}, LEADERBOARD_PROJECTION
+        ).to_list(len(batch))
+        for user in users:
+            self.leaderboard.apply(user)
+        await counters.record_points_many(
+            self.db, [(user.get('points', 0), batch[user['telegram_id']][0]) for user in users]
+        )
+
+    async def run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Tap flush loop error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Let an in-progress flush finish, then write whatever is still pending"""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"Stopping with unwritten taps for {len(self._pending)} users")
+
+    def stats(self):
+        return {
+            "pending_users": len(self._pending),
+            "accepted": self.accepted,
+            "capped": self.capped,
+            "duplicates": self.duplicates,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+        }
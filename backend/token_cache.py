@@ -0,0 +1,42 @@
+"""LRU of already-verified JWTs so repeat requests skip the HMAC check.
+
+Entries are keyed by the raw token and never outlive the token's ``exp``,
+so a cached payload is only ever returned while the token itself is valid.
+"""
+import os
+import time
+from collections import OrderedDict
+
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', '10000'))
+
+
+class TokenCache:
+    def __init__(self, maxsize=JWT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        payload, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return payload
+
+    def put(self, token, payload):
+        expires_at = payload.get('exp')
+        self._entries[token] = (payload, float(expires_at) if expires_at is not None else None)
+        self._entries.move_to_end(token)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+token_cache = TokenCache()
@@ -0,0 +1,125 @@
+"""Bounded in-process queue between the Telegram webhook and the bot handlers.
+
+The webhook only validates and enqueues, so Telegram gets its 200 straight
+away. Updates are sharded by chat onto single-worker lanes, which keeps
+per-chat ordering while different chats are handled concurrently. Recently
+seen update_ids are remembered so Telegram redeliveries are dropped.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_DEDUP_WINDOW = int(os.environ.get('WEBHOOK_DEDUP_WINDOW', '10000'))
+
+# Update types whose payload identifies the chat (or user) it belongs to
+_CHAT_PAYLOADS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "callback_query", "my_chat_member", "chat_member", "chat_join_request",
+    "inline_query", "chosen_inline_result", "shipping_query",
+    "pre_checkout_query", "poll_answer",
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def chat_key(update_data):
+    """Return the chat (or sender) id an update belongs to, for ordering"""
+    for name in _CHAT_PAYLOADS:
+        payload = update_data.get(name)
+        if not isinstance(payload, dict):
+            continue
+        for owner in (payload.get('chat'), (payload.get('message') or {}).get('chat'),
+                      payload.get('from'), payload.get('user')):
+            if isinstance(owner, dict) and 'id' in owner:
+                return owner['id']
+    return update_data['update_id']
+
+
+class UpdateQueue:
+    def __init__(self, handler, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE,
+                 dedup_window=WEBHOOK_DEDUP_WINDOW):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.dedup_window = dedup_window
+        self._lanes = [asyncio.Queue() for _ in range(workers)]
+        self._workers = []
+        self._seen = OrderedDict()
+        self.depth = 0
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def submit(self, update_data):
+        """Enqueue an update; returns False for a duplicate, raises QueueFull when saturated"""
+        update_id = update_data['update_id']
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        if self.depth >= self.maxsize:
+            self.rejected += 1
+            raise QueueFull()
+
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+
+        lane = self._lanes[chat_key(update_data) % len(self._lanes)]
+        lane.put_nowait((asyncio.get_running_loop().time(), update_data))
+        self.depth += 1
+        self.received += 1
+        return True
+
+    async def _work(self, lane):
+        loop = asyncio.get_running_loop()
+        while True:
+            enqueued_at, update_data = await lane.get()
+            self.last_lag = loop.time() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                await self.handler(update_data)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Update {update_data.get('update_id')} failed: {e}")
+            finally:
+                self.depth -= 1
+                self.processed += 1
+                lane.task_done()
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work(lane)) for lane in self._lanes]
+
+    async def stop(self, timeout=10.0):
+        """Drain queued updates for up to ``timeout`` seconds, then stop the workers"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping with {self.depth} unprocessed updates")
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "capacity": self.maxsize,
+            "lanes": [lane.qsize() for lane in self._lanes],
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "last_lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+        }
@@ -0,0 +1,178 @@
+"""Indexed username / telegram_id search for the admin users page.
+
+Every user document carries ``username_lower`` (the NFKC-casefolded
+username without a leading "@") and ``username_ngrams`` (its distinct
+trigrams). A query is answered in ranked phases, each an index range:
+
+1. exact telegram_id, when the query is all digits
+2. username prefix, on ``username_lower``
+3. username substring, on ``username_ngrams`` (queries of 3+ characters),
+   confirmed against ``username_lower``
+
+Run ``python user_search.py backfill`` to add the fields to users created
+before they existed; the API also does this once at startup.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import unicodedata
+
+from pymongo import UpdateOne
+
+import pagination
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+SEARCH_PROJECTION = {"_id": 0, "username_ngrams": 0}
+# Substring candidates are confirmed in Python; fetch a few extra per round
+SUBSTRING_BATCH_FACTOR = 4
+
+
+def _telegram_id_or_none(value):
+    return value is None or pagination.integer(value)
+
+
+# (phase, username_lower, telegram_id); a substring cursor leaves the name empty
+CURSOR_CHECKS = (pagination.string, pagination.string, _telegram_id_or_none)
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text or "").casefold().strip().lstrip("@")
+
+
+def ngrams(normalized):
+    return sorted({normalized[i:i + NGRAM_SIZE] for i in range(len(normalized) - NGRAM_SIZE + 1)})
+
+
+def search_fields(username):
+    """Fields to store on a user document for ``username``"""
+    normalized = normalize(username)
+    return {"username_lower": normalized, "username_ngrams": ngrams(normalized)}
+
+
+def _after(fields, values):
+    """Filter for documents strictly after ``values`` in ascending (fields) order"""
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {f: v for f, v in zip(fields[:i], values[:i])}
+        clause[field] = {"$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def search(db, query, limit, cursor=None):
+    """One page of ranked matches as {"items", "next_cursor"}; raises pagination.InvalidCursor"""
+    q = normalize(query)
+    if not q:
+        return {"items": [], "next_cursor": None}
+    phase, position = ("id", None)
+    if cursor:
+        values = pagination.decode_cursor(cursor, CURSOR_CHECKS)
+        phase, position = values[0], values[1:]
+        if phase not in ("prefix", "substring"):
+            raise pagination.InvalidCursor(cursor)
+
+    items = []
+    # The exact-id match is shown once, first, and left out of the later phases
+    exclude = {}
+    if q.isdigit():
+        exclude = {"telegram_id": {"$ne": int(q)}}
+        if phase == "id":
+            user = await db.users.find_one({"telegram_id": int(q)}, SEARCH_PROJECTION)
+            if user:
+                items.append({**user, "match": "id"})
+
+    if phase in ("id", "prefix"):
+        keys = ("username_lower", "telegram_id")
+        filters = [{"username_lower": {"$gte": q, "$lt": q + "\uffff"}}] + ([exclude] if exclude else [])
+        if phase == "prefix":
+            filters.append(_after(keys, position))
+        wanted = limit - len(items)
+        rows = await db.users.find({"$and": filters}, SEARCH_PROJECTION).sort(
+            [(k, 1) for k in keys]
+        ).limit(wanted + 1).to_list(wanted + 1)
+        items += [{**row, "match": "prefix"} for row in rows[:wanted]]
+        if len(rows) > wanted:
+            last = rows[wanted - 1] if wanted else None
+            next_values = ["prefix", last['username_lower'], last['telegram_id']] if last else ["prefix", "", 0]
+            return {"items": items, "next_cursor": pagination.encode_cursor(next_values)}
+        phase, position = "substring", None
+
+    if len(q) < NGRAM_SIZE:
+        return {"items": items, "next_cursor": None}
+
+    # Substring matches that are not prefix matches, in telegram_id order
+    base = {"username_ngrams": {"$all": ngrams(q)}, **exclude}
+    last_id = position[1] if position else None
+    wanted = limit - len(items)
+    while True:
+        filter_ = dict(base)
+        if last_id is not None:
+            filter_["telegram_id"] = {"$gt": last_id, **filter_.get("telegram_id", {})}
+        batch = max(wanted + 1, 1) * SUBSTRING_BATCH_FACTOR
+        rows = await db.users.find(filter_, SEARCH_PROJECTION).sort("telegram_id", 1).limit(batch).to_list(batch)
+        for row in rows:
+            name = row.get('username_lower', '')
+            if q in name and not name.startswith(q):
+                if wanted == 0:
+                    return {"items": items, "next_cursor": pagination.encode_cursor(["substring", "", last_id])}
+                items.append({**row, "match": "substring"})
+                wanted -= 1
+            last_id = row['telegram_id']
+        if len(rows) < batch:
+            return {"items": items, "next_cursor": None}
+
+
+async def backfill(db, batch_size=1000):
+    """Add search fields to users missing them; returns the number updated"""
+    ops, updated = [], 0
+    async for user in db.users.find({"username_lower": {"$exists": False}}, {"_id": 0, "telegram_id": 1, "username": 1}):
+        ops.append(UpdateOne({"telegram_id": user['telegram_id']}, {"$set": search_fields(user.get('username'))}))
+        if len(ops) >= batch_size:
+            await db.users.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            ops = []
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    if updated:
+        logger.info(f"Added search fields to {updated} users")
+    return updated
+
+
+async def ensure_search_fields(db):
+    if await db.users.find_one({"username_lower": {"$exists": False}}, {"_id": 1}):
+        await backfill(db)
+
+
+def main():
+    import repository
+
+    parser = argparse.ArgumentParser(description="Backfill search fields or search users")
+    parser.add_argument("command", choices=["backfill", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = repository.db
+
+    async def run():
+        if args.command == "backfill":
+            await backfill(db)
+            return 0
+        result = await search(db, args.query, args.limit)
+        for user in result['items']:
+            print(f"{user['telegram_id']:>12} @{user.get('username')} ({user['match']})")
+        return 0
+
+    try:
+        sys.exit(asyncio.run(run()))
+    finally:
+        repository.close()
+
+
+if __name__ == '__main__':
+    main()
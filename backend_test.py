@@ -123,7 +123,8 @@ class APITester:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                # Paginated: {"items": [...], "next_cursor": ...}
+                data = response.json().get('items')
                 
                 if isinstance(data, list):
                     if len(data) > 0:
@@ -181,7 +182,7 @@ class APITester:
                 self.log_test("User Details API", False, "Could not get users list for testing")
                 return False
                 
-            users = response.json()
+            users = response.json()['items']
             if not users or len(users) == 0:
                 self.log_test("User Details API", True, "No users to test with (empty system)")
                 return True
@@ -1,13 +1,17 @@
-import React, { createContext, useState, useEffect, useContext } from 'react';
+import React, { createContext, useState, useEffect, useContext, useRef } from 'react';
 import apiClient from '../utils/api';
 
 const AuthContext = createContext();
 
+const STARTUP_SECTIONS = ['countdown', 'settings', 'tasks', 'referral_stats'];
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('token'));
   const [loading, setLoading] = useState(true);
   const [isAdmin, setIsAdmin] = useState(false);
+  // Sections of the startup payload not yet taken by a page
+  const startupData = useRef({});
 
   useEffect(() => {
     const initAuth = async () => {
@@ -35,7 +39,7 @@ export const AuthProvider = ({ children }) => {
           // For testing outside Telegram - create a demo user
           console.log('Not in Telegram WebApp, using demo user');
           if (token) {
-            await fetchUserProfile();
+            await restoreSession();
           } else {
             // Auto-login with demo user for testing
             await authenticateDemoUser();
@@ -68,6 +72,9 @@ export const AuthProvider = ({ children }) => {
       setToken(newToken);
       setUser(userData);
       localStorage.setItem('token', newToken);
+      // Pages fall back to their own requests if this fails
+      await loadStartupData(STARTUP_SECTIONS)
+        .catch((error) => console.error('Failed to fetch startup data:', error));
     } catch (error) {
       console.error('Authentication failed:', error);
     } finally {
@@ -89,6 +96,9 @@ export const AuthProvider = ({ children }) => {
       setToken(newToken);
       setUser(userData);
       localStorage.setItem('token', newToken);
+      // Pages fall back to their own requests if this fails
+      await loadStartupData(STARTUP_SECTIONS)
+        .catch((error) => console.error('Failed to fetch startup data:', error));
     } catch (error) {
       console.error('Demo authentication failed:', error);
     } finally {
@@ -96,6 +106,35 @@ export const AuthProvider = ({ children }) => {
     }
   };
 
+  // Everything the pages show at startup comes from one /bootstrap call made
+  // as soon as there is a token, instead of each page fetching after auth
+  const loadStartupData = async (sections) => {
+    const response = await apiClient.get('/bootstrap', {
+      params: { sections: sections.join(',') }
+    });
+    const { profile, ...rest } = response.data;
+    startupData.current = rest;
+    return profile;
+  };
+
+  // Hands a section to the first page that asks; later visits fetch fresh data
+  const takeStartupData = (section) => {
+    const data = startupData.current[section];
+    delete startupData.current[section];
+    return data;
+  };
+
+  const restoreSession = async () => {
+    try {
+      setUser(await loadStartupData(['profile', ...STARTUP_SECTIONS]));
+    } catch (error) {
+      console.error('Failed to restore session:', error);
+      logout();
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const fetchUserProfile = async () => {
     try {
       const response = await apiClient.get('/user/profile');
@@ -145,7 +184,8 @@ export const AuthProvider = ({ children }) => {
         setUser,
         adminLogin,
         logout,
-        refreshUser: fetchUserProfile
+        refreshUser: fetchUserProfile,
+        takeStartupData
       }}
     >
       {children}
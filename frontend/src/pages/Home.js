@@ -9,16 +9,20 @@ import { Home as HomeIcon, CheckCircle, Gift, Users, Play, DollarSign, Trophy }
 
 const Home = () => {
   const navigate = useNavigate();
-  const { user, loading, refreshUser } = useAuth();
+  const { user, loading, refreshUser, takeStartupData } = useAuth();
   const [countdown, setCountdown] = useState({});
   const [settings, setSettings] = useState({});
 
   useEffect(() => {
-    fetchCountdown();
-    fetchSettings();
+    // Startup data arrives with the session; fetch only what it did not bring
+    if (loading) return;
+    const startupCountdown = takeStartupData('countdown');
+    const startupSettings = takeStartupData('settings');
+    if (startupCountdown) setCountdown(startupCountdown); else fetchCountdown();
+    if (startupSettings) setSettings(startupSettings); else fetchSettings();
     const interval = setInterval(fetchCountdown, 60000);
     return () => clearInterval(interval);
-  }, []);
+  }, [loading]);
 
   const fetchCountdown = async () => {
     try {
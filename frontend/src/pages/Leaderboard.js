@@ -8,9 +8,11 @@ import { ArrowLeft, Trophy, Medal } from 'lucide-react';
 const Leaderboard = () => {
   const navigate = useNavigate();
   const [leaderboard, setLeaderboard] = useState([]);
+  const [myRank, setMyRank] = useState(null);
 
   useEffect(() => {
     fetchLeaderboard();
+    fetchMyRank();
   }, []);
 
   const fetchLeaderboard = async () => {
@@ -22,6 +24,15 @@ const Leaderboard = () => {
     }
   };
 
+  const fetchMyRank = async () => {
+    try {
+      const response = await apiClient.get('/leaderboard/me', { params: { window: 2 } });
+      setMyRank(response.data);
+    } catch (error) {
+      console.error('Failed to fetch rank:', error);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-gradient-to-b from-yellow-900 via-orange-800 to-red-900 p-4">
       <div className="container mx-auto max-w-md">
@@ -42,6 +53,28 @@ const Leaderboard = () => {
           <p className="text-white/80 text-sm">Top 100 participants</p>
         </Card>
 
+        {myRank && (
+          <Card className="bg-white/10 backdrop-blur-md border-white/20 p-6 mb-6" data-testid="my-rank">
+            <h2 className="text-white font-bold mb-1">Your Rank: {myRank.rank_exact === false ? '~' : ''}#{myRank.rank}</h2>
+            <p className="text-white/80 text-sm mb-4">
+              Top {(100 * myRank.rank / myRank.total_users).toFixed(1)}% of {myRank.total_users} participants
+            </p>
+            <div className="space-y-2">
+              {[...myRank.above, myRank, ...myRank.below].map((entry) => (
+                <div
+                  key={entry.telegram_id}
+                  className={`flex justify-between text-sm ${
+                    entry.telegram_id === myRank.telegram_id ? 'text-yellow-300 font-bold' : 'text-white/80'
+                  }`}
+                >
+                  <span>#{entry.rank} @{entry.username}</span>
+                  <span>{entry.points} pts</span>
+                </div>
+              ))}
+            </div>
+          </Card>
+        )}
+
         <div className="space-y-3" data-testid="leaderboard-list">
           {leaderboard.map((user, index) => (
             <Card
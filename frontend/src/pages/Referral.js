@@ -9,12 +9,13 @@ import { ArrowLeft, Users, Copy, Gift } from 'lucide-react';
 
 const Referral = () => {
   const navigate = useNavigate();
-  const { user } = useAuth();
+  const { user, takeStartupData } = useAuth();
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
-    fetchReferralStats();
+    const startupStats = takeStartupData('referral_stats');
+    if (startupStats) setStats(startupStats); else fetchReferralStats();
   }, []);
 
   const fetchReferralStats = async () => {
@@ -1,21 +1,61 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import apiClient from '../utils/api';
 import { Button } from '../components/ui/button';
 import { Card } from '../components/ui/card';
 import { ArrowLeft, Play } from 'lucide-react';
 
+const TAP_SEND_INTERVAL_MS = 2000;
+const TAP_MAX_BATCH = 500;
+
 const TapForFun = () => {
   const navigate = useNavigate();
   const [settings, setSettings] = useState({});
   const [videoPlaying, setVideoPlaying] = useState(false);
   const [videoLoaded, setVideoLoaded] = useState(false);
+  const [earned, setEarned] = useState(0);
   const videoRef = React.useRef(null);
+  // Taps are counted here and sent as numbered batches; a failed batch is
+  // resent with the same seq so the server never counts it twice
+  const sessionId = useRef(`${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`);
+  const seq = useRef(0);
+  const unsentTaps = useRef(0);
+  const retryBatch = useRef(null);
+  const sending = useRef(false);
 
   useEffect(() => {
     fetchSettings();
+    const interval = setInterval(sendTaps, TAP_SEND_INTERVAL_MS);
+    return () => {
+      clearInterval(interval);
+      sendTaps();
+    };
   }, []);
 
+  const sendTaps = async () => {
+    if (sending.current) return;
+    let batch = retryBatch.current;
+    if (!batch) {
+      if (unsentTaps.current === 0) return;
+      const count = Math.min(unsentTaps.current, TAP_MAX_BATCH);
+      unsentTaps.current -= count;
+      seq.current += 1;
+      batch = { session_id: sessionId.current, seq: seq.current, taps: count };
+    }
+    sending.current = true;
+    try {
+      const response = await apiClient.post('/tap/batch', batch);
+      retryBatch.current = null;
+      setEarned((total) => total + response.data.points);
+    } catch (error) {
+      const status = error.response?.status;
+      // Keep rate-limited, busy and network failures for the next round
+      retryBatch.current = !status || status === 429 || status >= 500 ? batch : null;
+    } finally {
+      sending.current = false;
+    }
+  };
+
   const fetchSettings = async () => {
     try {
       const response = await apiClient.get('/settings');
@@ -26,6 +66,7 @@ const TapForFun = () => {
   };
 
   const handleTap = () => {
+    unsentTaps.current += 1;
     if (videoRef.current && videoLoaded) {
       // Restart video from beginning on every tap
       videoRef.current.currentTime = 0;
@@ -63,7 +104,9 @@ const TapForFun = () => {
             <h1 className="text-2xl font-black text-white">Tap for Fun</h1>
           </div>
           <p className="text-white/80 text-sm">Tap the image to play the video!</p>
-          <p className="text-yellow-300 text-xs mt-2">(No points, just for fun!)</p>
+          <p className="text-yellow-300 text-xs mt-2" data-testid="tap-earned">
+            Every tap earns points! +{earned.toLocaleString()} this visit
+          </p>
         </Card>
 
         {settings.tap_image_url && settings.tap_video_url && (
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { useAuth } from '../context/AuthContext';
 import apiClient from '../utils/api';
 import { Button } from '../components/ui/button';
 import { Card } from '../components/ui/card';
@@ -8,12 +9,14 @@ import { ArrowLeft, Gift, CheckCircle, ExternalLink } from 'lucide-react';
 
 const Tasks = () => {
   const navigate = useNavigate();
+  const { takeStartupData } = useAuth();
   const [tasks, setTasks] = useState([]);
   const [loading, setLoading] = useState(false);
   const [clickedLinks, setClickedLinks] = useState(new Set());
 
   useEffect(() => {
-    fetchTasks();
+    const startupTasks = takeStartupData('tasks');
+    if (startupTasks) setTasks(startupTasks); else fetchTasks();
   }, []);
 
   const fetchTasks = async () => {
@@ -10,20 +10,22 @@ import { ArrowLeft, DollarSign, Clock, CheckCircle, XCircle, AlertCircle } from
 
 const Withdrawal = () => {
   const navigate = useNavigate();
-  const { user } = useAuth();
+  const { user, refreshUser } = useAuth();
   const [amount, setAmount] = useState('');
   const [loading, setLoading] = useState(false);
   const [requests, setRequests] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [withdrawalEnabled, setWithdrawalEnabled] = useState(false);
 
   useEffect(() => {
     fetchRequests();
   }, []);
 
-  const fetchRequests = async () => {
+  const fetchRequests = async (cursor = null) => {
     try {
-      const response = await apiClient.get('/withdrawal/my-requests');
-      setRequests(response.data);
+      const response = await apiClient.get('/withdrawal/my-requests', { params: cursor ? { cursor } : {} });
+      setRequests(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to fetch withdrawal requests:', error);
     }
@@ -54,6 +56,8 @@ const Withdrawal = () => {
       toast.success('✅ Withdrawal request submitted!');
       setAmount('');
       fetchRequests();
+      // Requested points are reserved immediately
+      refreshUser();
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Failed to submit request');
     } finally {
@@ -147,6 +151,15 @@ const Withdrawal = () => {
                 </div>
               ))
             )}
+            {nextCursor && (
+              <Button
+                onClick={() => fetchRequests(nextCursor)}
+                variant="ghost"
+                className="w-full text-white/80 hover:text-white hover:bg-white/10"
+              >
+                Load more
+              </Button>
+            )}
           </div>
         </Card>
       </div>
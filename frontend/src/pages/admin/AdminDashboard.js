@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import AdminLayout from '../../components/AdminLayout';
-import apiClient from '../../utils/api';
+import apiClient, { openAdminStream } from '../../utils/api';
 import { Card } from '../../components/ui/card';
 import { Button } from '../../components/ui/button';
 import { Users, DollarSign, Gift, TrendingUp, CheckCircle, UserPlus, Clock, Award, RefreshCw, Activity } from 'lucide-react';
@@ -32,17 +32,53 @@ const AdminDashboard = () => {
 
   useEffect(() => {
     fetchData();
-    // Auto-refresh every 30 seconds
-    const interval = setInterval(() => fetchData(false), 30000);
-    return () => clearInterval(interval);
+    // Live updates are pushed by the server instead of polling
+    const source = openAdminStream();
+    let reconnecting = false;
+    const touch = () => setLastUpdated(new Date());
+
+    source.addEventListener('snapshot', (e) => {
+      setStats(JSON.parse(e.data));
+      touch();
+    });
+    source.addEventListener('stats', (e) => {
+      const { deltas = {}, totals = {} } = JSON.parse(e.data);
+      setStats(prev => {
+        const next = { ...prev, ...totals };
+        Object.entries(deltas).forEach(([field, delta]) => {
+          next[field] = (next[field] || 0) + delta;
+        });
+        return next;
+      });
+      touch();
+    });
+    source.addEventListener('activity', (e) => {
+      const activity = JSON.parse(e.data);
+      setActivities(prev => [activity, ...prev].slice(0, 30));
+      touch();
+    });
+    // Fell too far behind: reload once over REST
+    source.addEventListener('resync', () => fetchData(false));
+    source.onerror = () => { reconnecting = true; };
+    source.onopen = () => {
+      // Events sent while disconnected are lost; catch up after reconnecting
+      if (reconnecting) fetchData(false);
+      reconnecting = false;
+    };
+
+    return () => source.close();
   }, [fetchData]);
 
   const getActivityIcon = (type) => {
     switch (type) {
       case 'user_joined': return <UserPlus size={16} className="text-green-500" />;
       case 'task_completed': return <CheckCircle size={16} className="text-blue-500" />;
-      case 'withdrawal': return <DollarSign size={16} className="text-orange-500" />;
+      case 'withdrawal':
+      case 'withdrawal_approved':
+      case 'withdrawal_rejected': return <DollarSign size={16} className="text-orange-500" />;
       case 'checkin': return <Clock size={16} className="text-purple-500" />;
+      case 'join_bonus': return <Gift size={16} className="text-pink-500" />;
+      case 'referral_reward': return <Award size={16} className="text-yellow-500" />;
       default: return <Activity size={16} className="text-gray-500" />;
     }
   };
@@ -51,8 +87,12 @@ const AdminDashboard = () => {
     switch (type) {
       case 'user_joined': return 'border-l-green-500 bg-green-50';
       case 'task_completed': return 'border-l-blue-500 bg-blue-50';
-      case 'withdrawal': return 'border-l-orange-500 bg-orange-50';
+      case 'withdrawal':
+      case 'withdrawal_approved':
+      case 'withdrawal_rejected': return 'border-l-orange-500 bg-orange-50';
       case 'checkin': return 'border-l-purple-500 bg-purple-50';
+      case 'join_bonus': return 'border-l-pink-500 bg-pink-50';
+      case 'referral_reward': return 'border-l-yellow-500 bg-yellow-50';
       default: return 'border-l-gray-500 bg-gray-50';
     }
   };
@@ -192,8 +232,12 @@ const AdminDashboard = () => {
                           <p className="text-sm font-medium text-gray-800">{activity.description}</p>
                           <div className="flex items-center gap-2 mt-1">
                             <span className="text-xs text-gray-500">{formatTime(activity.timestamp)}</span>
-                            <span className="text-xs text-gray-400">•</span>
-                            <span className="text-xs text-gray-500">ID: {activity.telegram_id}</span>
+                            {activity.telegram_id && (
+                              <>
+                                <span className="text-xs text-gray-400">•</span>
+                                <span className="text-xs text-gray-500">ID: {activity.telegram_id}</span>
+                              </>
+                            )}
                           </div>
                         </div>
                       </div>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import AdminLayout from '../../components/AdminLayout';
 import apiClient from '../../utils/api';
 import { Card } from '../../components/ui/card';
@@ -10,8 +10,13 @@ import { Users, Edit, Eye, Search, RefreshCw, CheckCircle, DollarSign, Gift, Use
 
 const AdminUsers = () => {
   const [users, setUsers] = useState([]);
-  const [filteredUsers, setFilteredUsers] = useState([]);
+  const [searchResults, setSearchResults] = useState([]);
+  const [searchCursor, setSearchCursor] = useState(null);
+  const [searching, setSearching] = useState(false);
+  const latestQuery = useRef('');
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [refreshing, setRefreshing] = useState(false);
   const [editingUser, setEditingUser] = useState(null);
   const [pointsAdjust, setPointsAdjust] = useState('');
@@ -24,24 +29,46 @@ const AdminUsers = () => {
     fetchUsers();
   }, []);
 
+  // Search runs on the server over all users; debounce keystrokes
   useEffect(() => {
-    if (searchQuery.trim()) {
-      const filtered = users.filter(user => 
-        user.username?.toLowerCase().includes(searchQuery.toLowerCase()) ||
-        user.telegram_id?.toString().includes(searchQuery)
-      );
-      setFilteredUsers(filtered);
-    } else {
-      setFilteredUsers(users);
+    const query = searchQuery.trim();
+    latestQuery.current = query;
+    if (!query) {
+      setSearchResults([]);
+      setSearchCursor(null);
+      return;
     }
-  }, [searchQuery, users]);
+    const timer = setTimeout(() => searchUsers(query), 250);
+    return () => clearTimeout(timer);
+  }, [searchQuery]);
+
+  const searchUsers = async (query, cursor = null) => {
+    setSearching(true);
+    try {
+      const response = await apiClient.get('/admin/users/search', { params: { q: query, cursor } });
+      // Ignore responses for a query the admin has already changed
+      if (latestQuery.current !== query) return;
+      setSearchResults(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setSearchCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Failed to search users:', error);
+      toast.error('Failed to search users');
+    } finally {
+      setSearching(false);
+    }
+  };
+
+  const isSearching = searchQuery.trim() !== '';
+  const displayedUsers = isSearching ? searchResults : users;
+  const displayedCursor = isSearching ? searchCursor : nextCursor;
+  const loadMore = () => (isSearching ? searchUsers(searchQuery.trim(), searchCursor) : fetchMoreUsers());
 
   const fetchUsers = async (isRefresh = false) => {
     if (isRefresh) setRefreshing(true);
     try {
       const response = await apiClient.get('/admin/users');
-      setUsers(response.data);
-      setFilteredUsers(response.data);
+      setUsers(response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to fetch users:', error);
       toast.error('Failed to fetch users');
@@ -51,6 +78,20 @@ const AdminUsers = () => {
     }
   };
 
+  const fetchMoreUsers = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await apiClient.get('/admin/users', { params: { cursor: nextCursor } });
+      setUsers(prev => [...prev, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Failed to fetch users:', error);
+      toast.error('Failed to fetch users');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const fetchUserDetails = async (telegram_id) => {
     setDetailsLoading(true);
     try {
@@ -116,7 +157,7 @@ const AdminUsers = () => {
             <Users size={32} className="text-blue-600" />
             <div>
               <h1 className="text-3xl font-bold">Users Management</h1>
-              <p className="text-gray-500 text-sm">{users.length} total users</p>
+              <p className="text-gray-500 text-sm">{users.length} users loaded</p>
             </div>
           </div>
           <Button 
@@ -151,7 +192,7 @@ const AdminUsers = () => {
           </div>
           {searchQuery && (
             <p className="text-sm text-gray-500 mt-2">
-              Found {filteredUsers.length} user(s)
+              {searching ? 'Searching...' : `Found ${searchResults.length}${searchCursor ? '+' : ''} user(s)`}
             </p>
           )}
         </div>
@@ -177,7 +218,7 @@ const AdminUsers = () => {
                   </tr>
                 </thead>
                 <tbody className="divide-y divide-gray-200">
-                  {filteredUsers.map((user) => (
+                  {displayedUsers.map((user) => (
                     <tr key={user.telegram_id} className="hover:bg-gray-50 transition-colors">
                       <td className="px-6 py-4 whitespace-nowrap">
                         <div className="font-medium text-blue-600">@{user.username}</div>
@@ -251,6 +292,13 @@ const AdminUsers = () => {
                 </tbody>
               </table>
             </div>
+            {displayedCursor && (
+              <div className="p-4 text-center border-t">
+                <Button onClick={loadMore} disabled={loadingMore || searching} variant="outline">
+                  {loadingMore || searching ? 'Loading...' : 'Load more'}
+                </Button>
+              </div>
+            )}
           </Card>
         )}
 
@@ -338,8 +386,13 @@ const AdminUsers = () => {
                 {/* Referred Users */}
                 <div>
                   <h4 className="font-bold text-lg mb-3 flex items-center gap-2">
-                    <UserPlus size={20} className="text-purple-500" /> Users Referred ({userDetails.referred_users?.length || 0})
+                    <UserPlus size={20} className="text-purple-500" /> Users Referred ({userDetails.total_referred_users ?? userDetails.referred_users?.length ?? 0})
                   </h4>
+                  <p className="text-xs text-gray-500 mb-2">
+                    Network: {userDetails.user.referral_network || 0} users
+                    {' · '}Indirect: {(userDetails.user.referral_network || 0) - (userDetails.user.referral_levels?.['1'] || 0)}
+                    {' · '}Depth: {userDetails.user.referral_depth || 0}
+                  </p>
                   {userDetails.referred_users?.length > 0 ? (
                     <div className="space-y-2 max-h-40 overflow-y-auto">
                       {userDetails.referred_users.map((refUser, idx) => (
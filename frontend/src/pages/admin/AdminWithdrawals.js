@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import AdminLayout from '../../components/AdminLayout';
-import apiClient from '../../utils/api';
+import apiClient, { openAdminStream } from '../../utils/api';
 import { Card } from '../../components/ui/card';
 import { Button } from '../../components/ui/button';
 import { Textarea } from '../../components/ui/textarea';
@@ -10,23 +10,44 @@ import { DollarSign, CheckCircle, XCircle } from 'lucide-react';
 
 const AdminWithdrawals = () => {
   const [withdrawals, setWithdrawals] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [rejectDialogOpen, setRejectDialogOpen] = useState(false);
   const [selectedWithdrawal, setSelectedWithdrawal] = useState(null);
   const [rejectReason, setRejectReason] = useState('');
+  const [selectedIds, setSelectedIds] = useState([]);
+  const [bulkReject, setBulkReject] = useState(false);
+  const [processing, setProcessing] = useState(false);
 
   useEffect(() => {
     fetchWithdrawals();
+
+    const source = openAdminStream();
+    source.addEventListener('withdrawal', (e) => {
+      const change = JSON.parse(e.data);
+      setWithdrawals(prev => {
+        if (prev.some(w => w.withdrawal_id === change.withdrawal_id)) {
+          return prev.map(w => w.withdrawal_id === change.withdrawal_id ? { ...w, status: change.status } : w);
+        }
+        return change.status === 'pending' ? [change, ...prev] : prev;
+      });
+    });
+    source.addEventListener('resync', () => fetchWithdrawals());
+    return () => source.close();
   }, []);
 
-  const fetchWithdrawals = async () => {
+  const fetchWithdrawals = async (cursor = null) => {
+    if (cursor) setLoadingMore(true);
     try {
-      const response = await apiClient.get('/admin/withdrawals');
-      setWithdrawals(response.data);
+      const response = await apiClient.get('/admin/withdrawals', { params: cursor ? { cursor } : {} });
+      setWithdrawals(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to fetch withdrawals:', error);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -44,10 +65,58 @@ const AdminWithdrawals = () => {
 
   const openRejectDialog = (withdrawal) => {
     setSelectedWithdrawal(withdrawal);
+    setBulkReject(false);
+    setRejectDialogOpen(true);
+  };
+
+  const pendingIds = withdrawals.filter(w => w.status === 'pending').map(w => w.withdrawal_id);
+
+  const toggleSelected = (withdrawalId) => {
+    setSelectedIds(prev => prev.includes(withdrawalId)
+      ? prev.filter(id => id !== withdrawalId)
+      : [...prev, withdrawalId]);
+  };
+
+  // One request settles the whole selection; the server reports each item
+  const settleSelected = async (action, reason) => {
+    setProcessing(true);
+    try {
+      const response = await apiClient.post(`/admin/withdrawals/bulk-${action}`, {
+        withdrawal_ids: selectedIds,
+        ...(reason ? { reason } : {})
+      });
+      const summary = response.data.summary;
+      const done = summary[action === 'approve' ? 'approved' : 'rejected'] || 0;
+      const skipped = selectedIds.length - done;
+      toast.success(`${done} withdrawals ${action === 'approve' ? 'approved' : 'rejected'}` +
+        (skipped ? `, ${skipped} skipped` : ''));
+      setSelectedIds([]);
+      fetchWithdrawals();
+    } catch (error) {
+      toast.error(`Failed to ${action} withdrawals`);
+    } finally {
+      setProcessing(false);
+    }
+  };
+
+  const approveSelected = () => {
+    if (!confirm(`Approve ${selectedIds.length} withdrawals?`)) return;
+    settleSelected('approve');
+  };
+
+  const openBulkRejectDialog = () => {
+    setSelectedWithdrawal(null);
+    setBulkReject(true);
     setRejectDialogOpen(true);
   };
 
   const rejectWithdrawal = async () => {
+    if (bulkReject) {
+      setRejectDialogOpen(false);
+      await settleSelected('reject', rejectReason || 'Rejected');
+      setRejectReason('');
+      return;
+    }
     if (!selectedWithdrawal) return;
 
     try {
@@ -72,6 +141,37 @@ const AdminWithdrawals = () => {
           <h1 className="text-3xl font-bold">Withdrawal Management</h1>
         </div>
 
+        {pendingIds.length > 0 && (
+          <Card className="p-4 mb-4 flex flex-wrap items-center gap-3">
+            <label className="flex items-center gap-2 text-sm font-medium">
+              <input
+                type="checkbox"
+                checked={pendingIds.every(id => selectedIds.includes(id))}
+                onChange={(e) => setSelectedIds(e.target.checked ? pendingIds : [])}
+                data-testid="select-all-pending"
+              />
+              Select all pending ({pendingIds.length})
+            </label>
+            <span className="text-sm text-gray-500">{selectedIds.length} selected</span>
+            <div className="flex gap-2 ml-auto">
+              <Button
+                onClick={approveSelected}
+                disabled={selectedIds.length === 0 || processing}
+                className="bg-green-600 hover:bg-green-700"
+              >
+                <CheckCircle size={16} className="mr-2" /> Approve selected
+              </Button>
+              <Button
+                onClick={openBulkRejectDialog}
+                disabled={selectedIds.length === 0 || processing}
+                variant="destructive"
+              >
+                <XCircle size={16} className="mr-2" /> Reject selected
+              </Button>
+            </div>
+          </Card>
+        )}
+
         {loading ? (
           <div className="text-center py-12">Loading...</div>
         ) : (
@@ -86,6 +186,13 @@ const AdminWithdrawals = () => {
                   <div className="flex items-start justify-between">
                     <div>
                       <div className="flex items-center gap-3 mb-2">
+                        {withdrawal.status === 'pending' && (
+                          <input
+                            type="checkbox"
+                            checked={selectedIds.includes(withdrawal.withdrawal_id)}
+                            onChange={() => toggleSelected(withdrawal.withdrawal_id)}
+                          />
+                        )}
                         <h3 className="text-xl font-bold">@{withdrawal.username}</h3>
                         <StatusBadge status={withdrawal.status} />
                       </div>
@@ -120,13 +227,22 @@ const AdminWithdrawals = () => {
                 </Card>
               ))
             )}
+            {nextCursor && (
+              <div className="text-center">
+                <Button onClick={() => fetchWithdrawals(nextCursor)} disabled={loadingMore} variant="outline">
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </Button>
+              </div>
+            )}
           </div>
         )}
 
         <Dialog open={rejectDialogOpen} onOpenChange={setRejectDialogOpen}>
           <DialogContent>
             <DialogHeader>
-              <DialogTitle>Reject Withdrawal</DialogTitle>
+              <DialogTitle>
+                {bulkReject ? `Reject ${selectedIds.length} Withdrawals` : 'Reject Withdrawal'}
+              </DialogTitle>
             </DialogHeader>
             <div className="space-y-4 mt-4">
               <div>
@@ -28,6 +28,60 @@ apiClient.interceptors.request.use(
   }
 );
 
+// Live admin updates over Server-Sent Events. EventSource cannot set an
+// Authorization header, so each connection presents a single-use ticket
+// fetched with the token; the JWT itself never appears in a URL. Returns an
+// EventSource-like object that reconnects with a fresh ticket on errors.
+const STREAM_RETRY_MS = 3000;
+
+export const openAdminStream = () => {
+  const listeners = [];
+  let source = null;
+  let retry = null;
+  let closed = false;
+
+  const stream = {
+    onopen: null,
+    onerror: null,
+    addEventListener: (type, listener) => {
+      listeners.push([type, listener]);
+      if (source) source.addEventListener(type, listener);
+    },
+    close: () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    },
+  };
+
+  const reconnect = (event) => {
+    if (source) source.close();
+    source = null;
+    if (stream.onerror) stream.onerror(event);
+    if (!closed) retry = setTimeout(connect, STREAM_RETRY_MS);
+  };
+
+  const connect = async () => {
+    let ticket;
+    try {
+      const response = await apiClient.post('/admin/stream/ticket');
+      ticket = response.data.ticket;
+    } catch (error) {
+      reconnect(error);
+      return;
+    }
+    if (closed) return;
+    source = new EventSource(`${API}/admin/stream?ticket=${encodeURIComponent(ticket)}`);
+    listeners.forEach(([type, listener]) => source.addEventListener(type, listener));
+    source.onopen = (event) => { if (stream.onopen) stream.onopen(event); };
+    // The browser would retry with the same, already used ticket
+    source.onerror = reconnect;
+  };
+
+  connect();
+  return stream;
+};
+
 // Handle auth errors
 apiClient.interceptors.response.use(
   (response) => response,
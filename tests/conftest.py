@@ -0,0 +1,171 @@
+"""Fixtures running the backend against an in-memory mongomock database.
+
+The backend modules import each other by top-level name, so ``backend/`` is
+put on the path, and the settings they read at import time get test values.
+``FakeDatabase`` gives mongomock the awaitable surface Motor has.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import mongomock
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:1')
+os.environ.setdefault('DB_NAME', 'test')
+os.environ.setdefault('JWT_SECRET', 'test-secret')
+
+
+class FakeCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    def skip(self, count):
+        self._cursor = self._cursor.skip(count)
+        return self
+
+    def batch_size(self, count):
+        return self
+
+    async def to_list(self, length=None):
+        docs = list(self._cursor)
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._cursor:
+            yield doc
+            await asyncio.sleep(0)
+
+
+class FakeCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return FakeCursor(self._collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeCursor(iter(list(self._collection.aggregate(pipeline))))
+
+    async def _find_and_modify(self, method, filter, *args, sort=None, upsert=False, **kwargs):
+        # mongomock re-reads an AFTER image with the original filter, which a guarded
+        # update no longer matches; pin the document by _id first, as the server would
+        current = self._collection.find_one(filter, {"_id": 1}, sort=sort)
+        if current is not None:
+            filter = {"_id": current["_id"]}
+        elif not upsert:
+            return None
+        if upsert:
+            kwargs['upsert'] = True
+        return getattr(self._collection, method)(filter, *args, **kwargs)
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return await self._find_and_modify("find_one_and_update", filter, update, **kwargs)
+
+    async def find_one_and_delete(self, filter, **kwargs):
+        return await self._find_and_modify("find_one_and_delete", filter, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.sync = mongomock.MongoClient(tz_aware=True)["test"]
+
+    def __getitem__(self, name):
+        return FakeCollection(self.sync[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return FakeCollection(self.sync[name])
+
+    async def create_collection(self, name, **kwargs):
+        self.sync.create_collection(name)
+
+    async def command(self, *args, **kwargs):
+        return self.sync.command(*args, **kwargs)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh database wired into every module that holds one"""
+    import indexes
+    import repository
+    import server
+
+    fake = FakeDatabase()
+    monkeypatch.setattr(repository, 'db', fake)
+    monkeypatch.setattr(server, 'db', fake)
+    monkeypatch.setattr(server.tap_accumulator, 'db', fake)
+    run(indexes.ensure_indexes(fake))
+    return fake
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    """The API without its startup hooks, with empty rate limit buckets"""
+    import ratelimit
+    import server
+
+    monkeypatch.setattr(server.app.router, 'on_startup', [])
+    monkeypatch.setattr(server.app.router, 'on_shutdown', [])
+    monkeypatch.setattr(server, 'limiter', ratelimit.Limiter(ratelimit.LocalBuckets()))
+    return server.app
+
+
+def add_user(db, telegram_id, **fields):
+    """Create a user the way /auth/telegram does, then set ``fields`` on it"""
+    import repository
+
+    run(repository.get_or_create_user(telegram_id, f"user{telegram_id}"))
+    if fields:
+        db.sync.users.update_one({"telegram_id": telegram_id}, {"$set": fields})
+
+
+def user_headers(telegram_id, username="tester"):
+    import server
+
+    token = server.create_jwt_token({"telegram_id": telegram_id, "username": username})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def admin_headers():
+    import server
+
+    token = server.create_jwt_token({"username": "admin", "is_admin": True})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def post_twice(app, path, headers, **kwargs):
+    """Send the same request twice at once; returns both responses"""
+    import httpx
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        return await asyncio.gather(
+            client.post(path, headers=headers, **kwargs),
+            client.post(path, headers=headers, **kwargs),
+        )
@@ -0,0 +1,45 @@
+"""Exports: formula-like cells are neutralised in CSV and left alone in NDJSON"""
+import csv
+import io
+import json
+
+from .conftest import run
+
+
+def export(db, fmt):
+    import exports
+
+    async def collect():
+        return b"".join([chunk async for chunk in exports.stream_export(db, "withdrawals", fmt, {})]).decode()
+
+    return collect()
+
+
+def seed(db):
+    db.sync.withdrawals.insert_many([
+        {"withdrawal_id": "w1", "user_id": 1, "username": "=HYPERLINK(\"http://x\")", "amount": 10,
+         "status": "rejected", "timestamp": "2026-01-01T00:00:00+00:00", "admin_note": "@SUM(A1:A2)"},
+        {"withdrawal_id": "w2", "user_id": 2, "username": "+1-2", "amount": -5,
+         "status": "pending", "timestamp": "2026-01-02T00:00:00+00:00", "admin_note": "-3"},
+        {"withdrawal_id": "w3", "user_id": 3, "username": "plain", "amount": 7,
+         "status": "pending", "timestamp": "2026-01-03T00:00:00+00:00"},
+    ])
+
+
+def test_csv_escapes_formula_cells(db):
+    seed(db)
+    rows = list(csv.DictReader(io.StringIO(run(export(db, "csv")))))
+    assert [(r['username'], r['admin_note']) for r in rows] == [
+        ("'=HYPERLINK(\"http://x\")", "'@SUM(A1:A2)"),
+        ("'+1-2", "'-3"),
+        ("plain", ""),
+    ]
+    # Numbers are not text a spreadsheet would evaluate
+    assert rows[1]['amount'] == "-5"
+
+
+def test_ndjson_keeps_values_as_stored(db):
+    seed(db)
+    rows = [json.loads(line) for line in run(export(db, "ndjson")).splitlines()]
+    assert rows[0]['username'] == "=HYPERLINK(\"http://x\")"
+    assert rows[1]['admin_note'] == "-3"
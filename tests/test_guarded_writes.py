@@ -0,0 +1,90 @@
+"""One-shot rewards: a repeated request must lose to the guard in the write itself"""
+import pytest
+
+from .conftest import FakeDatabase, add_user, post_twice, run, user_headers
+
+
+def points_of(db, telegram_id):
+    return db.sync.users.find_one({"telegram_id": telegram_id})['points']
+
+
+def statuses(responses):
+    return sorted(r.status_code for r in responses)
+
+
+def test_join_bonus_is_awarded_once(app, db):
+    add_user(db, 1)
+    responses = run(post_twice(app, "/api/user/claim-join-bonus", user_headers(1)))
+    assert statuses(responses) == [200, 400]
+    assert points_of(db, 1) == 1200
+
+
+def test_checkin_is_awarded_once_a_day(app, db):
+    add_user(db, 2)
+    responses = run(post_twice(app, "/api/user/checkin", user_headers(2)))
+    assert statuses(responses) == [200, 400]
+    assert points_of(db, 2) == 100
+    assert "Already checked in" in next(r for r in responses if r.status_code == 400).json()['detail']
+
+
+def test_task_completion_is_awarded_once(app, db):
+    add_user(db, 3)
+    db.sync.tasks.insert_one({"task_id": "t1", "title": "Follow", "reward_points": 250, "active": True})
+    responses = run(post_twice(app, "/api/tasks/complete", user_headers(3), json={"task_id": "t1"}))
+    assert statuses(responses) == [200, 400]
+    assert points_of(db, 3) == 250
+    assert db.sync.task_completions.count_documents({"user_id": 3}) == 1
+
+
+@pytest.mark.parametrize("path", ["/api/user/claim-join-bonus", "/api/user/checkin"])
+def test_deleted_user_gets_404(app, db, path):
+    # A valid token for a user that no longer exists
+    responses = run(post_twice(app, path, user_headers(4)))
+    assert statuses(responses) == [404, 404]
+    assert db.sync.users.count_documents({}) == 0
+
+
+def test_deleted_user_leaves_no_task_completion(app, db):
+    db.sync.tasks.insert_one({"task_id": "t1", "title": "Follow", "reward_points": 250, "active": True})
+    responses = run(post_twice(app, "/api/tasks/complete", user_headers(5), json={"task_id": "t1"}))
+    assert 404 in statuses(responses)
+    assert db.sync.task_completions.count_documents({}) == 0
+
+
+def test_duplicate_completions_stop_startup(monkeypatch):
+    import indexes
+    import server
+
+    fake = FakeDatabase()
+    fake.sync.task_completions.insert_many([
+        {"user_id": 7, "task_id": "t1"},
+        {"user_id": 7, "task_id": "t1"},
+        {"user_id": 8, "task_id": "t1"},
+    ])
+    monkeypatch.setattr(server, 'db', fake)
+    with pytest.raises(indexes.MissingGuardIndex) as raised:
+        run(server.start_background_services())
+    message = str(raised.value)
+    assert "task_completions.user_task_unique" in message
+    assert "user_id=7, task_id='t1', count=2" in message
+    assert "user_id=8" not in message
+
+
+@pytest.mark.parametrize("collection, index, rows, listed", [
+    ("users", "telegram_id_unique",
+     [{"telegram_id": 5}, {"telegram_id": 5}, {"telegram_id": 6}], "telegram_id=5, count=2"),
+    ("withdrawals", "withdrawal_id_unique",
+     [{"withdrawal_id": "w1"}, {"withdrawal_id": "w1"}, {"withdrawal_id": "w2"}], "withdrawal_id='w1', count=2"),
+])
+def test_duplicate_ids_stop_startup(monkeypatch, collection, index, rows, listed):
+    import indexes
+    import server
+
+    fake = FakeDatabase()
+    fake.sync[collection].insert_many(rows)
+    monkeypatch.setattr(server, 'db', fake)
+    with pytest.raises(indexes.MissingGuardIndex) as raised:
+        run(server.start_background_services())
+    message = str(raised.value)
+    assert f"{collection}.{index}" in message
+    assert listed in message
@@ -0,0 +1,89 @@
+"""rank_of against the true leaderboard order, counted and estimated"""
+import random
+
+import pytest
+
+from .conftest import run
+
+
+def seed(db, rows):
+    """Insert (telegram_id, points) rows and the histogram they imply"""
+    import counters
+
+    db.sync.users.insert_many([{"telegram_id": t, "username": f"user{t}", "points": p} for t, p in rows])
+    histogram = {}
+    for _, points in rows:
+        field = counters.bucket_field(points)
+        histogram[field] = histogram.get(field, 0) + 1
+    db.sync.counters.insert_one({"_id": counters.HISTOGRAM_KEY, **histogram})
+
+
+def true_ranks(rows):
+    ordered = sorted(rows, key=lambda row: (-row[1], row[0]))
+    return {telegram_id: rank for rank, (telegram_id, _) in enumerate(ordered, 1)}
+
+
+def population(size=1500, seed_value=7):
+    rng = random.Random(seed_value)
+    choices = [0] * 40 + [-25, -300] + list(range(1, 5000))
+    return [(telegram_id, rng.choice(choices)) for telegram_id in range(1, size + 1)]
+
+
+def rank(db, telegram_id, points):
+    from leaderboard import rank_of
+
+    return run(rank_of(db, telegram_id, points))
+
+
+def test_small_buckets_are_counted_exactly(db):
+    rows = population()
+    seed(db, rows)
+    expected = true_ranks(rows)
+    for telegram_id, points in random.Random(1).sample(rows, 100):
+        assert rank(db, telegram_id, points) == (expected[telegram_id], len(rows), True)
+
+
+def test_large_buckets_are_estimated_close_to_the_true_rank(db, monkeypatch):
+    import leaderboard
+
+    monkeypatch.setattr(leaderboard, 'RANK_EXACT_BUCKET_MAX', 5)
+    rows = population()
+    seed(db, rows)
+    expected = true_ranks(rows)
+    estimated = 0
+    for telegram_id, points in random.Random(2).sample(rows, 200):
+        position, total, exact = rank(db, telegram_id, points)
+        assert total == len(rows)
+        assert abs(position - expected[telegram_id]) <= 0.05 * len(rows)
+        estimated += not exact
+    assert estimated > 150
+
+
+def test_zero_points_share_the_top_of_their_tie_group(db, monkeypatch):
+    import leaderboard
+
+    monkeypatch.setattr(leaderboard, 'RANK_EXACT_BUCKET_MAX', 2)
+    rows = [(1, 50), (2, 0), (3, 0), (4, 0), (5, -10)]
+    seed(db, rows)
+    assert [rank(db, t, 0)[0] for t in (2, 3, 4)] == [2, 2, 2]
+
+
+def test_negative_balances_rank_below_zero(db, monkeypatch):
+    import leaderboard
+
+    # Bucket 0 is far over the limit, so zero balances are estimated
+    monkeypatch.setattr(leaderboard, 'RANK_EXACT_BUCKET_MAX', 3)
+    rows = [(1, 10)] + [(t, 0) for t in range(2, 12)] + [(12, -5), (13, -5), (14, -40)]
+    seed(db, rows)
+    assert rank(db, 12, -5) == (12, 14, True)
+    assert rank(db, 13, -5) == (13, 14, True)
+    assert rank(db, 14, -40) == (14, 14, True)
+    assert rank(db, 2, 0)[0] < rank(db, 12, -5)[0]
+
+
+@pytest.mark.parametrize("points", [0, 1, 7, 8, 15, 16, 100, 1023, 1024, 10 ** 6])
+def test_points_fall_inside_their_bucket(points):
+    import counters
+
+    lower, upper = counters.points_bucket(points)
+    assert lower <= points < upper
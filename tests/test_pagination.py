@@ -0,0 +1,104 @@
+"""Keyset cursors: every item exactly once, and nothing but sort key values in a query"""
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from .conftest import admin_headers, run, user_headers
+
+
+def raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+async def get(app, path, headers, **params):
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        return await client.get(path, headers=headers, params=params)
+
+
+def add_users(db, count):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db.sync.users.insert_many([
+        # Pairs share a join_date, so pages must split ties on telegram_id
+        {"telegram_id": i, "username": f"user{i}", "points": 0,
+         "join_date": (start + timedelta(minutes=i // 2)).isoformat()}
+        for i in range(1, count + 1)
+    ])
+
+
+def test_cursor_round_trip():
+    import pagination
+
+    cursor = pagination.encode_cursor(["2026-01-01T00:00:00+00:00", 42])
+    assert pagination.decode_cursor(cursor, (pagination.iso_date, pagination.integer)) == \
+        ["2026-01-01T00:00:00+00:00", 42]
+
+
+@pytest.mark.parametrize("values", [
+    [{"$gt": ""}, 1],
+    ["2026-01-01T00:00:00+00:00", {"$gt": 0}],
+    ["not a date", 1],
+    ["2026-01-01T00:00:00+00:00", "1"],
+    ["2026-01-01T00:00:00+00:00", True],
+    ["2026-01-01T00:00:00+00:00"],
+    {"join_date": "2026-01-01T00:00:00+00:00"},
+])
+def test_decode_rejects_unexpected_values(values):
+    import pagination
+
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(raw_cursor(values), (pagination.iso_date, pagination.integer))
+
+
+def test_decode_rejects_garbage():
+    import pagination
+
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor("%%%not-base64", (pagination.iso_date, pagination.integer))
+
+
+def test_users_pages_cover_every_user_once(app, db):
+    add_users(db, 25)
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+        body = run(get(app, "/api/admin/users", admin_headers(), **params)).json()
+        seen += [user['telegram_id'] for user in body['items']]
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == sorted(range(1, 26), reverse=True)
+
+
+def test_my_withdrawals_pages_stay_with_the_caller(app, db):
+    db.sync.withdrawals.insert_many([
+        {"withdrawal_id": f"w{i:02d}", "user_id": 1 + i % 2, "amount": 10, "status": "pending",
+         "timestamp": "2026-01-01T00:00:00+00:00"}
+        for i in range(10)
+    ])
+    first = run(get(app, "/api/withdrawal/my-requests", user_headers(1), limit=3)).json()
+    second = run(get(app, "/api/withdrawal/my-requests", user_headers(1), limit=3,
+                     cursor=first['next_cursor'])).json()
+    ids = [w['withdrawal_id'] for w in first['items'] + second['items']]
+    assert ids == ["w08", "w06", "w04", "w02", "w00"]
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize("path, headers, values", [
+    ("/api/admin/users", admin_headers, [{"$gt": ""}, 0]),
+    ("/api/admin/users", admin_headers, ["2026-01-01T00:00:00+00:00", {"$gt": 0}]),
+    ("/api/withdrawal/my-requests", lambda: user_headers(1), [{"$ne": None}, "w1"]),
+    ("/api/admin/withdrawals", admin_headers, ["2026-01-01T00:00:00+00:00", {"$regex": "."}]),
+])
+def test_operator_cursors_are_rejected(app, db, path, headers, values):
+    add_users(db, 3)
+    response = run(get(app, path, headers(), cursor=raw_cursor(values)))
+    assert response.status_code == 400
+
+
+def test_search_cursor_is_checked(app, db):
+    response = run(get(app, "/api/admin/users/search", admin_headers(), q="user",
+                       cursor=raw_cursor(["prefix", {"$gt": ""}, 0])))
+    assert response.status_code == 400
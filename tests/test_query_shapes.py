@@ -0,0 +1,44 @@
+"""Every declared query shape is planned on an index by a real mongod.
+
+mongomock has no query planner, so this runs against ``MONGO_TEST_URL``
+(default ``mongodb://localhost:27017``) in a throwaway database, and is
+skipped when no server answers.
+"""
+import os
+import uuid
+
+import pytest
+
+from .conftest import run
+
+MONGO_TEST_URL = os.environ.get('MONGO_TEST_URL', 'mongodb://localhost:27017')
+
+
+async def explain_on_fresh_database():
+    """COLLSCAN failures in an indexed, empty database; None when there is no server"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo.errors import ServerSelectionTimeoutError
+
+    import indexes
+
+    client = AsyncIOMotorClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1500)
+    try:
+        await client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        client.close()
+        return None
+    name = f"test_query_shapes_{uuid.uuid4().hex[:8]}"
+    try:
+        db = client[name]
+        await indexes.ensure_indexes(db)
+        return await indexes.explain_query_shapes(db)
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def test_no_query_shape_needs_a_collection_scan():
+    failures = run(explain_on_fresh_database())
+    if failures is None:
+        pytest.skip(f"no mongod at {MONGO_TEST_URL}")
+    assert failures == []
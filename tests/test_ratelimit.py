@@ -0,0 +1,130 @@
+"""Token buckets and in-flight limits, with a controllable clock"""
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from .conftest import add_user, run, user_headers
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import ratelimit
+
+    clock = Clock()
+    # Only ratelimit's view of time; the event loop keeps the real clock
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+def acquire(buckets, key="checkin:1", capacity=5, period=60):
+    return run(buckets.acquire(key, capacity, period))
+
+
+def test_bucket_allows_a_burst_of_capacity(clock):
+    import ratelimit
+
+    buckets = ratelimit.LocalBuckets()
+    assert [acquire(buckets) for _ in range(5)] == [0.0] * 5
+    # Empty: one token comes back every period / capacity seconds
+    assert acquire(buckets) == pytest.approx(12.0)
+
+
+def test_bucket_refills_over_the_period(clock):
+    import ratelimit
+
+    buckets = ratelimit.LocalBuckets()
+    for _ in range(5):
+        acquire(buckets)
+    clock.now += 12
+    assert acquire(buckets) == 0.0
+    assert acquire(buckets) > 0
+    clock.now += 3600
+    assert [acquire(buckets) for _ in range(5)] == [0.0] * 5
+    assert acquire(buckets) > 0
+
+
+def test_denied_requests_do_not_spend_tokens(clock):
+    import ratelimit
+
+    buckets = ratelimit.LocalBuckets()
+    for _ in range(5):
+        acquire(buckets)
+    for _ in range(10):
+        assert acquire(buckets) > 0
+    clock.now += 12
+    assert acquire(buckets) == 0.0
+
+
+def test_buckets_are_per_key(clock):
+    import ratelimit
+
+    buckets = ratelimit.LocalBuckets()
+    for _ in range(5):
+        acquire(buckets, "checkin:1")
+    assert acquire(buckets, "checkin:2") == 0.0
+    assert acquire(buckets, "tasks_complete:1", capacity=30) == 0.0
+
+
+def test_evicting_a_bucket_only_forgives(clock):
+    import ratelimit
+
+    buckets = ratelimit.LocalBuckets(maxsize=2)
+    for _ in range(5):
+        acquire(buckets, "checkin:1")
+    acquire(buckets, "checkin:2")
+    acquire(buckets, "checkin:3")
+    assert acquire(buckets, "checkin:1") == 0.0
+
+
+def test_limiter_rounds_retry_after_up(clock):
+    import ratelimit
+
+    limiter = ratelimit.Limiter(ratelimit.LocalBuckets())
+    capacity, _ = ratelimit.RATES["checkin"]
+    for _ in range(capacity):
+        assert run(limiter.check("checkin", 1)) == 0
+    retry_after = run(limiter.check("checkin", 1))
+    assert isinstance(retry_after, int) and retry_after >= 1
+    assert limiter.stats()['limited'] == 1
+
+
+def test_limiter_sheds_beyond_max_in_flight():
+    import ratelimit
+
+    limiter = ratelimit.Limiter(ratelimit.LocalBuckets(), max_in_flight=2)
+    assert limiter.enter("checkin") and limiter.enter("checkin")
+    assert not limiter.enter("checkin")
+    limiter.leave("checkin")
+    assert limiter.enter("checkin")
+    assert limiter.stats() == {"in_flight": {"checkin": 2}, "limited": 0, "shed": 1}
+
+
+def test_parse_rate():
+    import ratelimit
+
+    assert ratelimit.parse_rate("5/60") == (5, 60.0)
+
+
+def test_route_answers_429_with_retry_after(app, db, clock):
+    import ratelimit
+
+    add_user(db, 1)
+    capacity, _ = ratelimit.RATES["claim_join_bonus"]
+
+    async def claim_repeatedly():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return [await client.post("/api/user/claim-join-bonus", headers=user_headers(1))
+                    for _ in range(capacity + 1)]
+
+    responses = run(claim_repeatedly())
+    assert [r.status_code for r in responses] == [200] + [400] * (capacity - 1) + [429]
+    assert int(responses[-1].headers['Retry-After']) >= 1
@@ -0,0 +1,147 @@
+"""Withdrawal reservations: points leave the balance on request and come back on rejection"""
+import httpx
+
+from .conftest import add_user, admin_headers, post_twice, run, user_headers
+
+
+def balance(db, telegram_id):
+    user = db.sync.users.find_one({"telegram_id": telegram_id})
+    return user['points'], user.get('reserved_points', 0)
+
+
+def expected_counters(db):
+    """total_points, pending_withdrawals and the histogram, recomputed from the raw data"""
+    import counters
+
+    histogram = {}
+    for user in db.sync.users.find({}):
+        field = counters.bucket_field(user['points'])
+        histogram[field] = histogram.get(field, 0) + 1
+    return {
+        "total_points": sum(user['points'] for user in db.sync.users.find({})),
+        "pending_withdrawals": db.sync.withdrawals.count_documents({"status": "pending"}),
+        "histogram": histogram,
+    }
+
+
+def stored_counters(db):
+    import counters
+
+    totals = db.sync.counters.find_one({"_id": counters.GLOBAL_KEY})
+    histogram = db.sync.counters.find_one({"_id": counters.HISTOGRAM_KEY})
+    return {
+        "total_points": totals['total_points'],
+        "pending_withdrawals": totals['pending_withdrawals'],
+        "histogram": {field: count for field, count in histogram.items() if field != "_id" and count},
+    }
+
+
+def seed(db, telegram_id, points):
+    """One user, with counters that match the data (as ``counters.py rebuild`` leaves them)"""
+    import counters
+
+    add_user(db, telegram_id, points=points)
+    expected = expected_counters(db)
+    db.sync.counters.insert_many([
+        {"_id": counters.GLOBAL_KEY, "total_points": expected['total_points'], "pending_withdrawals": 0},
+        {"_id": counters.HISTOGRAM_KEY, **expected['histogram']},
+    ])
+
+
+def assert_counters_consistent(db):
+    assert stored_counters(db) == expected_counters(db)
+
+
+async def post(app, path, headers, **kwargs):
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        return await client.post(path, headers=headers, **kwargs)
+
+
+def request_withdrawal(app, db, telegram_id, amount):
+    response = run(post(app, "/api/withdrawal/request", user_headers(telegram_id), json={"amount": amount}))
+    assert response.status_code == 200
+    return db.sync.withdrawals.find_one({"user_id": telegram_id}, sort=[("timestamp", -1)])['withdrawal_id']
+
+
+def test_request_reserves_points(app, db):
+    seed(db, 1, 500)
+    request_withdrawal(app, db, 1, 200)
+    assert balance(db, 1) == (300, 200)
+    assert_counters_consistent(db)
+
+
+def test_insufficient_balance_leaves_points_unchanged(app, db):
+    seed(db, 2, 100)
+    response = run(post(app, "/api/withdrawal/request", user_headers(2), json={"amount": 101}))
+    assert response.status_code == 400
+    assert balance(db, 2) == (100, 0)
+    assert db.sync.withdrawals.count_documents({}) == 0
+    assert_counters_consistent(db)
+
+
+def test_concurrent_requests_cannot_overdraw(app, db):
+    seed(db, 3, 300)
+    responses = run(post_twice(app, "/api/withdrawal/request", user_headers(3), json={"amount": 200}))
+    assert sorted(r.status_code for r in responses) == [200, 400]
+    assert balance(db, 3) == (100, 200)
+    assert_counters_consistent(db)
+
+
+def test_reject_restores_balance(app, db):
+    seed(db, 4, 500)
+    withdrawal_id = request_withdrawal(app, db, 4, 200)
+    response = run(post(app, f"/api/admin/withdrawal/{withdrawal_id}/reject", admin_headers()))
+    assert response.status_code == 200
+    assert balance(db, 4) == (500, 0)
+    assert_counters_consistent(db)
+
+
+def test_approve_settles_reservation(app, db):
+    seed(db, 5, 500)
+    withdrawal_id = request_withdrawal(app, db, 5, 200)
+    response = run(post(app, f"/api/admin/withdrawal/{withdrawal_id}/approve", admin_headers()))
+    assert response.status_code == 200
+    assert balance(db, 5) == (300, 0)
+    assert_counters_consistent(db)
+
+
+def test_second_approval_is_a_no_op(app, db):
+    seed(db, 6, 500)
+    withdrawal_id = request_withdrawal(app, db, 6, 200)
+    responses = run(post_twice(app, f"/api/admin/withdrawal/{withdrawal_id}/approve", admin_headers()))
+    assert sorted(r.status_code for r in responses) == [200, 400]
+    assert balance(db, 6) == (300, 0)
+    assert_counters_consistent(db)
+
+
+def test_rejecting_an_approved_withdrawal_is_a_no_op(app, db):
+    seed(db, 7, 500)
+    withdrawal_id = request_withdrawal(app, db, 7, 200)
+    run(post(app, f"/api/admin/withdrawal/{withdrawal_id}/approve", admin_headers()))
+    response = run(post(app, f"/api/admin/withdrawal/{withdrawal_id}/reject", admin_headers()))
+    assert response.status_code == 400
+    assert db.sync.withdrawals.find_one({"withdrawal_id": withdrawal_id})['status'] == "approved"
+    assert balance(db, 7) == (300, 0)
+    assert_counters_consistent(db)
+
+
+def test_unknown_withdrawal_is_404(app, db):
+    response = run(post(app, "/api/admin/withdrawal/missing/approve", admin_headers()))
+    assert response.status_code == 404
+
+
+def test_bulk_settlement_matches_single_routes(app, db):
+    seed(db, 8, 1000)
+    approved = [request_withdrawal(app, db, 8, 100) for _ in range(2)]
+    rejected = [request_withdrawal(app, db, 8, 150) for _ in range(2)]
+    assert balance(db, 8) == (500, 500)
+
+    response = run(post(app, "/api/admin/withdrawals/bulk-approve", admin_headers(),
+                        json={"withdrawal_ids": approved + approved[:1]}))
+    assert response.json()['summary'] == {"approved": 2, "duplicate": 1}
+    response = run(post(app, "/api/admin/withdrawals/bulk-reject", admin_headers(),
+                        json={"withdrawal_ids": rejected + approved, "reason": "Spam"}))
+    assert response.json()['summary'] == {"rejected": 2, "already_processed": 2}
+
+    assert balance(db, 8) == (800, 0)
+    assert_counters_consistent(db)